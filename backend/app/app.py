@@ -10,9 +10,11 @@ from typing import List, Optional
 from urllib.parse import unquote_plus
 from uuid import UUID
 
-from app.contacts_dump import run_executive_assistant_to_get_drafts
+from app.contacts_dump import extract_people_with_context, summarize_and_draft_people
 from app.datashare import PersonDataEntry
+from app.delivery import DeliveryQueue
 from app.emails import (
+    dispatch_scheduled_emails,
     send_networking_per_person_result,
     send_result_no_people_found,
     send_result_rest_of_the_crowd,
@@ -22,8 +24,11 @@ from app.emails import (
 from app.food_dump import run_food_ingredient_extraction
 from app.form_library import FormName
 from app.gsheets import TEMPLATE_CONTACTS_SPREADSHEET_ID, GoogleClient
+from app.job import Job, Step
 from common.aws_utils import get_boto_s3_client, get_bucket_url
 from common.config import (
+    EMAIL_OUTBOX_DISPATCH_WINDOW_SECONDS,
+    EMAIL_OUTBOX_DRAIN_TIMEOUT_MARGIN_SECONDS,
     RESPONSE_EMAILS_WAIT_BETWEEN_EMAILS_SECONDS,
     SKIP_PROCESSED_DATA_ENTRIES,
     SKIP_SHARE_SPREADSHEET, POSTGRES_LOGIN_URL_FROM_ENV,
@@ -31,7 +36,12 @@ from common.config import (
 from gpt_form_filler.form import FormData
 from gpt_form_filler.openai_client import CHEAPEST_MODEL, OpenAiClient, BEST_MODEL
 
+from common.gpt_cache import flush_prompt_log_writes, prompt_cache_stats
 from common.gpt_client import open_ai_client_with_db_cache
+from common.gpt_utils import NO_AUDIO_TRANSCRIPT
+from common.prompt_cache_maintenance import run_prompt_cache_maintenance
+from common.storage_utils import STREAM_BUFFER_BYTES
+from common.tmp_storage import get_work_dir, invocation_work_dir
 from common.twillio_client import TwilioClient
 from database.account import Account
 from supawee.client import (
@@ -39,12 +49,13 @@ from supawee.client import (
     connect_to_postgres_i_will_call_disconnect_i_promise,
 )
 from database.data_entry import STATE_UPLOAD_PROCESSED, STATE_UPLOAD_TRANSCRIBED
-from database.email_log import EmailLog
+from database.email_log import EmailLog, utc_now
 from database.models import BaseAccount, BaseDataEntry
 from database.task import Task
 from input.app_upload import process_app_upload
 from input.call import process_voice_recording_input
 from input.email import process_email_input
+from input.ffmpeg_utils import ffmpeg_stream_convert_to_whisper_chunks, is_pipe_decodable
 
 s3 = get_boto_s3_client()
 
@@ -79,12 +90,16 @@ def wait_for_sms_email_update():
     #                 break
 
 
-def sync_form_datas_to_gsheets(account_id: uuid.UUID, form_datas: List[FormData]):
+# Pass a logged in `google_client` to re-use it across multiple calls.
+def sync_form_datas_to_gsheets(
+    account_id: uuid.UUID, form_datas: List[FormData], google_client: Optional[GoogleClient] = None
+):
     print(
         f"Gonna sync {len(form_datas)} FormDatas into GSheets for account {account_id}"
     )
-    google_client = GoogleClient()
-    google_client.login()
+    if google_client is None:
+        google_client = GoogleClient()
+        google_client.login()
 
     acc: Account = Account.get_by_id(account_id)
     if acc.gsheet_id is None:
@@ -152,86 +167,135 @@ def get_workflow_name(gpt_client: OpenAiClient, transcript: str) -> Optional[For
     # return default
 
 
+# `person_to_transcript` usually comes from the (parallel, checkpointed) extract_people step of the second lambda job.
+# Results are streamed: as soon as one person is summarized, its sheet row and email go out through a DeliveryQueue,
+# while the rest of the people are still being summarized.
 def process_networking_transcript(
     gpt_client: OpenAiClient,
     data_entry: BaseDataEntry,
+    person_to_transcript: Optional[dict] = None,
 ) -> List[PersonDataEntry]:
     # TODO: We should move task creation higher
-    task = Task.create_task(
+    # NOTE: A retry (e.g. after the Lambda timeout) continues the same task, and skips all the stages it has done.
+    task = Task.get_or_create_task(
         workflow_name=FormName.CONTACTS.value, data_entry_id=data_entry.id
     )
     # TODO(P1, devx): With gpt-form-filler migration, we lost the task_id setting. Would be nice to have it back.
     # gpt_client.set_task_id(task_id=task.id)
     # ===== Actually perform black magic
     # TODO(P1, feature): We should gather general context, e.g. try to infer the event type, the person's vibes, ...
-    people_entries = run_executive_assistant_to_get_drafts(
-        gpt_client, full_transcript=data_entry.output_transcript
-    )
+    if person_to_transcript is None:
+        person_to_transcript = task.run_once(
+            "people_extracted",
+            lambda: extract_people_with_context(gpt_client, data_entry.output_transcript),
+        )
 
-    # wait a bit more
-    if not wait_for_email_updated_on_data_entry(data_entry.id, max_wait_seconds=3 * 60):
-        raise ValueError(
-            f"email missing for data_entry {data_entry.id} - cannot process"
+    # Only touched from the delivery thread.
+    delivery_state = {
+        "data_entry": None,
+        "email_missing_error": None,
+        "google_client": None,
+        "next_email_not_before": None,
+    }
+    rest_of_the_crowd: List[PersonDataEntry] = []
+
+    def _get_data_entry_with_email() -> BaseDataEntry:
+        # We only wait once, as the DeliveryQueue goes on after errors and every person would wait again.
+        if delivery_state["email_missing_error"] is not None:
+            raise delivery_state["email_missing_error"]
+        if delivery_state["data_entry"] is None:
+            # wait a bit more
+            if not wait_for_email_updated_on_data_entry(data_entry.id, max_wait_seconds=3 * 60):
+                delivery_state["email_missing_error"] = ValueError(
+                    f"email missing for data_entry {data_entry.id} - cannot process"
+                )
+                raise delivery_state["email_missing_error"]
+            # This the hack when DataEntry.account_id can be updated, so we re-fetch the stuff.
+            delivery_state["data_entry"] = BaseDataEntry.get_by_id(data_entry.id)
+        return delivery_state["data_entry"]
+
+    # Keep the pacing between the emails, but never wait before the first one.
+    # NOTE: We do not sleep, the later emails are scheduled into the email_log outbox, see dispatch_scheduled_emails.
+    # The pacing is checkpointed, so a retry schedules its emails after the ones already in the outbox.
+    def _next_email_not_before() -> Optional[datetime.datetime]:
+        if delivery_state["next_email_not_before"] is None:
+            _, next_not_before = task.get_checkpoint("next_email_not_before")
+            if next_not_before is not None:
+                delivery_state["next_email_not_before"] = datetime.datetime.fromisoformat(next_not_before)
+        not_before = delivery_state["next_email_not_before"]
+        delivery_state["next_email_not_before"] = max(utc_now(), not_before or utc_now()) + datetime.timedelta(
+            seconds=RESPONSE_EMAILS_WAIT_BETWEEN_EMAILS_SECONDS
         )
-    # This the hack when DataEntry.account_id can be updated, so we re-fetch the stuff.
-    data_entry = BaseDataEntry.get_by_id(data_entry.id)
+        task.set_checkpoint("next_email_not_before", delivery_state["next_email_not_before"].isoformat())
+        return not_before
 
-    if len(people_entries) == 0:
-        # If this is sent, this should be the only email sent for this data_entry
-        send_result_no_people_found(
-            account_id=data_entry.account_id,
+    def _send_person_email(person: PersonDataEntry) -> bool:
+        # if user.contact_method() == "email":
+        return send_networking_per_person_result(
+            account_id=_get_data_entry_with_email().account_id,
             idempotency_id_prefix=data_entry.idempotency_id,
-            full_transcript=data_entry.output_transcript,
+            person=person,
+            not_before=_next_email_not_before(),
         )
-        return people_entries
 
-    # TODO(P1, ux/reliability): Would be better to create / send emails as processed
-    # instead of waiting to collect everything here.
-    rest_of_the_crowd = []
-    legit_results = []
-    for i, person in enumerate(people_entries):
+    def _sync_person_to_gsheets(person: PersonDataEntry):
+        if delivery_state["google_client"] is None:
+            delivery_state["google_client"] = GoogleClient()
+            delivery_state["google_client"].login()
+        sync_form_datas_to_gsheets(
+            account_id=_get_data_entry_with_email().account_id,
+            form_datas=[person.form_data],
+            google_client=delivery_state["google_client"],
+        )
+
+    def _deliver_person(person: PersonDataEntry):
         if not person.should_show_full_contact_card():
             rest_of_the_crowd.append(person)
-            continue
+            return
 
         person.form_data.set_field_value(
             # We use data_entry.created_at over .now(), cause created_at is best-effort when the recording happened.
             "recording_time",
             data_entry.created_at,
         )
-        legit_results.append(person)
-
-    # SAVE TO TASK
-    for person in legit_results:
-        task.add_generated_output(person.name, person.form_data)
+        # SAVE TO TASK
+        task.run_once(f"output_saved:{person.name}", lambda: task.add_generated_output(person.name, person.form_data))
 
-    # UPDATE SPREADSHEET
-    # TODO(P1, reliability): Once battle-tested, remove this
-    try:
-        sync_form_datas_to_gsheets(
-            account_id=data_entry.account_id,
-            form_datas=[person.form_data for person in legit_results],
+        # UPDATE SPREADSHEET
+        # TODO(P1, reliability): Once battle-tested, remove this
+        try:
+            task.run_once(f"sheet_synced:{person.name}", lambda: _sync_person_to_gsheets(person))
+        except Exception as ex:
+            print(f"ERROR: Cannot sync_people_to_gsheets cause {ex}")
+            traceback.print_exc()
+
+        # SEND EMAIL
+        # A retry skips the emails already sent (or scheduled), but tries again the ones which failed.
+        task.run_once_if_succeeded(f"email_sent:{person.name}", lambda: _send_person_email(person))
+
+    with DeliveryQueue("networking", _deliver_person) as delivery_queue:
+        people_entries = summarize_and_draft_people(
+            gpt_client, person_to_transcript, checkpoint_task=task, on_person_ready=delivery_queue.put
         )
-    except Exception as ex:
-        print(f"ERROR: Cannot sync_people_to_gsheets cause {ex}")
-        traceback.print_exc()
+    print(f"Delivered results for {delivery_queue.delivered_count} people")
 
-    # SEND EMAILS
-    for person in legit_results:
-        # if user.contact_method() == "email":
-        send_networking_per_person_result(
-            account_id=data_entry.account_id,
+    if len(people_entries) == 0:
+        # If this is sent, this should be the only email sent for this data_entry
+        task.run_once_if_succeeded("no_people_found_sent", lambda: send_result_no_people_found(
+            account_id=_get_data_entry_with_email().account_id,
             idempotency_id_prefix=data_entry.idempotency_id,
-            person=person,
-        )
-        time.sleep(RESPONSE_EMAILS_WAIT_BETWEEN_EMAILS_SECONDS)
+            full_transcript=data_entry.output_transcript,
+        ))
+        return people_entries
 
     if len(rest_of_the_crowd) > 0:
-        send_result_rest_of_the_crowd(
-            account_id=data_entry.account_id,
+        task.run_once_if_succeeded("rest_of_the_crowd_sent", lambda: send_result_rest_of_the_crowd(
+            account_id=_get_data_entry_with_email().account_id,
             idempotency_id_prefix=data_entry.idempotency_id,
-            people=rest_of_the_crowd,
-        )
+            people=sorted(rest_of_the_crowd, key=lambda pde: pde.sort_key()),
+            # After the per-person emails.
+            not_before=_next_email_not_before(),
+        ))
 
     return people_entries
 
@@ -301,20 +365,33 @@ def first_lambda_handler_wrapper(event, context) -> BaseDataEntry:
 
     # First Lambda
     if bucket == APP_UPLOADS_BUCKET:
-        download_path = "/tmp/{}".format(os.path.basename(key))
-        s3.download_file(bucket, key, download_path)
+        download_path = get_work_dir().path(os.path.basename(key))
+        # Download, conversion and transcription are pipelined, i.e. chunk N is transcribed while
+        # chunk N+1 is being converted, and the tail is still downloading.
+        audio_chunk_filepaths = None
+        if is_pipe_decodable(key):
+            s3_body = s3.get_object(Bucket=bucket, Key=key)["Body"]
+            audio_chunk_filepaths = ffmpeg_stream_convert_to_whisper_chunks(
+                output_file_prefix=download_path,
+                input_byte_chunks=s3_body.iter_chunks(chunk_size=STREAM_BUFFER_BYTES),
+            )
+        else:
+            # Nothing to overlap the download with, so we take the whole file path with its conversion cache,
+            # silence trimming and cuts in the pauses.
+            s3.download_file(bucket, key, download_path)
+            get_work_dir().track(download_path)
         # it can include folders, file extensions and such; ideally it should have metadata but unsure with presigned
         data_entry_id = parse_uuid_from_string(key)
         data_entry = process_app_upload(
             gpt_client=gpt_client,
             audio_or_video_filepath=download_path,
             data_entry_id=data_entry_id,
+            audio_chunk_filepaths=audio_chunk_filepaths,
         )
     elif bucket == EMAIL_BUCKET:
-        raw_email = s3.get_object(Bucket=bucket, Key=key)["Body"].read()
         data_entry = process_email_input(
             gpt_client=gpt_client,
-            raw_email=raw_email,
+            raw_email_stream=s3.get_object(Bucket=bucket, Key=key)["Body"],
             bucket_url=get_bucket_url(bucket, key),
         )
     elif bucket == PHONE_RECORDINGS_BUCKET:
@@ -335,7 +412,7 @@ def first_lambda_handler_wrapper(event, context) -> BaseDataEntry:
             gpt_client=gpt_client,
             twilio_client=twilio_client,
             bucket_url=get_bucket_url(bucket, key),
-            voice_file_data=s3_get_object_response["Body"].read(),
+            voice_file_stream=s3_get_object_response["Body"],
             call_sid=call_sid,
             phone_number=phone_number,
             full_name=proper_name,
@@ -354,37 +431,83 @@ def first_lambda_handler_wrapper(event, context) -> BaseDataEntry:
     return data_entry
 
 
-def process_generic_prompt(gpt_client, data_entry) -> str:
-    print("process_generic_prompt for data_entry", data_entry.id)
-
-    task = Task.create_task(workflow_name="generic_id", data_entry_id=data_entry.id)
-    # TODO(P1, devx): With gpt-form-filler migration, we lost the task_id setting. Would be nice to have it back.
-    # gpt_client.set_task_id(task.id)
-
+def run_generic_reply_prompt(gpt_client: OpenAiClient, data_entry: BaseDataEntry) -> str:
+    print("run_generic_reply_prompt for data_entry", data_entry.id)
     format_prompt = "Respond to this intake as a human executive assistant in a plaintext email: "
-    result = gpt_client.run_prompt(format_prompt + data_entry.output_transcript, model=BEST_MODEL)
+    return gpt_client.run_prompt(format_prompt + data_entry.output_transcript, model=BEST_MODEL)
+
 
+def run_transcript_cleanup_prompt(gpt_client: OpenAiClient, data_entry: BaseDataEntry) -> str:
+    print("run_transcript_cleanup_prompt for data_entry", data_entry.id)
     transcript_prompt = """
         Just reformat this transcript, omit filler words, better sentence structure, keep the wording,
         add paragraphs if needed. Especially make sure you keep all mentioned facts and details.
     """
     # CHEAPEST_MODEL leads to overly short answers.
-    transcription = gpt_client.run_prompt(transcript_prompt + data_entry.output_transcript, model=GPTo_MODEL)
+    return gpt_client.run_prompt(transcript_prompt + data_entry.output_transcript, model=GPTo_MODEL)
+
 
+def send_generic_result_email(data_entry: BaseDataEntry, result: str, transcription: str) -> bool:
     if not wait_for_email_updated_on_data_entry(data_entry.id, max_wait_seconds=3 * 60):
         print(
             f"WARNING: email missing for data_entry {data_entry.id} - cannot send results email"
         )
+    # The email (and so the account) might have been updated while we waited.
+    data_entry = BaseDataEntry.get_by_id(data_entry.id)
 
     # sync_form_datas_to_gsheets(data_entry.account_id, form_datas=form_datas)
-    send_generic_result(
+    return send_generic_result(
         account_id=data_entry.account_id,
         idempotency_id=data_entry.idempotency_id + "-generic-result",
         email_subject=f"Re: {data_entry.display_name}",
         email_body=result + "\n\n === Transcription === \n\n" + transcription,
     )
 
-    return result
+
+# The second lambda as a DAG, the generic reply, transcript cleanup and people extraction are independent GPT calls
+# so they all run at the same time. Step outputs are checkpointed on the Task, so a retry skips the finished ones.
+def build_second_lambda_job(
+    gpt_client: OpenAiClient, data_entry: BaseDataEntry, workflow_name: Optional[FormName]
+) -> Job:
+    steps = [
+        Step("generic_reply", lambda _: run_generic_reply_prompt(gpt_client, data_entry)),
+        Step("transcript_cleanup", lambda _: run_transcript_cleanup_prompt(gpt_client, data_entry)),
+        Step(
+            "generic_email",
+            lambda inputs: send_generic_result_email(
+                data_entry, result=inputs["generic_reply"], transcription=inputs["transcript_cleanup"]
+            ),
+            depends_on=["generic_reply", "transcript_cleanup"],
+        ),
+    ]
+    if workflow_name == FormName.CONTACTS:
+        steps += [
+            Step(
+                "extract_people",
+                lambda _: extract_people_with_context(gpt_client, data_entry.output_transcript),
+            ),
+            # Sends out the emails, so it has to wait for the generic one to keep the order users are used to.
+            Step(
+                "networking",
+                lambda inputs: len(process_networking_transcript(
+                    gpt_client=gpt_client,
+                    data_entry=data_entry,
+                    person_to_transcript=inputs["extract_people"],
+                )),
+                depends_on=["extract_people", "generic_email"],
+            ),
+        ]
+    if workflow_name == FormName.FOOD_LOG:
+        steps.append(
+            Step(
+                "food_log",
+                lambda _: len(process_food_log_transcript(gpt_client=gpt_client, data_entry=data_entry)),
+                depends_on=["generic_email"],
+            )
+        )
+
+    task = Task.get_or_create_task(workflow_name="second_lambda", data_entry_id=data_entry.id)
+    return Job(name=f"second_lambda-{workflow_name}", steps=steps, task=task)
 
 
 def second_lambda_handler_wrapper(data_entry: BaseDataEntry):
@@ -392,22 +515,22 @@ def second_lambda_handler_wrapper(data_entry: BaseDataEntry):
         print(
             "WARNING: data entry has no associated email - we might be operating on an incomplete account"
         )
-    gpt_client = open_ai_client_with_db_cache()
+    gpt_client = open_ai_client_with_db_cache(account_id=data_entry.account_id)
     acc: BaseAccount = BaseAccount.get_by_id(data_entry.account_id)
     print(f"gonna process transcript for account {acc.__dict__}")
 
-    process_generic_prompt(gpt_client, data_entry)
+    # The audio pre-screen found nothing worth transcribing, so there is nothing for GPT either.
+    if data_entry.output_transcript is None or data_entry.output_transcript.strip() == NO_AUDIO_TRANSCRIPT:
+        print("INFO: silent or empty recording, skipping GPT processing")
+        send_result_no_people_found(
+            account_id=data_entry.account_id,
+            idempotency_id_prefix=data_entry.idempotency_id,
+            full_transcript=None,
+        )
+        return
 
     suggested_workflow_name = get_workflow_name(gpt_client, data_entry.output_transcript)
-    if suggested_workflow_name == FormName.CONTACTS:
-        process_networking_transcript(
-            gpt_client=gpt_client,
-            data_entry=data_entry,
-        )
-    if suggested_workflow_name == FormName.FOOD_LOG:
-        process_food_log_transcript(
-            gpt_client=gpt_client, data_entry=data_entry
-        )
+    build_second_lambda_job(gpt_client, data_entry, suggested_workflow_name).run()
 
 
 def _event_idempotency_id(event):
@@ -426,7 +549,33 @@ def _event_idempotency_id(event):
     return idempotency_key
 
 
-def lambda_handler(event, context):
+# EventBridge scheduled rule (every minute, see deploy_lambda_container.sh), which only drains the email outbox.
+def _is_scheduled_event(event) -> bool:
+    return event.get("source") == "aws.events" or event.get("detail-type") == "Scheduled Event"
+
+
+# EventBridge daily rule with the constant input {"job": "prompt_cache_maintenance"}.
+PROMPT_CACHE_MAINTENANCE_JOB = "prompt_cache_maintenance"
+
+
+# How long we can keep draining the outbox before the Lambda times out, 0 when not in a Lambda.
+def _remaining_drain_seconds(context) -> int:
+    if context is None or not hasattr(context, "get_remaining_time_in_millis"):
+        return 0
+    remaining_seconds = context.get_remaining_time_in_millis() // 1000
+    return max(0, remaining_seconds - EMAIL_OUTBOX_DRAIN_TIMEOUT_MARGIN_SECONDS)
+
+
+def _dispatch_due_emails(max_wait_seconds: int = 0):
+    try:
+        dispatch_scheduled_emails(max_wait_seconds=max_wait_seconds)
+    except Exception as err:
+        # The next dispatch picks them up.
+        print(f"ERROR: dispatch_scheduled_emails failed: {err}")
+        traceback.print_exc()
+
+
+def _process_s3_event(event, context):
     data_entry: Optional[BaseDataEntry] = None
     try:
         data_entry = first_lambda_handler_wrapper(event, context)
@@ -451,10 +600,38 @@ def lambda_handler(event, context):
             data_entry.save()
         except Exception as err:
             send_technical_failure_email(err, str(data_entry.id), data_entry=data_entry)
+
+        print(f"prompt cache stats (this process): {dict(prompt_cache_stats)}")
+        # Sends the paced emails as they become due, for as long as the invocation has time left.
+        # Whatever does not fit goes with the scheduled invocations.
+        _dispatch_due_emails(max_wait_seconds=_remaining_drain_seconds(context))
     else:
         print("INFO: No DataEntry returned by first lambda, skipping second step")
 
 
+def lambda_handler(event, context):
+    if event.get("job") == PROMPT_CACHE_MAINTENANCE_JOB:
+        connect_to_postgres_i_will_call_disconnect_i_promise(POSTGRES_LOGIN_URL_FROM_ENV)
+        # The archives are written to the work dir before going to S3.
+        with invocation_work_dir():
+            run_prompt_cache_maintenance()
+        return
+
+    if _is_scheduled_event(event):
+        connect_to_postgres_i_will_call_disconnect_i_promise(POSTGRES_LOGIN_URL_FROM_ENV)
+        _dispatch_due_emails(max_wait_seconds=EMAIL_OUTBOX_DISPATCH_WINDOW_SECONDS)
+        return
+
+    # Everything the invocation writes to disk lives in its own work dir, which is deleted when we are done,
+    # as /tmp survives across warm invocations and would otherwise fill up.
+    with invocation_work_dir():
+        try:
+            _process_s3_event(event, context)
+        finally:
+            # The write-behind thread is frozen in-between invocations, so we flush what is left.
+            flush_prompt_log_writes()
+
+
 # For local testing without emails or S3, great for bigger refactors.
 # TODO(P1, devx): Would be nice to get this working again, BUT my local supabase is somehow broken :(
 # TODO(P2): Make this an automated-ish test
@@ -493,10 +670,9 @@ if __name__ == "__main__":
             )
         if test_case == "email":
             with open("testdata/boomergpt-mail-email", "rb") as handle:
-                file_contents = handle.read()
                 orig_data_entry = process_email_input(
                     gpt_client=open_ai_client,
-                    raw_email=file_contents,
+                    raw_email_stream=handle,
                 )
         if test_case == "voicemail":
             # Optional
@@ -508,7 +684,6 @@ if __name__ == "__main__":
             test_call_sid = "CAf85701fd23e325761071817c42092922"
             creation_time = datetime.datetime.fromtimestamp(os.path.getctime(filepath))
             with open(filepath, "rb") as handle:
-                file_contents = handle.read()
                 orig_data_entry = process_voice_recording_input(
                     gpt_client=open_ai_client,
                     # TODO(P1, testing): Support local testing
@@ -518,30 +693,17 @@ if __name__ == "__main__":
                     phone_number=test_phone_number,
                     full_name=test_full_name,
                     phone_carrier_info="T-Mobile consumer stuff",
-                    voice_file_data=file_contents,
+                    voice_file_stream=handle,
                     event_timestamp=creation_time,  # reasonably idempotent
                 )
 
         loaded_data_entry = BaseDataEntry.get(BaseDataEntry.id == orig_data_entry.id)
         print(f"loaded_data_entry: {loaded_data_entry}")
 
-        process_generic_prompt(
-            gpt_client=open_ai_client,
-            data_entry=orig_data_entry
-        )
-
         workflow_name = get_workflow_name(
             open_ai_client, loaded_data_entry.output_transcript
         )
-        if workflow_name == FormName.FOOD_LOG:
-            process_food_log_transcript(
-                gpt_client=open_ai_client, data_entry=loaded_data_entry
-            )
-        elif workflow_name == FormName.CONTACTS:
-            # NOTE: We pass "orig_data_entry" here cause the loaded would include the results.
-            process_networking_transcript(
-                gpt_client=open_ai_client,
-                data_entry=orig_data_entry,
-            )
+        # NOTE: We pass "orig_data_entry" here cause the loaded would include the results.
+        build_second_lambda_job(open_ai_client, orig_data_entry, workflow_name).run()
 
         EmailLog.save_last_email_log_to("result-app-app.html")
@@ -1,10 +1,18 @@
 import json
-from typing import Dict, List, Optional
-
-from app.datashare import PersonDataEntry
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import fields
+from typing import Callable, Dict, List, Optional
+
+from app.datashare import PersonDataEntry, dict_to_dataclass
 from app.form_library import get_form, FormName
+from common.config import PEOPLE_SUMMARIZATION_MAX_CONCURRENCY, TRANSCRIPT_WINDOWS_MAX_CONCURRENCY
+from common.tokenizer import count_tokens, pack_into_batches, truncate_to_token_count
+from database.task import Task
+from gpt_form_filler.form import FormData
 from gpt_form_filler.openai_client import (
-    DEFAULT_MODEL,
     OpenAiClient,
     gpt_response_to_json,
 )
@@ -13,14 +21,18 @@ from gpt_form_filler.openai_client import (
 MIN_FULL_TRANSCRIPT_CHAR_LENGTH = 100
 MIN_FULL_TRANSCRIPT_CHAR_LENGTH_TO_GENERATE_SUMMARY = 200
 MIN_PERSON_TRANSCRIPT_CHAR_LENGTH = 140
-MAX_TRANSCRIPT_TOKEN_COUNT = 2500  # words
-
-
-# https://help.openai.com/en/articles/4936856-what-are-tokens-and-how-to-count-them
-def poor_mans_token_counter(text: str) -> int:
-    by_character = len(text) / 4
-    by_words = 3 * len(text.split()) // 4
-    return int(by_character + by_words) // 2
+MAX_TRANSCRIPT_TOKEN_COUNT = 3300  # about 2500 words
+# Long transcripts are processed in overlapping windows, so people mentioned late in the recording are not lost.
+# The overlap makes sure a person introduced right at a window boundary is seen whole in at least one window.
+TRANSCRIPT_WINDOW_TOKEN_COUNT = 2700
+TRANSCRIPT_WINDOW_OVERLAP_TOKEN_COUNT = 200
+# The extracted mentions are the output, so this is what limits how many people fit into one prompt.
+CONTEXT_EXTRACTION_OUTPUT_TOKEN_BUDGET = 3000
+# People are often mentioned together, so their contexts overlap, and GPT adds some glue text.
+CONTEXT_EXTRACTION_OUTPUT_PER_TRANSCRIPT_TOKEN = 1.5
+CONTEXT_EXTRACTION_MIN_TOKENS_PER_PERSON = 100
+# Too many people in one prompt makes GPT skip some of them, regardless the tokens.
+CONTEXT_EXTRACTION_MAX_PEOPLE_PER_BATCH = 15
 
 
 # TODO(P1, devx): Historically, this query give me most of the headaches.
@@ -30,9 +42,8 @@ def poor_mans_token_counter(text: str) -> int:
 def extract_everyone_i_have_talked_to(
     gpt_client: OpenAiClient, full_transcript: str
 ) -> List:
-    # NOTE: We shorten the string by words cause easier, but we better estimate the token count by OpenAI counter.
-    token_count = poor_mans_token_counter(full_transcript)
-    print(f"Transcript has {token_count} words and {len(full_transcript)} characters")
+    token_count = count_tokens(full_transcript)
+    print(f"Transcript has {token_count} tokens and {len(full_transcript)} characters")
 
     # This can happen for either super-short, or silent uploads
     if len(full_transcript) < 5 or token_count <= 1:
@@ -40,13 +51,12 @@ def extract_everyone_i_have_talked_to(
         return []
 
     # Make sure to include the whole string without gaps.
-    # TODO(P1, quality): Eventually we would need to implement processing a larger input (Claude, or split it up).
+    # NOTE: extract_people_with_context splits long transcripts into windows, so this is just a safety net.
     if token_count > MAX_TRANSCRIPT_TOKEN_COUNT:
         print(
             f"ERROR: raw_transcript too long ({token_count}), truncating to {MAX_TRANSCRIPT_TOKEN_COUNT}"
         )
-        transcript_words = full_transcript.split()
-        full_transcript = " ".join(transcript_words[:MAX_TRANSCRIPT_TOKEN_COUNT])
+        full_transcript = truncate_to_token_count(full_transcript, MAX_TRANSCRIPT_TOKEN_COUNT)
 
     # TODO(P1, research): Understand if GPT function calling can help us. From first read it seems that the use case
     #   is for GPT to call other APIs. But they mention `extract_people_data` from a Wikipedia article
@@ -82,9 +92,20 @@ def extract_context_per_person(
         return {}
 
     result = {}
-    size = 10 if DEFAULT_MODEL.startswith("gpt-4") else 5
-    # I generated this with chat-gpt, so feel free to use it to explain it.
-    sub_lists_of_people = [people[i : i + size] for i in range(0, len(people), size)]
+    # We do not know how much of the transcript is about each person, so we assume an even split.
+    # For short notes everyone fits into one prompt, for long ones we never overflow the output.
+    transcript_token_count = count_tokens(full_transcript)
+    per_person_token_count = max(
+        CONTEXT_EXTRACTION_MIN_TOKENS_PER_PERSON,
+        int(CONTEXT_EXTRACTION_OUTPUT_PER_TRANSCRIPT_TOKEN * transcript_token_count / len(people)),
+    )
+    sub_lists_of_people = pack_into_batches(
+        people,
+        [per_person_token_count + count_tokens(str(person)) for person in people],
+        max_batch_tokens=CONTEXT_EXTRACTION_OUTPUT_TOKEN_BUDGET,
+        max_batch_size=CONTEXT_EXTRACTION_MAX_PEOPLE_PER_BATCH,
+    )
+    print(f"extract_context_per_person for {len(people)} people in {len(sub_lists_of_people)} batches")
     for sublist in sub_lists_of_people:
         query_mentions = """
 For each of the following people, extract all substrings which mention them in my notes.
@@ -127,6 +148,113 @@ Be careful to include all full original substrings with enough context merged in
     return result
 
 
+# Windows are cut on word boundaries, the token budget is converted to words by the average tokens per word.
+def split_transcript_into_windows(
+    full_transcript: str,
+    window_token_count: int = TRANSCRIPT_WINDOW_TOKEN_COUNT,
+    overlap_token_count: int = TRANSCRIPT_WINDOW_OVERLAP_TOKEN_COUNT,
+) -> List[str]:
+    token_count = count_tokens(full_transcript)
+    if token_count <= window_token_count:
+        return [full_transcript]
+    words_per_token = len(full_transcript.split()) / token_count
+    return split_words_into_windows(
+        full_transcript,
+        window_word_count=max(1, int(window_token_count * words_per_token)),
+        overlap_word_count=int(overlap_token_count * words_per_token),
+    )
+
+
+def split_words_into_windows(
+    full_transcript: str, window_word_count: int, overlap_word_count: int
+) -> List[str]:
+    words = full_transcript.split()
+    if len(words) <= window_word_count:
+        return [full_transcript]
+
+    windows = []
+    step = max(1, window_word_count - overlap_word_count)
+    for window_start in range(0, len(words), step):
+        windows.append(" ".join(words[window_start : window_start + window_word_count]))
+        if window_start + window_word_count >= len(words):
+            break
+    return windows
+
+
+def _normalize_person_name(name: str) -> str:
+    return " ".join(re.sub(r"[^\w\s]", " ", name.lower()).split())
+
+
+def _context_to_str(context) -> str:
+    # NOTE: GPT sometimes returns a list of mentions instead of one text.
+    if isinstance(context, list):
+        return " ".join(str(mention) for mention in context)
+    return "" if context is None else str(context)
+
+
+# Reduce step of the windowed extraction: merges the name -> context maps of all windows into one.
+# * The same person in multiple windows is matched by the normalized name,
+#   a sole first name (e.g. "Katka") is merged into the only full name starting with it (e.g. "Katka Sabo").
+# * Contexts are concatenated in the window order, skipping the ones already included (e.g. from the overlap).
+def merge_person_contexts(per_window_contexts: List[Dict]) -> Dict:
+    display_names: Dict[str, str] = {}
+    contexts: Dict[str, List[str]] = {}
+    for window_contexts in per_window_contexts:
+        for name, context in window_contexts.items():
+            key = _normalize_person_name(name)
+            if key not in display_names:
+                display_names[key] = name
+                contexts[key] = []
+            context = _context_to_str(context)
+            if len(context) > 0 and not any(context in existing for existing in contexts[key]):
+                contexts[key].append(context)
+
+    for key in list(display_names.keys()):
+        if " " in key:
+            continue
+        full_name_keys = [other for other in display_names if other.startswith(key + " ")]
+        if len(full_name_keys) != 1:
+            continue
+        full_name_key = full_name_keys[0]
+        print(f"Merging {display_names[key]} into {display_names[full_name_key]}")
+        for context in contexts.pop(key):
+            if not any(context in existing for existing in contexts[full_name_key]):
+                contexts[full_name_key].append(context)
+        display_names.pop(key)
+
+    return {display_names[key]: "\n".join(contexts[key]) for key in display_names}
+
+
+def _extract_people_with_context_from_window(
+    gpt_client: OpenAiClient, window_num: int, transcript_window: str
+) -> Dict:
+    print(f"Extracting people from transcript window {window_num}")
+    people = extract_everyone_i_have_talked_to(gpt_client, transcript_window)
+    if people is None or len(people) == 0:
+        return {}
+    return extract_context_per_person(gpt_client, transcript_window, people)
+
+
+# Return a dict(name -> context) for everyone I have talked to.
+# Long transcripts are map-reduced: every window is processed in parallel (so the prompt size stays constant
+# and no text gets dropped), then the per window results are merged by name.
+def extract_people_with_context(gpt_client: OpenAiClient, full_transcript: str) -> Dict:
+    windows = split_transcript_into_windows(full_transcript)
+    if len(windows) == 1:
+        return _extract_people_with_context_from_window(gpt_client, 0, full_transcript)
+
+    print(f"Transcript is too long for one go, splitting it into {len(windows)} overlapping windows")
+    max_workers = max(1, min(TRANSCRIPT_WINDOWS_MAX_CONCURRENCY, len(windows)))
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="window") as executor:
+        per_window_contexts = list(
+            executor.map(
+                lambda args: _extract_people_with_context_from_window(gpt_client, *args),
+                enumerate(windows),
+            )
+        )
+    return merge_person_contexts(per_window_contexts)
+
+
 def summarize_note(gpt_client: OpenAiClient, raw_note: str):
     return gpt_client.run_prompt(
         f"""Summarize my following meeting note into a short concise structured output,
@@ -251,6 +379,24 @@ My note {note}""".format(
     return raw_response
 
 
+# The summarize -> draft chain of one person, independent of everyone else.
+def summarize_and_draft_person(
+    gpt_client: OpenAiClient, name: str, raw_note: str
+) -> Optional[PersonDataEntry]:
+    person_data_entry = summarize_raw_note_to_person_data_entry(
+        gpt_client, name, raw_note
+    )
+    if person_data_entry is None:
+        return None
+
+    if person_data_entry.should_draft():
+        person_data_entry.next_draft = generate_draft(gpt_client, person_data_entry)
+        person_data_entry.form_data.set_field_value(
+            "next_draft", person_data_entry.next_draft
+        )
+    return person_data_entry
+
+
 # =============== MAIN FUNCTIONS TO BE CALLED  =================
 # Current approach is in two passes:
 # * first is to extract all people the text talks about
@@ -267,37 +413,105 @@ def run_executive_assistant_to_get_drafts(
             f"WARNING: full_transcript length too short {MIN_FULL_TRANSCRIPT_CHAR_LENGTH}"
         )
 
-    token_count = poor_mans_token_counter(full_transcript)
+    token_count = count_tokens(full_transcript)
     print(f"extract_context_per_person on raw_transcript of {token_count} token count")
 
-    people = extract_everyone_i_have_talked_to(gpt_client, full_transcript)
-    if len(people) == 0:
-        return []
-
-    person_to_transcript = extract_context_per_person(
-        gpt_client, full_transcript, people
-    )
+    person_to_transcript = extract_people_with_context(gpt_client, full_transcript)
     # TODO(P1, quality): Make sure all of the original transcript is covered OR at least we should log it.
     print("=== All people with all their mentions === ")
     print(json.dumps(person_to_transcript))
+    return summarize_and_draft_people(gpt_client, person_to_transcript)
+
+
+# For Task checkpoints, the form_data goes through its own to_dict as dict_to_dataclass does not know FormData.
+def person_data_entry_to_dict(person: PersonDataEntry) -> Dict:
+    result = {f.name: getattr(person, f.name) for f in fields(PersonDataEntry) if f.name != "form_data"}
+    result["form_data"] = person.form_data.to_dict() if person.form_data is not None else None
+    return result
+
+
+def person_data_entry_from_dict(dict_: Dict) -> PersonDataEntry:
+    person = dict_to_dataclass({k: v for k, v in dict_.items() if k != "form_data"}, PersonDataEntry)
+    if dict_.get("form_data") is not None:
+        person.form_data = FormData(get_form(FormName.CONTACTS), dict_["form_data"])
+    return person
+
+
+# Summarize -> draft one person, skipped if a previous attempt already did it.
+def _summarize_and_draft_person_once(
+    gpt_client: OpenAiClient, name: str, raw_note: str, checkpoint_task: Optional[Task]
+) -> Optional[PersonDataEntry]:
+    if checkpoint_task is None:
+        return summarize_and_draft_person(gpt_client, name, raw_note)
+
+    stage_name = f"person_summarized:{name}"
+    has_checkpoint, person_dict = checkpoint_task.get_checkpoint(stage_name)
+    if has_checkpoint:
+        print(f"Re-using summary of {name} from a previous attempt")
+        return person_data_entry_from_dict(person_dict) if person_dict is not None else None
+
+    person = summarize_and_draft_person(gpt_client, name, raw_note)
+    checkpoint_task.set_checkpoint(stage_name, person_data_entry_to_dict(person) if person is not None else None)
+    return person
+
+
+# Second half of run_executive_assistant_to_get_drafts, separate so a (checkpointed) person_to_transcript
+# can be re-used when retrying. With `checkpoint_task` every summarized person is checkpointed on it.
+# `on_person_ready` is called (from a worker thread) in the sort_key order, every person as soon as they
+# and everyone before them are done.
+def summarize_and_draft_people(
+    gpt_client: OpenAiClient,
+    person_to_transcript: Dict,
+    checkpoint_task: Optional[Task] = None,
+    on_person_ready: Optional[Callable[[PersonDataEntry], None]] = None,
+) -> List[PersonDataEntry]:
     if person_to_transcript is None or len(person_to_transcript) == 0:
         return []
 
-    person_data_entries: List[PersonDataEntry] = []
-    for name, raw_note in person_to_transcript.items():
-        person_data_entry = summarize_raw_note_to_person_data_entry(
-            gpt_client, name, raw_note
+    # Every person is independent, so the GPT round trips of all of them overlap,
+    # i.e. the latency is given by the slowest person rather than the whole crowd.
+    start_time = time.time()
+
+    # The people get their full contact card first, and then the longest notes first (see sort_key).
+    # Only the former is unknown upfront, and the others are not delivered one by one anyway.
+    ready_order = sorted(person_to_transcript.keys(), key=lambda name: -len(str(person_to_transcript[name])))
+    ready_lock = threading.Lock()
+    done_people: Dict[str, Optional[PersonDataEntry]] = {}
+    next_ready_index = 0
+
+    def _mark_done(name: str, person: Optional[PersonDataEntry]):
+        nonlocal next_ready_index
+        # Under the lock, so the handover order does not depend on the thread scheduling.
+        with ready_lock:
+            done_people[name] = person
+            while next_ready_index < len(ready_order) and ready_order[next_ready_index] in done_people:
+                ready_person = done_people[ready_order[next_ready_index]]
+                next_ready_index += 1
+                if ready_person is not None:
+                    on_person_ready(ready_person)
+
+    def _process_person(name: str, raw_note: str) -> Optional[PersonDataEntry]:
+        person = None
+        try:
+            person = _summarize_and_draft_person_once(gpt_client, name, raw_note, checkpoint_task)
+            return person
+        finally:
+            # A failed person must not hold back the ones after it.
+            if on_person_ready is not None:
+                _mark_done(name, person)
+
+    max_workers = max(1, min(PEOPLE_SUMMARIZATION_MAX_CONCURRENCY, len(person_to_transcript)))
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="person") as executor:
+        # executor.map keeps the input order, so ties in sort_key below stay deterministic.
+        maybe_person_data_entries = list(
+            executor.map(_process_person, person_to_transcript.keys(), person_to_transcript.values())
         )
-        if person_data_entry is None:
-            continue
-
-        if person_data_entry.should_draft():
-            person_data_entry.next_draft = generate_draft(gpt_client, person_data_entry)
-            person_data_entry.form_data.set_field_value(
-                "next_draft", person_data_entry.next_draft
-            )
-
-        person_data_entries.append(person_data_entry)
+    person_data_entries: List[PersonDataEntry] = [
+        pde for pde in maybe_person_data_entries if pde is not None
+    ]
+    print(
+        f"Summarized {len(person_data_entries)} people in {round(time.time() - start_time, 2)} seconds"
+    )
 
     print("=== All summaries === ")
     # Sort by priority, these are now P0, P1 so do it ascending.
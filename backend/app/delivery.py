@@ -0,0 +1,54 @@
+import queue
+import threading
+import traceback
+from typing import Any, Callable, List
+
+_STOP = object()
+
+
+# Delivers items (e.g. a person's sheet row and email) one-by-one on a single worker thread, in the order they
+# were put. The producers (e.g. the parallel per-person summarization) never wait for the delivery,
+# while the user-facing side effects stay serial, so their pacing and ordering are under our control.
+# A failing item does NOT stop the delivery of the others, the first error is re-raised by `close`.
+class DeliveryQueue:
+    def __init__(self, name: str, deliver_fn: Callable[[Any], None]):
+        self.name = name
+        self.deliver_fn = deliver_fn
+        self.queue = queue.Queue()
+        self.errors: List[Exception] = []
+        self.delivered_count = 0
+        self.thread = threading.Thread(
+            target=self._run, name=f"delivery-{name}", daemon=True
+        )
+        self.thread.start()
+
+    def put(self, item: Any):
+        self.queue.put(item)
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                return
+            try:
+                self.deliver_fn(item)
+                self.delivered_count += 1
+            except Exception as err:
+                print(f"ERROR: delivery {self.name} failed for an item: {err}")
+                traceback.print_exc()
+                self.errors.append(err)
+
+    # Waits until everything put so far is delivered, returns the number of successfully delivered items.
+    def close(self, raise_errors: bool = True) -> int:
+        self.queue.put(_STOP)
+        self.thread.join()
+        if raise_errors and len(self.errors) > 0:
+            raise self.errors[0]
+        return self.delivered_count
+
+    def __enter__(self) -> "DeliveryQueue":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # Do not shadow the original exception with the delivery ones.
+        self.close(raise_errors=exc_type is None)
@@ -2,6 +2,7 @@
 # TODO(P2, ux): Setup Supabase SMTP to use the for login stuff as other (Amazon SES)
 #  SMTP Settings: You can use your own SMTP server instead of the built-in email service.
 #  https://app.supabase.com/project/kubtuncgxkefdlzdnnue/settings/auth
+import datetime
 import os
 import re
 import time
@@ -39,7 +40,7 @@ from gpt_form_filler.form import FormData
 from common.storage_utils import pretty_filesize_path
 from common.twillio_client import TwilioClient
 from database.account import Account
-from database.email_log import EmailLog
+from database.email_log import EmailLog, utc_now
 from database.models import BaseDataEntry
 
 
@@ -56,36 +57,6 @@ def sanitize_filename(filename: str) -> str:
     return filename
 
 
-def store_and_get_attachments_from_email(msg, file_name_prefix: str):
-    # Process the attachments
-    attachment_file_paths = []
-    for part in msg.walk():
-        if part.get_content_maintype() == "multipart":
-            continue
-        if part.get("Content-Disposition") is None:
-            continue
-
-        # Get the attachment's filename
-        orig_file_name = part.get_filename()
-        print(f"Parsing attachment {orig_file_name}")
-
-        if not bool(orig_file_name):
-            continue
-
-        # If there is an attachment, save it to a file
-        file_name = sanitize_filename(f"{file_name_prefix}-{orig_file_name}")
-        file_path = os.path.join("/tmp/", file_name)
-        with open(file_path, "wb") as f:
-            f.write(part.get_payload(decode=True))
-
-        attachment_file_paths.append(file_path)
-
-    print(
-        f"store_and_get_attachments_from_email got {len(attachment_file_paths)} total attachments"
-    )
-    return attachment_file_paths
-
-
 # TODO(P1, test this)
 def decode_str(s):
     """Decode the specified RFC 2047 string."""
@@ -233,7 +204,6 @@ def create_raw_email_with_attachments(params: EmailLog):
 #     * Over-time, the higher the engagement with our emails the better.
 def send_email(params: EmailLog, check_idempotency: bool = True) -> bool:
     params.bcc = DEBUG_RECIPIENTS
-    raw_email = create_raw_email_with_attachments(params)
 
     # The check_if_already_sent uses DB, which ain't always available.
     try:
@@ -242,6 +212,19 @@ def send_email(params: EmailLog, check_idempotency: bool = True) -> bool:
         print(f"ERROR: check_if_already_sent failed with {e}")
         already_sent = False
 
+    if already_sent:
+        print(f"SKIPPING email '{params.idempotency_id}' cause already sent for {params.account}")
+        return True
+
+    if not _send_raw_email(params):
+        return False
+    params.log_email()
+    return True
+
+
+def _send_raw_email(params: EmailLog) -> bool:
+    raw_email = create_raw_email_with_attachments(params)
+
     if not is_running_in_aws() or str(SKIP_SENDING_EMAILS) == "1":
         # TODO(P2, testing): Ideally we should also test the translation from params to raw email.
         # TODO(P1, devx): How this can be printed "an contents None"? If params is None, it should fail earlier.
@@ -249,13 +232,8 @@ def send_email(params: EmailLog, check_idempotency: bool = True) -> bool:
             f"Skipping ses.send_raw_email cause NOT in AWS or SKIP_SENDING_EMAILS={SKIP_SENDING_EMAILS} "
             f"Dumping the email {params.idempotency_id} contents {params}"
         )
-        if not already_sent:
-            params.log_email()  # to test db queries too
         return True
 
-    if already_sent:
-        print(f"SKIPPING email '{params.idempotency_id}' cause already sent for {params.account}")
-        return True
     try:
         print(
             f"Attempting to send email {params.idempotency_id} to {params.recipient} "
@@ -277,8 +255,6 @@ def send_email(params: EmailLog, check_idempotency: bool = True) -> bool:
 
         message_id = response["MessageId"]
         print(f"Email sent! Message ID: {message_id}, Subject: {params.subject}")
-
-        params.log_email()
         return True
     except Exception as e:
         print(f"Email with subject {params.subject} failed to send. {e}")
@@ -286,6 +262,67 @@ def send_email(params: EmailLog, check_idempotency: bool = True) -> bool:
         return False
 
 
+# Instead of sleeping in-between emails (which we pay for), we put the email into the email_log outbox
+# and return right away. The outbox is drained by dispatch_scheduled_emails.
+# With `not_before` None (or in the past) the email is sent right away.
+def schedule_email(params: EmailLog, not_before: Optional[datetime.datetime]) -> bool:
+    if not_before is None or not_before <= utc_now():
+        return send_email(params=params)
+    if len(params.attachment_paths) > 0:
+        # The attachments live in the invocation work dir, which is gone by the time the dispatcher runs.
+        print(f"WARNING: cannot schedule email {params.idempotency_id} with attachments, sending it right away")
+        return send_email(params=params)
+
+    params.bcc = DEBUG_RECIPIENTS
+    try:
+        if not params.schedule(not_before):
+            print(f"SKIPPING scheduling email '{params.idempotency_id}' cause already scheduled or sent")
+        return True
+    except Exception as e:
+        # Better to send it a bit sooner than never.
+        print(f"ERROR: failed to schedule email {params.idempotency_id}, sending it right away: {e}")
+        traceback.print_exc()
+        return send_email(params=params)
+
+
+# Sends the due emails from the email_log outbox in their not_before order, returns how many were sent.
+# With `max_wait_seconds` it also waits for the emails which become due in the meantime, so their spacing holds.
+# Safe to run concurrently, every email is claimed before sending.
+def dispatch_scheduled_emails(max_wait_seconds: int = 0) -> int:
+    deadline = time.time() + max_wait_seconds
+    sent_count = 0
+    failed: List[EmailLog] = []
+    while True:
+        for email_log in EmailLog.get_due_scheduled(now=utc_now()):
+            if not email_log.claim_for_sending():
+                continue  # Some other dispatcher got it
+            print(f"dispatch_scheduled_emails: {email_log.idempotency_id} scheduled for {email_log.not_before}")
+            if _send_raw_email(email_log):
+                email_log.mark_as_sent()
+                sent_count += 1
+            else:
+                failed.append(email_log)
+
+        next_not_before = EmailLog.get_next_scheduled_not_before()
+        if next_not_before is None:
+            break
+        wait_seconds = max(0.0, (next_not_before - utc_now()).total_seconds())
+        if time.time() + wait_seconds > deadline:
+            print(f"dispatch_scheduled_emails: next email is due at {next_not_before}, leaving it for later")
+            break
+        time.sleep(wait_seconds)
+
+    # Only put back the failed ones at the end, so we do not retry them in a tight loop.
+    for email_log in failed:
+        if not email_log.release_claim():
+            print(
+                f"ERROR: giving up on email {email_log.idempotency_id} to {email_log.recipient} "
+                f"after {email_log.send_attempts} attempts"
+            )
+    print(f"dispatch_scheduled_emails: sent {sent_count} emails, {len(failed)} failed")
+    return sent_count
+
+
 # E.g. "2023-10-05_193824-0500-James_white_for_testing.m4a" -> James White For Testing
 # or 2023-10-06_210315-0500-Andrej_Jursa_Vestberry.m4a.mp4
 def _make_human_readable(filename):
@@ -540,7 +577,10 @@ def send_generic_result(
 
 
 def send_networking_per_person_result(
-    account_id: UUID, idempotency_id_prefix: str, person: PersonDataEntry
+    account_id: UUID,
+    idempotency_id_prefix: str,
+    person: PersonDataEntry,
+    not_before: Optional[datetime.datetime] = None,
 ) -> bool:
     person_name_safe = re.sub(r"\W", "-", person.name).lower()
     acc: Account = Account.get_by_id(account_id)
@@ -559,11 +599,14 @@ def send_networking_per_person_result(
         content=content_html,
     )
 
-    return send_email(params=email_params)
+    return schedule_email(params=email_params, not_before=not_before)
 
 
 def send_result_rest_of_the_crowd(
-    account_id: UUID, idempotency_id_prefix: str, people: List[PersonDataEntry]
+    account_id: UUID,
+    idempotency_id_prefix: str,
+    people: List[PersonDataEntry],
+    not_before: Optional[datetime.datetime] = None,
 ) -> bool:
     email_params = EmailLog.get_email_reply_params_for_account_id(
         account_id=account_id,
@@ -591,7 +634,7 @@ def send_result_rest_of_the_crowd(
         content_text=content_text,
     )
 
-    return send_email(params=email_params)
+    return schedule_email(params=email_params, not_before=not_before)
 
 
 def send_result_no_people_found(
@@ -1,16 +1,142 @@
-from typing import List
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional
 
 from gpt_form_filler.form import FormDefinition
 from gpt_form_filler.openai_client import OpenAiClient
 
+from database.task import Task
+
+JOB_MAX_CONCURRENCY = 4
+
 
 def decide_on_workflow(gpt_client: OpenAiClient, text: str):
     pass
 
 
-# Or maybe workflow
+# One unit of work in a Job, `fn` gets the outputs of the steps it `depends_on` keyed by their name.
+# With `checkpoint=True` the output is stored on the Task, so it has to be JSON serializable.
+class Step:
+    def __init__(
+        self,
+        name: str,
+        fn: Callable[[Dict[str, Any]], Any],
+        depends_on: Optional[List[str]] = None,
+        checkpoint: bool = True,
+    ):
+        self.name = name
+        self.fn = fn
+        self.depends_on = depends_on or []
+        self.checkpoint = checkpoint
+
+
+# Or maybe workflow.
+# A small DAG executor: every step runs as soon as all its dependencies are done, independent steps in parallel
+# (the steps are mostly GPT calls, so threads are good enough).
+# With a `task`, outputs of finished steps are checkpointed on it, and a re-run (e.g. a Lambda retry) skips them.
 class Job:
-    pass
+    def __init__(
+        self,
+        name: str,
+        steps: List[Step],
+        task: Optional[Task] = None,
+        max_concurrency: int = JOB_MAX_CONCURRENCY,
+    ):
+        self.name = name
+        self.steps = {step.name: step for step in steps}
+        self.task = task
+        self.max_concurrency = max_concurrency
+        for step in steps:
+            for dependency in step.depends_on:
+                if dependency not in self.steps:
+                    raise ValueError(
+                        f"job {name} step {step.name} depends on unknown step {dependency}"
+                    )
+        self._check_no_cycles()
+
+    def _check_no_cycles(self):
+        visiting, visited = set(), set()
+
+        def _visit(step_name: str):
+            if step_name in visited:
+                return
+            if step_name in visiting:
+                raise ValueError(
+                    f"job {self.name} has a dependency cycle through step {step_name}"
+                )
+            visiting.add(step_name)
+            for dependency in self.steps[step_name].depends_on:
+                _visit(dependency)
+            visiting.remove(step_name)
+            visited.add(step_name)
+
+        for step_name in self.steps:
+            _visit(step_name)
+
+    def _run_step(self, step: Step, outputs: Dict[str, Any]) -> Any:
+        start_time = time.time()
+        print(f"JOB {self.name}: starting step {step.name}")
+        output = step.fn(
+            {dependency: outputs[dependency] for dependency in step.depends_on}
+        )
+        print(
+            f"JOB {self.name}: step {step.name} done in {round(time.time() - start_time, 2)} seconds"
+        )
+        if step.checkpoint and self.task is not None:
+            self.task.set_checkpoint(step.name, output)
+        return output
+
+    # Returns the outputs of all steps keyed by the step name.
+    # On the first failing step no new steps are started, the already running ones finish (and get checkpointed).
+    def run(self) -> Dict[str, Any]:
+        outputs: Dict[str, Any] = {}
+        if self.task is not None:
+            for step in self.steps.values():
+                if not step.checkpoint:
+                    continue
+                has_checkpoint, output = self.task.get_checkpoint(step.name)
+                if has_checkpoint:
+                    print(
+                        f"JOB {self.name}: skipping step {step.name} as already checkpointed"
+                    )
+                    outputs[step.name] = output
+
+        pending = [step for step in self.steps.values() if step.name not in outputs]
+        running: Dict[Future, Step] = {}
+        first_error: Optional[Exception] = None
+        with ThreadPoolExecutor(
+            max_workers=max(1, self.max_concurrency), thread_name_prefix="job"
+        ) as executor:
+            while len(pending) > 0 or len(running) > 0:
+                if first_error is None:
+                    ready = [
+                        step
+                        for step in pending
+                        if all(dep in outputs for dep in step.depends_on)
+                    ]
+                    for step in ready:
+                        pending.remove(step)
+                        running[
+                            executor.submit(self._run_step, step, dict(outputs))
+                        ] = step
+                if len(running) == 0:
+                    break
+
+                done, _ = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+                for future in done:
+                    step = running.pop(future)
+                    try:
+                        outputs[step.name] = future.result()
+                    except Exception as err:
+                        print(f"ERROR: JOB {self.name}: step {step.name} failed: {err}")
+                        traceback.print_exc()
+                        if first_error is None:
+                            first_error = err
+
+        if first_error is not None:
+            raise first_error
+        return outputs
 
 
 # Yeah, maybe easiest is to quickly hack up the food_log stuff
@@ -0,0 +1,129 @@
+import hashlib
+import zlib
+from typing import Dict, Iterable, List
+
+from peewee import fn
+
+from database.models import BasePromptBlob
+
+# Content-defined chunking: the chunk boundaries depend on the content around them (not on the offset),
+# so the same transcript embedded in two different prompts splits into (mostly) the same chunks.
+CHUNK_MIN_BYTES = 1024
+CHUNK_AVG_BYTES = 4096  # has to be a power of two
+CHUNK_MAX_BYTES = 32 * 1024
+ZLIB_LEVEL = 6
+# Max chunks per SELECT / INSERT, so we do not build huge queries.
+BLOB_QUERY_BATCH_SIZE = 200
+
+_UINT64_MASK = (1 << 64) - 1
+_CHUNK_BOUNDARY_MASK = CHUNK_AVG_BYTES - 1
+# Random (but fixed) 64-bit value per byte for the gear rolling hash.
+_GEAR_TABLE = [
+    int.from_bytes(hashlib.sha256(f"gear-{i}".encode()).digest()[:8], "big")
+    for i in range(256)
+]
+
+
+def split_into_chunks(data: bytes) -> List[bytes]:
+    chunks = []
+    start = 0
+    rolling_hash = 0
+    gear_table = _GEAR_TABLE
+    for i, byte in enumerate(data):
+        rolling_hash = ((rolling_hash << 1) + gear_table[byte]) & _UINT64_MASK
+        chunk_len = i + 1 - start
+        if chunk_len < CHUNK_MIN_BYTES:
+            continue
+        # The top bits are the best mixed ones in a gear hash.
+        if (
+            rolling_hash >> 48
+        ) & _CHUNK_BOUNDARY_MASK == 0 or chunk_len >= CHUNK_MAX_BYTES:
+            chunks.append(data[start : i + 1])
+            start = i + 1
+            rolling_hash = 0
+    if start < len(data) or len(data) == 0:
+        chunks.append(data[start:])
+    return chunks
+
+
+def content_hash(chunk: bytes) -> str:
+    return hashlib.sha256(chunk).hexdigest()
+
+
+def _batches(items: List, batch_size: int = BLOB_QUERY_BATCH_SIZE) -> Iterable[List]:
+    for i in range(0, len(items), batch_size):
+        yield items[i : i + batch_size]
+
+
+# Stores the texts as deduplicated, compressed chunks in the prompt_blob table,
+# returns the list of chunk hashes per text (to be stored in prompt_log).
+def store_texts(texts: List[str]) -> List[List[str]]:
+    chunk_hashes_per_text: List[List[str]] = []
+    chunks_by_hash: Dict[str, bytes] = {}
+    for text in texts:
+        chunk_hashes = []
+        for chunk in split_into_chunks(text.encode("utf-8")):
+            chunk_hash = content_hash(chunk)
+            chunks_by_hash[chunk_hash] = chunk
+            chunk_hashes.append(chunk_hash)
+        chunk_hashes_per_text.append(chunk_hashes)
+
+    # Most of the chunks are usually there already, so we only send over the new ones.
+    # Touching referenced_at of the existing ones keeps them safe from the orphan garbage collection.
+    new_hashes = set(chunks_by_hash.keys())
+    for hashes_batch in _batches(list(chunks_by_hash.keys())):
+        existing = (
+            BasePromptBlob.update(referenced_at=fn.now())
+            .where(BasePromptBlob.content_hash.in_(hashes_batch))
+            .returning(BasePromptBlob.content_hash)
+            .execute()
+        )
+        new_hashes.difference_update(row.content_hash for row in existing)
+
+    rows = [
+        {
+            "content_hash": chunk_hash,
+            "data": zlib.compress(chunks_by_hash[chunk_hash], ZLIB_LEVEL),
+            "size_bytes": len(chunks_by_hash[chunk_hash]),
+        }
+        for chunk_hash in sorted(new_hashes)
+    ]
+    for rows_batch in _batches(rows):
+        BasePromptBlob.insert_many(rows_batch).on_conflict_ignore().execute()
+    if len(rows) > 0:
+        print(
+            f"prompt_blob: stored {len(rows)} new out of {len(chunks_by_hash)} chunks"
+        )
+    return chunk_hashes_per_text
+
+
+# The inverse of store_texts, with one query per BLOB_QUERY_BATCH_SIZE chunks for all the texts.
+def load_texts(chunk_hashes_per_text: List[List[str]]) -> List[str]:
+    all_hashes = list(
+        {
+            chunk_hash
+            for chunk_hashes in chunk_hashes_per_text
+            for chunk_hash in chunk_hashes
+        }
+    )
+    chunks_by_hash: Dict[str, bytes] = {}
+    for hashes_batch in _batches(all_hashes):
+        for row in BasePromptBlob.select(
+            BasePromptBlob.content_hash, BasePromptBlob.data
+        ).where(BasePromptBlob.content_hash.in_(hashes_batch)):
+            chunks_by_hash[row.content_hash] = zlib.decompress(bytes(row.data))
+
+    missing = [
+        chunk_hash for chunk_hash in all_hashes if chunk_hash not in chunks_by_hash
+    ]
+    if len(missing) > 0:
+        raise ValueError(
+            f"prompt_blob is missing {len(missing)} chunks, e.g. {missing[0]}"
+        )
+    # Joined as bytes, as a chunk boundary can split a multi-byte character.
+    return [
+        b"".join(chunks_by_hash[chunk_hash] for chunk_hash in chunk_hashes).decode(
+            "utf-8"
+        )
+        for chunk_hashes in chunk_hashes_per_text
+    ]
@@ -29,13 +29,109 @@ DEBUG_RECIPIENTS = []  # used to be a google group
 RESPONSE_EMAILS_WAIT_BETWEEN_EMAILS_SECONDS = int(
     os.environ.get("RESPONSE_EMAILS_WAIT_BETWEEN_EMAILS_SECONDS", 30)
 )
+# The delayed emails are sent from the email_log outbox by dispatch_scheduled_emails, which runs at the end of
+# every invocation AND on a scheduled (EventBridge, every minute, see deploy_lambda_container.sh) invocation.
+# The latter keeps draining the outbox for up to this many seconds, so emails due in-between two scheduled
+# invocations still go out on time.
+EMAIL_OUTBOX_DISPATCH_WINDOW_SECONDS = int(
+    os.environ.get("EMAIL_OUTBOX_DISPATCH_WINDOW_SECONDS", 55)
+)
+# The invocation which scheduled the emails drains the outbox until this many seconds before its own timeout,
+# so its paced emails go out even without the scheduled invocations.
+EMAIL_OUTBOX_DRAIN_TIMEOUT_MARGIN_SECONDS = int(
+    os.environ.get("EMAIL_OUTBOX_DRAIN_TIMEOUT_MARGIN_SECONDS", 30)
+)
+# A dispatcher leases the email before sending, if it dies (or SES fails) the email is retried once the lease is over.
+EMAIL_OUTBOX_CLAIM_LEASE_SECONDS = int(
+    os.environ.get("EMAIL_OUTBOX_CLAIM_LEASE_SECONDS", 5 * 60)
+)
+EMAIL_OUTBOX_MAX_SEND_ATTEMPTS = int(
+    os.environ.get("EMAIL_OUTBOX_MAX_SEND_ATTEMPTS", 5)
+)
 
 GOOGLE_FORMS_SERVICE_ACCOUNT_PRIVATE_KEY = os.environ.get(
     "GOOGLE_FORMS_SERVICE_ACCOUNT_PRIVATE_KEY", ""
 ).replace("|", "\n")
 
+# TMP STORAGE STUFF
+# Lambda ephemeral storage is 512MB by default (configurable up to 10GB), keep some headroom.
+TMP_DISK_BUDGET_MB = int(os.environ.get("TMP_DISK_BUDGET_MB", 480))
+CONVERTED_AUDIO_CACHE_MAX_MB = int(os.environ.get("CONVERTED_AUDIO_CACHE_MAX_MB", 128))
+
+# AUDIO STUFF
+# One of input.ffmpeg_utils.AUDIO_PROFILES, "speech" trades audio fidelity for way smaller files.
+FFMPEG_AUDIO_PROFILE = os.environ.get("FFMPEG_AUDIO_PROFILE", "default")
+# Max ffmpeg processes at the same time across all threads, e.g. when converting multiple email attachments.
+FFMPEG_MAX_CONCURRENCY = int(
+    os.environ.get("FFMPEG_MAX_CONCURRENCY", os.cpu_count() or 2)
+)
+# Local loudness / pause analysis which skips silent recordings and trims long silences before Whisper.
+AUDIO_PRESCREEN_ENABLED = os.environ.get("AUDIO_PRESCREEN_ENABLED", "1")
+
 # OPENAI STUFF
 OPEN_AI_API_KEY: str = os.environ.get("OPEN_AI_API_KEY")
+# How many Whisper chunks of one recording are transcribed at the same time.
+TRANSCRIPTION_MAX_CONCURRENCY = int(os.environ.get("TRANSCRIPTION_MAX_CONCURRENCY", 4))
+TRANSCRIPTION_MAX_RETRIES = int(os.environ.get("TRANSCRIPTION_MAX_RETRIES", 2))
+# Max in-flight Whisper requests across all recordings (attachments) and their chunks.
+WHISPER_MAX_CONCURRENT_REQUESTS = int(
+    os.environ.get("WHISPER_MAX_CONCURRENT_REQUESTS", 8)
+)
+# Content-addressed Whisper results in the transcription_log table, safe to use in prod.
+TRANSCRIPTION_CACHE_ENABLED = os.environ.get("TRANSCRIPTION_CACHE_ENABLED", "1")
+# How many people of one recording are summarized (and drafted for) at the same time.
+PEOPLE_SUMMARIZATION_MAX_CONCURRENCY = int(
+    os.environ.get("PEOPLE_SUMMARIZATION_MAX_CONCURRENCY", 6)
+)
+# How many windows of a long transcript are searched for people at the same time.
+TRANSCRIPT_WINDOWS_MAX_CONCURRENCY = int(
+    os.environ.get("TRANSCRIPT_WINDOWS_MAX_CONCURRENCY", 4)
+)
+# Requests / tokens per minute token buckets per model shared through Postgres, see common/rate_limiter.py.
+OPENAI_RATE_LIMITER_ENABLED = os.environ.get("OPENAI_RATE_LIMITER_ENABLED", "1")
+# Which part of the OpenAI quota we aim for, leaves some headroom for the estimates being off.
+OPENAI_RATE_LIMIT_UTILIZATION = float(
+    os.environ.get("OPENAI_RATE_LIMIT_UTILIZATION", 0.9)
+)
+# Max in-flight (or waiting) OpenAI requests per invocation, so one big recording cannot hog the shared buckets.
+OPENAI_MAX_CONCURRENT_REQUESTS = int(
+    os.environ.get("OPENAI_MAX_CONCURRENT_REQUESTS", 8)
+)
+# Prompts which take longer than the p95 of similarly sized prompts get a hedged request, see common/hedging.py.
+GPT_HEDGING_ENABLED = os.environ.get("GPT_HEDGING_ENABLED", "1")
+# By default the hedged request is a duplicate to the same model. Set e.g. to gpt-4o-mini to trade
+# the answer quality of the slow prompts for speed.
+GPT_HEDGE_FALLBACK_MODEL = os.environ.get("GPT_HEDGE_FALLBACK_MODEL", "")
+# In-process LRU in front of the prompt_log cache, survives across warm Lambda invocations.
+PROMPT_CACHE_MEMORY_MAX_ENTRIES = int(
+    os.environ.get("PROMPT_CACHE_MEMORY_MAX_ENTRIES", 2000)
+)
+PROMPT_CACHE_MEMORY_MAX_MB = int(os.environ.get("PROMPT_CACHE_MEMORY_MAX_MB", 64))
+PROMPT_CACHE_MEMORY_TTL_SECONDS = int(
+    os.environ.get("PROMPT_CACHE_MEMORY_TTL_SECONDS", 60 * 60)
+)
+# prompt_log rows are inserted in batches from a background thread, off the latency path.
+PROMPT_LOG_WRITE_BEHIND_ENABLED = os.environ.get("PROMPT_LOG_WRITE_BEHIND_ENABLED", "1")
+PROMPT_LOG_FLUSH_BATCH_SIZE = int(os.environ.get("PROMPT_LOG_FLUSH_BATCH_SIZE", 20))
+PROMPT_LOG_FLUSH_INTERVAL_SECONDS = float(
+    os.environ.get("PROMPT_LOG_FLUSH_INTERVAL_SECONDS", 2)
+)
+# How long we wait for another process running the same prompt, before running it ourselves.
+PROMPT_SINGLE_FLIGHT_MAX_WAIT_SECONDS = float(
+    os.environ.get("PROMPT_SINGLE_FLIGHT_MAX_WAIT_SECONDS", 120)
+)
+# prompt_log prompts and results go to the deduplicated, compressed prompt_blob table, see common/blob_storage.py.
+PROMPT_BLOB_STORAGE_ENABLED = os.environ.get("PROMPT_BLOB_STORAGE_ENABLED", "1")
+# Retention of the prompt cache, see common/prompt_cache_maintenance.py.
+PROMPT_CACHE_RETENTION_DAYS = int(os.environ.get("PROMPT_CACHE_RETENTION_DAYS", 90))
+PROMPT_CACHE_MAX_TOTAL_MB = int(os.environ.get("PROMPT_CACHE_MAX_TOTAL_MB", 2048))
+# Evicted rows are archived as gzipped JSON lines, uploaded to this bucket when in AWS.
+PROMPT_CACHE_ARCHIVE_BUCKET = os.environ.get(
+    "PROMPT_CACHE_ARCHIVE_BUCKET", "prompt-log-archive-voxana"
+)
+PROMPT_CACHE_ARCHIVE_LOCAL_DIR = os.environ.get(
+    "PROMPT_CACHE_ARCHIVE_LOCAL_DIR", "prompt_log_archive"
+)
 
 # SUPABASE / POSTGRES STUFF
 GOTRUE_URL = os.environ.get("GOTRUE_URL")
@@ -1,10 +1,188 @@
+import atexit
+import threading
+import time
+import traceback
+import uuid
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
 from gpt_form_filler.openai_client import CacheStoreBase, PromptCacheEntry
-from peewee import InterfaceError
+from peewee import IntegrityError, InterfaceError, fn
+
+from common.blob_storage import load_texts, store_texts
+from common.config import (
+    PROMPT_BLOB_STORAGE_ENABLED,
+    PROMPT_CACHE_MEMORY_MAX_ENTRIES,
+    PROMPT_CACHE_MEMORY_MAX_MB,
+    PROMPT_CACHE_MEMORY_TTL_SECONDS,
+    PROMPT_LOG_FLUSH_BATCH_SIZE,
+    PROMPT_LOG_FLUSH_INTERVAL_SECONDS,
+    PROMPT_LOG_WRITE_BEHIND_ENABLED,
+)
+from database.models import BasePromptLog, BaseTranscriptionLog
+
+
+# Moves the prompt and result texts into prompt_blob, the returned rows only reference them.
+def _with_texts_in_blobs(rows: List[Dict]) -> List[Dict]:
+    if str(PROMPT_BLOB_STORAGE_ENABLED) != "1":
+        return rows
+    texts = [row["prompt"] for row in rows] + [row["result"] for row in rows]
+    chunk_hashes = store_texts(texts)
+    result = []
+    for i, row in enumerate(rows):
+        blob_row = dict(row)
+        blob_row["prompt"] = None
+        blob_row["result"] = None
+        blob_row["prompt_chunk_hashes"] = chunk_hashes[i]
+        blob_row["result_chunk_hashes"] = chunk_hashes[len(rows) + i]
+        result.append(blob_row)
+    return result
+
+
+def _insert_prompt_log_rows(rows: List[Dict]):
+    BasePromptLog.insert_many(_with_texts_in_blobs(rows)).on_conflict_ignore().execute()
+
+
+def _update_prompt_log_last_hit_at(prompt_log_ids: List[int]):
+    BasePromptLog.update(last_hit_at=fn.now()).where(BasePromptLog.id.in_(prompt_log_ids)).execute()
+
+
+# Write-behind buffer for the prompt_log rows: write_cache only appends here, and a background thread
+# flushes them with multi-row inserts when there are `batch_size` of them, or every `interval_seconds`.
+# The Lambda handler flushes at the end of the invocation, as the background thread is frozen in-between.
+# Until flushed, the rows are served from here (read-your-writes).
+# The cache hits (for the retention, see common/prompt_cache_maintenance.py) are recorded the same way.
+class PromptLogWriteBehind:
+    def __init__(
+        self,
+        batch_size: int = PROMPT_LOG_FLUSH_BATCH_SIZE,
+        interval_seconds: float = PROMPT_LOG_FLUSH_INTERVAL_SECONDS,
+        insert_rows_fn: Callable[[List[Dict]], None] = _insert_prompt_log_rows,
+        update_hits_fn: Callable[[List[int]], None] = _update_prompt_log_last_hit_at,
+    ):
+        self.batch_size = max(1, batch_size)
+        self.interval_seconds = interval_seconds
+        self.insert_rows_fn = insert_rows_fn
+        self.update_hits_fn = update_hits_fn
+        self.lock = threading.Lock()
+        # Only one flush at a time, so rows are not inserted twice.
+        self.flush_lock = threading.Lock()
+        self.pending: "OrderedDict[Tuple[str, str], Dict]" = OrderedDict()
+        self.hit_ids: Set[int] = set()
+        self.wakeup = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def _ensure_thread(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="prompt-log-write-behind", daemon=True)
+            self.thread.start()
+
+    def add(self, row: Dict):
+        with self.lock:
+            self.pending[(row["prompt_hash"], row["model"])] = row
+            self._ensure_thread()
+            if len(self.pending) >= self.batch_size:
+                self.wakeup.set()
+
+    def record_hit(self, prompt_log_id: int):
+        with self.lock:
+            self.hit_ids.add(prompt_log_id)
+            self._ensure_thread()
+
+    def get_pending(self, prompt_hash: str, model: str) -> Optional[Dict]:
+        with self.lock:
+            return self.pending.get((prompt_hash, model))
+
+    def _run(self):
+        while True:
+            self.wakeup.wait(self.interval_seconds)
+            self.wakeup.clear()
+            self.flush()
+
+    def _flush_hits(self):
+        with self.lock:
+            hit_ids = sorted(self.hit_ids)
+            self.hit_ids = set()
+        if len(hit_ids) == 0:
+            return
+        try:
+            self.update_hits_fn(hit_ids)
+        except Exception as e:
+            # Worst case these get evicted a bit sooner.
+            print(f"WARNING: failed to record {len(hit_ids)} gpt prompt cache hits: {e}")
+
+    # Returns the number of flushed rows.
+    def flush(self) -> int:
+        with self.flush_lock:
+            self._flush_hits()
+            with self.lock:
+                rows = list(self.pending.values())
+            if len(rows) == 0:
+                return 0
+
+            try:
+                for i in range(0, len(rows), self.batch_size):
+                    self.insert_rows_fn(rows[i:i + self.batch_size])
+            except InterfaceError:
+                print(f"DB NOT connected, dropping {len(rows)} gpt prompt cache entries")
+            except Exception as e:
+                # The prompt cache is best-effort, we do not want to retry forever.
+                print(f"ERROR: failed to flush {len(rows)} gpt prompt cache entries: {e}")
+                traceback.print_exc()
 
-from database.models import BasePromptLog
+            self._remove_flushed(rows)
+            return len(rows)
+
+    # Flushes only the row of this prompt (if pending), e.g. before another process waits for it.
+    def flush_row(self, prompt_hash: str, model: str) -> bool:
+        with self.flush_lock:
+            row = self.get_pending(prompt_hash, model)
+            if row is None:
+                return False
+            try:
+                self.insert_rows_fn([row])
+            except InterfaceError:
+                print(f"DB NOT connected, dropping gpt prompt cache entry {prompt_hash}")
+            except Exception as e:
+                print(f"ERROR: failed to flush gpt prompt cache entry {prompt_hash}: {e}")
+                traceback.print_exc()
+            self._remove_flushed([row])
+            return True
+
+    def _remove_flushed(self, rows: List[Dict]):
+        with self.lock:
+            for row in rows:
+                key = (row["prompt_hash"], row["model"])
+                # Unless it got re-written in the meantime.
+                if self.pending.get(key) is row:
+                    del self.pending[key]
+
+
+prompt_log_write_behind = PromptLogWriteBehind()
+
+
+def flush_prompt_log_writes():
+    flushed_count = prompt_log_write_behind.flush()
+    if flushed_count > 0:
+        print(f"flushed {flushed_count} gpt prompt cache entries")
+
+
+def flush_prompt_log_row(prompt_hash: str, model: str):
+    if prompt_log_write_behind.flush_row(prompt_hash, model):
+        print(f"flushed gpt prompt cache entry {prompt_hash} for {model}")
+
+
+# For the scripts (e.g. research/), the Lambda handler flushes explicitly.
+atexit.register(flush_prompt_log_writes)
 
 
 class InDatabaseCacheStorage(CacheStoreBase):
+    def __init__(self, write_behind: Optional[PromptLogWriteBehind] = None):
+        if write_behind is None and str(PROMPT_LOG_WRITE_BEHIND_ENABLED) == "1":
+            write_behind = prompt_log_write_behind
+        self.write_behind = write_behind
+
     def maybe_get(self, prompt: str, model: str) -> PromptCacheEntry:
         pce = PromptCacheEntry(
             prompt=prompt,
@@ -12,16 +190,47 @@ class InDatabaseCacheStorage(CacheStoreBase):
         )
 
         prompt_hash = pce.prompt_hash()
+        pending_row = None if self.write_behind is None else self.write_behind.get_pending(prompt_hash, model)
+        if pending_row is not None:
+            pce.result = pending_row["result"]
+            pce.prompt_tokens = pending_row["prompt_tokens"]
+            pce.completion_tokens = pending_row["completion_tokens"]
+            pce.request_time_ms = pending_row["request_time_ms"]
+            return pce
+
         try:
-            cached_prompt_log: BasePromptLog = BasePromptLog.get(
-                BasePromptLog.prompt_hash == prompt_hash, BasePromptLog.model == model
+            # The prompt is not needed for a hit, and it is the largest column.
+            cached_prompt_log: BasePromptLog = (
+                BasePromptLog.select(
+                    BasePromptLog.id,
+                    BasePromptLog.result,
+                    BasePromptLog.result_chunk_hashes,
+                    BasePromptLog.prompt_tokens,
+                    BasePromptLog.completion_tokens,
+                    BasePromptLog.request_time_ms,
+                )
+                .where(BasePromptLog.prompt_hash == prompt_hash, BasePromptLog.model == model)
+                .get()
             )
+            if cached_prompt_log.result is None and cached_prompt_log.result_chunk_hashes is not None:
+                [cached_prompt_log.result] = load_texts([cached_prompt_log.result_chunk_hashes])
         except BasePromptLog.DoesNotExist:
             return pce
         except InterfaceError:
             print("DB NOT connected, NOT using gpt prompt caching")
             return pce
+        except ValueError as e:
+            # Treat it as a miss, the fresh result is written again.
+            print(f"WARNING: cannot load cached result for {prompt_hash}: {e}")
+            return pce
 
+        if self.write_behind is not None:
+            self.write_behind.record_hit(cached_prompt_log.id)
+        else:
+            try:
+                _update_prompt_log_last_hit_at([cached_prompt_log.id])
+            except Exception as e:
+                print(f"WARNING: failed to record gpt prompt cache hit: {e}")
         pce.result = cached_prompt_log.result
         pce.prompt_tokens = cached_prompt_log.prompt_tokens
         pce.completion_tokens = cached_prompt_log.completion_tokens
@@ -29,18 +238,223 @@ class InDatabaseCacheStorage(CacheStoreBase):
         return pce
 
     def write_cache(self, pce: PromptCacheEntry) -> None:
-        cached_prompt_log = BasePromptLog(
-            model=pce.model,
-            prompt=pce.prompt,
-            prompt_hash=pce.prompt_hash(),
+        row = {
+            "model": pce.model,
+            "prompt": pce.prompt,
+            "prompt_hash": pce.prompt_hash(),
+            "result": pce.result,
+            "prompt_tokens": pce.prompt_tokens,
+            "completion_tokens": pce.completion_tokens,
+            "request_time_ms": pce.request_time_ms,
+        }
+        if self.write_behind is not None:
+            self.write_behind.add(row)
+            return
+
+        try:
+            BasePromptLog.insert(_with_texts_in_blobs([row])[0]).execute()
+        # TODO(P3, reliability): There is an edge case when two threads running the same prompt
+        except InterfaceError:
+            print("DB NOT connected, NOT using gpt prompt caching")
+        except IntegrityError:
+            # E.g. the losing hedged request of the same model, the first answer is already cached.
+            print(f"prompt {pce.prompt_hash()} for {pce.model} already cached")
+
+
+@dataclass
+class CachedPromptResult:
+    result: str
+    prompt_tokens: int
+    completion_tokens: int
+    request_time_ms: int
+    size_bytes: int
+    expires_at: float
+
+    def fill_in(self, pce: PromptCacheEntry) -> PromptCacheEntry:
+        pce.result = self.result
+        pce.prompt_tokens = self.prompt_tokens
+        pce.completion_tokens = self.completion_tokens
+        pce.request_time_ms = self.request_time_ms
+        return pce
+
+
+# Only the results are kept (not the large prompts), keyed by (prompt_hash, model), bounded by both entries and bytes.
+# NOTE: Misses are not cached, as the miss is followed by the write_cache of the fresh result.
+class InMemoryPromptCache:
+    def __init__(
+        self,
+        max_entries: int = PROMPT_CACHE_MEMORY_MAX_ENTRIES,
+        max_bytes: int = PROMPT_CACHE_MEMORY_MAX_MB * 1024 * 1024,
+        ttl_seconds: int = PROMPT_CACHE_MEMORY_TTL_SECONDS,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.lock = threading.Lock()
+        # Least recently used first.
+        self.entries: "OrderedDict[Tuple[str, str], CachedPromptResult]" = OrderedDict()
+        self.total_bytes = 0
+
+    def get(self, prompt_hash: str, model: str) -> Optional[CachedPromptResult]:
+        key = (prompt_hash, model)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires_at < time.monotonic():
+                self._remove(key)
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def put(self, prompt_hash: str, model: str, pce: PromptCacheEntry):
+        key = (prompt_hash, model)
+        size_bytes = len(pce.result.encode("utf-8"))
+        if size_bytes > self.max_bytes:
+            return
+        entry = CachedPromptResult(
             result=pce.result,
             prompt_tokens=pce.prompt_tokens,
             completion_tokens=pce.completion_tokens,
             request_time_ms=pce.request_time_ms,
+            size_bytes=size_bytes,
+            expires_at=time.monotonic() + self.ttl_seconds,
         )
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = entry
+            self.total_bytes += size_bytes
+            while len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+
+    def _remove(self, key: Tuple[str, str]):
+        self.total_bytes -= self.entries.pop(key).size_bytes
+
+    def __len__(self):
+        return len(self.entries)
+
+
+# Shared across warm Lambda invocations, as the gpt clients are created per invocation.
+prompt_memory_cache = InMemoryPromptCache()
+# E.g. {"memory_hit": 10, "memory_miss": 3, "db_hit": 1, "db_miss": 2}
+prompt_cache_stats: Counter = Counter()
+_prompt_cache_stats_lock = threading.Lock()
+
+
+def _count(stat: str):
+    with _prompt_cache_stats_lock:
+        prompt_cache_stats[stat] += 1
+
+
+# Repeated lookups (within one invocation, or across warm ones) are served from memory,
+# without the Postgres round trip of InDatabaseCacheStorage.
+class TwoTierCacheStorage(CacheStoreBase):
+    def __init__(
+        self,
+        db_cache: Optional[InDatabaseCacheStorage] = None,
+        memory_cache: Optional[InMemoryPromptCache] = None,
+    ):
+        self.db_cache = db_cache if db_cache is not None else InDatabaseCacheStorage()
+        self.memory_cache = memory_cache if memory_cache is not None else prompt_memory_cache
+
+    def maybe_get(self, prompt: str, model: str) -> PromptCacheEntry:
+        pce = PromptCacheEntry(prompt=prompt, model=model)
+        prompt_hash = pce.prompt_hash()
+        cached = self.memory_cache.get(prompt_hash, model)
+        if cached is not None:
+            _count("memory_hit")
+            return cached.fill_in(pce)
+        _count("memory_miss")
 
+        pce = self.db_cache.maybe_get(prompt, model)
+        if pce.result is None:
+            _count("db_miss")
+            return pce
+        _count("db_hit")
+        self.memory_cache.put(prompt_hash, model, pce)
+        return pce
+
+    def write_cache(self, pce: PromptCacheEntry) -> None:
+        if pce.result is not None:
+            self.memory_cache.put(pce.prompt_hash(), pce.model, pce)
+        self.db_cache.write_cache(pce)
+
+
+# Identifies the audio of a chunk for the InDatabaseTranscriptionCache, built by the input layer which knows
+# how to decode it (see input.ffmpeg_utils.transcription_cache_key). `content_hash` is of the decoded audio,
+# the fingerprint and duration are only needed on a miss, so they are computed on demand.
+@dataclass
+class TranscriptionCacheKey:
+    content_hash: str
+    get_audio_fingerprint: Callable[[], Optional[str]]
+    get_duration_ms: Callable[[], Optional[int]]
+
+
+# Content-addressed, i.e. keyed by the audio which was actually sent to Whisper instead of the (tmp) file path.
+# So it is safe to use in AWS: S3 re-deliveries, manual re-runs and duplicate attachments all hit the cache.
+class InDatabaseTranscriptionCache:
+    def maybe_get(self, content_hash: str, model: str) -> Optional[str]:
         try:
-            cached_prompt_log.save()
-        # TODO(P3, reliability): There is an edge case when two threads running the same prompt
+            cached_log = BaseTranscriptionLog.get_or_none(
+                BaseTranscriptionLog.content_hash == content_hash,
+                BaseTranscriptionLog.model == model,
+            )
+        except InterfaceError:
+            print("DB NOT connected, NOT using transcription caching")
+            return None
+
+        if cached_log is None:
+            return None
+        print(f"transcription cache hit for {content_hash} (originally took {cached_log.request_time_ms} ms)")
+        return cached_log.result
+
+    # Same recording which arrived re-encoded through a different channel (e.g. the app upload and an email).
+    # The fingerprint is coarse, so we only ever match the same account's recordings of the exact same duration,
+    # otherwise we could serve someone else's transcript.
+    def maybe_get_by_fingerprint(
+        self, audio_fingerprint: str, duration_ms: int, account_id: uuid.UUID, model: str
+    ) -> Optional[str]:
+        try:
+            cached_log = (
+                BaseTranscriptionLog.select()
+                .where(
+                    BaseTranscriptionLog.account == account_id,
+                    BaseTranscriptionLog.audio_fingerprint == audio_fingerprint,
+                    BaseTranscriptionLog.duration_ms == duration_ms,
+                    BaseTranscriptionLog.model == model,
+                )
+                .order_by(BaseTranscriptionLog.created_at.desc())
+                .first()
+            )
+        except InterfaceError:
+            print("DB NOT connected, NOT using transcription caching")
+            return None
+
+        if cached_log is None:
+            return None
+        print(f"transcription cache hit for fingerprint {audio_fingerprint} of account {account_id}")
+        return cached_log.result
+
+    def write_cache(
+        self,
+        content_hash: str,
+        model: str,
+        result: str,
+        request_time_ms: int,
+        audio_fingerprint: Optional[str] = None,
+        duration_ms: Optional[int] = None,
+        account_id: Optional[uuid.UUID] = None,
+    ) -> None:
+        try:
+            BaseTranscriptionLog.insert(
+                account=account_id,
+                content_hash=content_hash,
+                model=model,
+                result=result,
+                request_time_ms=request_time_ms,
+                audio_fingerprint=audio_fingerprint,
+                duration_ms=duration_ms,
+            ).on_conflict_ignore().execute()
         except InterfaceError:
-            print("DB NOT connected, NOT using gpt prompt caching")
\ No newline at end of file
+            print("DB NOT connected, NOT using transcription caching")
@@ -1,8 +1,229 @@
-from gpt_form_filler.openai_client import OpenAiClient
+import contextlib
+import threading
+import uuid
+from typing import Optional
 
-from common.config import OPEN_AI_API_KEY
-from common.gpt_cache import InDatabaseCacheStorage
+from gpt_form_filler.openai_client import (
+    DEFAULT_MODEL,
+    CacheStoreBase,
+    OpenAiClient,
+    PromptCacheEntry,
+)
 
+from common.config import (
+    GPT_HEDGE_FALLBACK_MODEL,
+    GPT_HEDGING_ENABLED,
+    OPEN_AI_API_KEY,
+    OPENAI_RATE_LIMITER_ENABLED,
+)
+from common.gpt_cache import TwoTierCacheStorage, flush_prompt_log_row
+from common.hedging import PromptLatencyStats, record_hedge_path, run_hedged
+from common.rate_limiter import (
+    EXPECTED_COMPLETION_TOKENS,
+    OpenAiRateLimiter,
+    in_rate_limited_call,
+)
+from common.single_flight import PostgresAdvisoryLock, SingleFlight
+from common.tokenizer import count_tokens
 
-def open_ai_client_with_db_cache(force_no_print_prompt=False) -> OpenAiClient:
-    return OpenAiClient(open_ai_api_key=OPEN_AI_API_KEY, cache_store=InDatabaseCacheStorage(), force_no_print_prompt=force_no_print_prompt)
+WHISPER_MODEL = "whisper-1"
+# The form definition (field names, descriptions) which gets added to the text by fill_in_form.
+FILL_IN_FORM_PROMPT_TOKENS = 500
+
+# One per process, so all the threads (and clients) share the in-flight cap and the learned latencies.
+_rate_limiter: Optional[OpenAiRateLimiter] = None
+_latency_stats: Optional[PromptLatencyStats] = None
+# Identical prompts running at the same time (e.g. re-delivered S3 events) only go to OpenAI once.
+# The cache write of the prompt is flushed before unlocking, so the waiting processes find it in prompt_log.
+prompt_single_flight = SingleFlight(cross_process_lock=PostgresAdvisoryLock())
+
+
+def get_rate_limiter() -> OpenAiRateLimiter:
+    global _rate_limiter
+    if _rate_limiter is None:
+        _rate_limiter = OpenAiRateLimiter()
+    return _rate_limiter
+
+
+def get_latency_stats() -> PromptLatencyStats:
+    global _latency_stats
+    if _latency_stats is None:
+        _latency_stats = PromptLatencyStats()
+    return _latency_stats
+
+
+# Hands our own cache lookup over to OpenAiClient.run_prompt, so each call looks the prompt up (and counts it
+# in prompt_cache_stats) only once. Per thread, and only for the very next lookup of the same prompt and model.
+class _LookedUpCacheStore(CacheStoreBase):
+    def __init__(self, cache_store: CacheStoreBase):
+        self.cache_store = cache_store
+        self.looked_up = threading.local()
+
+    def remember(self, pce: Optional[PromptCacheEntry]):
+        self.looked_up.pce = pce
+
+    def maybe_get(self, prompt: str, model: str) -> PromptCacheEntry:
+        pce = getattr(self.looked_up, "pce", None)
+        self.looked_up.pce = None
+        if pce is not None and pce.prompt == prompt and pce.model == model:
+            return pce
+        return self.cache_store.maybe_get(prompt, model)
+
+    def write_cache(self, pce: PromptCacheEntry) -> None:
+        self.cache_store.write_cache(pce)
+
+
+# Waits for the shared OpenAI rate limits before every request, instead of everyone hitting 429s and backing off.
+# Cache hits do not count against the limits. With `rate_limiter` None the requests go out right away.
+# The requests are queued per `account_id`, see set_rate_limited_account.
+# Concurrent identical prompts are deduplicated with `prompt_single_flight`.
+class RateLimitedOpenAiClient(OpenAiClient):
+    def __init__(
+        self,
+        rate_limiter: Optional[OpenAiRateLimiter],
+        cache_store: Optional[CacheStoreBase] = None,
+        account_id: Optional[uuid.UUID] = None,
+        **kwargs,
+    ):
+        self.looked_up_cache_store = (
+            _LookedUpCacheStore(cache_store) if cache_store is not None else None
+        )
+        super().__init__(cache_store=self.looked_up_cache_store, **kwargs)
+        self.rate_limiter = rate_limiter
+        self.account_id = account_id
+
+    def _limit(self, model: str, token_count: int):
+        if self.rate_limiter is None:
+            return contextlib.nullcontext()
+        return self.rate_limiter.limit(model, token_count, account_id=self.account_id)
+
+    # Returns the cache entry (with `result` None on a miss), or None without a cache.
+    def _lookup(self, prompt: str, model: str) -> Optional[PromptCacheEntry]:
+        if self.looked_up_cache_store is None:
+            return None
+        return self.looked_up_cache_store.cache_store.maybe_get(prompt, model)
+
+    def run_prompt(self, prompt: str, model: str = DEFAULT_MODEL, **kwargs) -> str:
+        # E.g. called by fill_in_form, which already waited for the limits. The hedged requests would run
+        # on other threads, and take more in-flight slots while this thread holds one.
+        if in_rate_limited_call():
+            return super().run_prompt(prompt, model=model, **kwargs)
+        pce = self._lookup(prompt, model)
+        if pce is not None and pce.result is not None:
+            return pce.result
+        prompt_hash = PromptCacheEntry(prompt=prompt, model=model).prompt_hash()
+        return prompt_single_flight.run(
+            f"prompt:{prompt_hash}:{model}",
+            lambda: self._run_uncached_prompt(prompt, model, looked_up=pce, **kwargs),
+            before_release=lambda: flush_prompt_log_row(prompt_hash, model),
+            # The process we waited for (likely) just cached it.
+            after_waiting=lambda: self._cached_result(prompt, model),
+        )
+
+    def _cached_result(self, prompt: str, model: str) -> Optional[str]:
+        pce = self._lookup(prompt, model)
+        return None if pce is None else pce.result
+
+    # `looked_up` is the cache miss of `model`, so OpenAiClient.run_prompt does not look it up again.
+    def _run_uncached_prompt(
+        self,
+        prompt: str,
+        model: str,
+        looked_up: Optional[PromptCacheEntry] = None,
+        **kwargs,
+    ) -> str:
+        with self._limit(model, count_tokens(prompt) + EXPECTED_COMPLETION_TOKENS):
+            if self.looked_up_cache_store is not None:
+                self.looked_up_cache_store.remember(looked_up)
+            return super().run_prompt(prompt, model=model, **kwargs)
+
+    # TODO(P2, cost): The form prompt is built inside gpt_form_filler, so we cannot check its cache upfront.
+    def fill_in_form(self, form, text: str, model: str = DEFAULT_MODEL, **kwargs):
+        token_count = (
+            count_tokens(text) + FILL_IN_FORM_PROMPT_TOKENS + EXPECTED_COMPLETION_TOKENS
+        )
+        with self._limit(model, token_count):
+            return super().fill_in_form(form=form, text=text, model=model, **kwargs)
+
+    # Whisper is limited by requests only.
+    def transcribe_audio(self, audio_filepath: str, **kwargs) -> str:
+        with self._limit(WHISPER_MODEL, 0):
+            return super().transcribe_audio(audio_filepath=audio_filepath, **kwargs)
+
+
+# The slowest prompt sets the pace of the whole pipeline. When a prompt takes longer than the p95 of the model
+# for its prompt size, we also send it once more (to `hedge_model` if set), and take whichever answer comes first.
+class HedgedOpenAiClient(RateLimitedOpenAiClient):
+    def __init__(
+        self,
+        latency_stats: PromptLatencyStats,
+        hedge_model: str = GPT_HEDGE_FALLBACK_MODEL,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.latency_stats = latency_stats
+        self.hedge_model = hedge_model
+
+    def _run_uncached_prompt(
+        self,
+        prompt: str,
+        model: str,
+        looked_up: Optional[PromptCacheEntry] = None,
+        **kwargs,
+    ) -> str:
+        hedge_model = self.hedge_model if self.hedge_model else model
+        result, path = run_hedged(
+            primary_fn=lambda: super(HedgedOpenAiClient, self)._run_uncached_prompt(
+                prompt, model, looked_up=looked_up, **kwargs
+            ),
+            hedge_fn=lambda: super(HedgedOpenAiClient, self)._run_uncached_prompt(
+                prompt, hedge_model, **kwargs
+            ),
+            deadline_seconds=self.latency_stats.get_deadline_seconds(
+                model, count_tokens(prompt)
+            ),
+        )
+        record_hedge_path(model, path)
+        print(
+            f"run_prompt for {model} answered by the {path} request (hedge model {hedge_model})"
+        )
+        return result
+
+
+# The client is usually created before we know whose upload it is, so the input handlers set it once they do.
+# The rate limiter then takes turns between the accounts, instead of serving a big recording first.
+def set_rate_limited_account(
+    gpt_client: OpenAiClient, account_id: Optional[uuid.UUID]
+) -> None:
+    if isinstance(gpt_client, RateLimitedOpenAiClient):
+        gpt_client.account_id = account_id
+
+
+def open_ai_client_with_db_cache(
+    force_no_print_prompt=False, account_id: Optional[uuid.UUID] = None
+) -> OpenAiClient:
+    rate_limiter = (
+        get_rate_limiter() if str(OPENAI_RATE_LIMITER_ENABLED) == "1" else None
+    )
+    if str(GPT_HEDGING_ENABLED) == "1":
+        return HedgedOpenAiClient(
+            latency_stats=get_latency_stats(),
+            rate_limiter=rate_limiter,
+            account_id=account_id,
+            open_ai_api_key=OPEN_AI_API_KEY,
+            cache_store=TwoTierCacheStorage(),
+            force_no_print_prompt=force_no_print_prompt,
+        )
+    if rate_limiter is not None:
+        return RateLimitedOpenAiClient(
+            rate_limiter=rate_limiter,
+            account_id=account_id,
+            open_ai_api_key=OPEN_AI_API_KEY,
+            cache_store=TwoTierCacheStorage(),
+            force_no_print_prompt=force_no_print_prompt,
+        )
+    return OpenAiClient(
+        open_ai_api_key=OPEN_AI_API_KEY,
+        cache_store=TwoTierCacheStorage(),
+        force_no_print_prompt=force_no_print_prompt,
+    )
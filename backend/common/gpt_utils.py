@@ -1,23 +1,220 @@
-from typing import List
+import re
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, List, Optional, Tuple
 
 from gpt_form_filler.openai_client import OpenAiClient
 
-from common.aws_utils import is_running_in_aws
+from common.config import (
+    TRANSCRIPTION_CACHE_ENABLED,
+    TRANSCRIPTION_MAX_CONCURRENCY,
+    TRANSCRIPTION_MAX_RETRIES,
+    WHISPER_MAX_CONCURRENT_REQUESTS,
+)
+from common.gpt_cache import InDatabaseTranscriptionCache, TranscriptionCacheKey
+from common.gpt_client import WHISPER_MODEL
+from common.tmp_storage import get_work_dir
 
+TRANSCRIPTION_RETRY_BACKOFF_SECONDS = 2
+# With WHISPER_API_OVERLAP_MS of 3 seconds, the duplicated part at a seam is about 5-10 words.
+SEAM_MAX_OVERLAP_WORDS = 20
+# Shorter matches are too likely to be just common phrases like "and then I".
+SEAM_MIN_OVERLAP_WORDS = 4
+SEAM_MAX_SKIPPED_HEAD_WORDS = 2
+SEAM_MAX_SKIPPED_TAIL_WORDS = 1
+# Returned when there is nothing to transcribe, e.g. the pre-screen found the recording silent.
+NO_AUDIO_TRANSCRIPT = "NO AUDIO PROVIDED"
 
-def transcribe_audio_chunk_filepaths(gpt_client: OpenAiClient, audio_filepaths: List[str]) -> str:
-    if len(audio_filepaths) == 0:
+transcription_cache = InDatabaseTranscriptionCache()
+# Returns the cache key of an audio chunk file, e.g. input.ffmpeg_utils.transcription_cache_key.
+CacheKeyFn = Callable[[str], Optional[TranscriptionCacheKey]]
+# Each transcribe_audio_chunk_filepaths call has its own pool, this caps the Whisper requests across all of them.
+whisper_request_semaphore = threading.BoundedSemaphore(WHISPER_MAX_CONCURRENT_REQUESTS)
+
+
+def _normalize_word(word: str) -> str:
+    return re.sub(r"[^\w]", "", word.lower())
+
+
+# Returns (index in tail, number of head words to skip) of the longest run of head words re-appearing in the tail.
+# The match has to end at the very end of the tail (or one word before it, as the last word is often cut in half),
+# otherwise a phrase said twice would make us drop the genuine words said after its first occurrence.
+def _find_seam(
+    tail_normalized: List[str], head_normalized: List[str], min_overlap_words: int
+) -> Optional[Tuple[int, int]]:
+    for match_len in range(min(len(head_normalized), len(tail_normalized)), min_overlap_words - 1, -1):
+        # The first word or two of the next chunk can be garbled, as the audio starts mid-word.
+        for head_skip in range(min(SEAM_MAX_SKIPPED_HEAD_WORDS, len(head_normalized) - match_len) + 1):
+            needle = head_normalized[head_skip:head_skip + match_len]
+            last_start = len(tail_normalized) - match_len
+            for i in range(last_start, max(-1, last_start - SEAM_MAX_SKIPPED_TAIL_WORDS - 1), -1):
+                if tail_normalized[i:i + match_len] == needle:
+                    return i, head_skip
+    return None
+
+
+# When two audio chunks overlap, Whisper transcribes the overlapping audio twice. We find where the beginning
+# of the next chunk re-appears in the tail of the previous one, and cut the previous one there.
+# Cutting the previous (rather than the next) chunk also drops the word which was likely cut in half at the seam.
+# `overlapping_seams[i]` tells whether chunk i starts with the (hard cut) overlap of chunk i - 1,
+# the seams cut in a pause have no duplicated words, so we leave them alone. None means all seams overlap.
+def stitch_transcribed_chunks(
+    transcribed_chunks: List[str],
+    overlapping_seams: Optional[List[bool]] = None,
+    max_overlap_words: int = SEAM_MAX_OVERLAP_WORDS,
+    min_overlap_words: int = SEAM_MIN_OVERLAP_WORDS,
+) -> str:
+    result_words: List[str] = []
+    for chunk_index, chunk in enumerate(transcribed_chunks):
+        next_words = chunk.split()
+        if overlapping_seams is not None and not overlapping_seams[chunk_index]:
+            result_words.extend(next_words)
+            continue
+        tail_start = max(0, len(result_words) - max_overlap_words)
+        seam = _find_seam(
+            tail_normalized=[_normalize_word(word) for word in result_words[tail_start:]],
+            head_normalized=[_normalize_word(word) for word in next_words[:max_overlap_words]],
+            min_overlap_words=min_overlap_words,
+        )
+        if seam is not None:
+            tail_index, head_skip = seam
+            seam_position = tail_start + tail_index
+            print(f"Dropping {len(result_words) - seam_position + head_skip} duplicated words at a chunk seam")
+            result_words = result_words[:seam_position]
+            next_words = next_words[head_skip:]
+        result_words.extend(next_words)
+    return " ".join(result_words)
+
+
+def transcribe_audio_chunk_with_retries(
+    gpt_client: OpenAiClient, filepath: str, max_retries: int = TRANSCRIPTION_MAX_RETRIES
+) -> str:
+    for attempt in range(max_retries + 1):
+        try:
+            # The gpt_client cache is keyed by the filepath which would collide on /tmp/..., we have our own below.
+            with whisper_request_semaphore:
+                return gpt_client.transcribe_audio(
+                    audio_filepath=filepath,
+                    prompt_hint="voice memo",
+                    use_cache_hit=False,
+                )
+        except Exception as err:
+            if attempt >= max_retries:
+                print(f"ERROR: transcribing {filepath} failed after {attempt + 1} attempts: {err}")
+                raise
+            backoff_seconds = TRANSCRIPTION_RETRY_BACKOFF_SECONDS * (2 ** attempt)
+            print(f"WARNING: transcribing {filepath} failed with {err}, retrying in {backoff_seconds} seconds")
+            traceback.print_exc()
+            time.sleep(backoff_seconds)
+
+
+def _transcribe_and_release(
+    gpt_client: OpenAiClient,
+    filepath: str,
+    cache_key_fn: Optional[CacheKeyFn],
+    account_id: Optional[uuid.UUID],
+) -> str:
+    result = transcribe_audio_chunk_with_cache(
+        gpt_client, filepath, cache_key_fn=cache_key_fn, account_id=account_id
+    )
+    # The chunk is consumed, no need to wait until the end of the invocation to free up the disk.
+    get_work_dir().release(filepath)
+    return result
+
+
+# Without `cache_key_fn` the chunk is always transcribed. The audio fingerprint fallback is only used
+# within the same `account_id`, without one we only match the exact same (decoded) audio.
+def transcribe_audio_chunk_with_cache(
+    gpt_client: OpenAiClient,
+    filepath: str,
+    cache_key_fn: Optional[CacheKeyFn] = None,
+    account_id: Optional[uuid.UUID] = None,
+) -> str:
+    cache_key = cache_key_fn(filepath) if cache_key_fn is not None else None
+    if cache_key is None:
+        return transcribe_audio_chunk_with_retries(gpt_client, filepath)
+
+    content_hash = cache_key.content_hash
+    cached_result = transcription_cache.maybe_get(content_hash, model=WHISPER_MODEL)
+    if cached_result is not None:
+        return cached_result
+    # Only computed on a miss, as it requires another (fast) ffmpeg decoding pass.
+    duration_ms = cache_key.get_duration_ms()
+    audio_fingerprint = cache_key.get_audio_fingerprint() if account_id is not None else None
+    if audio_fingerprint is not None and duration_ms is not None:
+        cached_result = transcription_cache.maybe_get_by_fingerprint(
+            audio_fingerprint, duration_ms=duration_ms, account_id=account_id, model=WHISPER_MODEL
+        )
+        if cached_result is not None:
+            # So next time we hit it right away by the content_hash.
+            transcription_cache.write_cache(
+                content_hash,
+                WHISPER_MODEL,
+                cached_result,
+                request_time_ms=0,
+                audio_fingerprint=audio_fingerprint,
+                duration_ms=duration_ms,
+                account_id=account_id,
+            )
+            return cached_result
+
+    start_time = time.time()
+    result = transcribe_audio_chunk_with_retries(gpt_client, filepath)
+    transcription_cache.write_cache(
+        content_hash,
+        WHISPER_MODEL,
+        result,
+        request_time_ms=int((time.time() - start_time) * 1000),
+        audio_fingerprint=audio_fingerprint,
+        duration_ms=duration_ms,
+        account_id=account_id,
+    )
+    return result
+
+
+# `audio_filepaths` can be a lazy iterator (e.g. from ffmpeg_stream_convert_to_whisper_chunks),
+# in which case each chunk gets transcribed as soon as it is produced.
+# The chunks are cached with `cache_key_fn` (when TRANSCRIPTION_CACHE_ENABLED and `use_cache`).
+def transcribe_audio_chunk_filepaths(
+    gpt_client: OpenAiClient,
+    audio_filepaths: Iterable[str],
+    max_concurrency: int = TRANSCRIPTION_MAX_CONCURRENCY,
+    use_cache: bool = TRANSCRIPTION_CACHE_ENABLED == "1",
+    account_id: Optional[uuid.UUID] = None,
+    cache_key_fn: Optional[CacheKeyFn] = None,
+) -> str:
+    if not use_cache:
+        cache_key_fn = None
+    if isinstance(audio_filepaths, list) and len(audio_filepaths) == 1:
+        return _transcribe_and_release(
+            gpt_client, audio_filepaths[0], cache_key_fn=cache_key_fn, account_id=account_id
+        )
+
+    # Whisper requests are IO bound, so threads are good enough. The wall-clock time is then dominated
+    # by the longest chunk rather than the sum of all of them (mind the 15min lambda limit).
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency), thread_name_prefix="transcribe") as executor:
+        futures = []
+        submitted_filepaths = []
+        for filepath in audio_filepaths:
+            futures.append(
+                executor.submit(
+                    _transcribe_and_release, gpt_client, filepath, cache_key_fn=cache_key_fn, account_id=account_id
+                )
+            )
+            submitted_filepaths.append(filepath)
+        # Collecting in the submission order, regardless which finishes first.
+        transcribed_chunks = [future.result() for future in futures]
+    # Only the chunker knows which seams were hard cuts with an overlap (see AudioChunkPath),
+    # plain file paths never overlap.
+    overlapping_seams = [getattr(filepath, "overlaps_previous", False) for filepath in submitted_filepaths]
+
+    if len(transcribed_chunks) == 0:
         print("WARNING: NO AUDIO PROVIDED in process_audio_chunk_filepaths")
-        return "NO AUDIO PROVIDED"
-    if len(audio_filepaths) > 1:
-        # TODO(P2, ux/devx): We can parallelize this, but it's not a priority (15min lambda limit though)
-        print(f"Provided {len(audio_filepaths)} audio files, will process them one-by-one in sequence.")
-
-    transcribed_chunks = [
-        gpt_client.transcribe_audio(
-            audio_filepath=filepath,
-            prompt_hint="voice memo",
-            use_cache_hit=not is_running_in_aws()
-        ) for filepath in audio_filepaths
-    ]
-    return " ".join(transcribed_chunks)
+        return NO_AUDIO_TRANSCRIPT
+    print(f"Transcribed {len(transcribed_chunks)} chunks in {round(time.time() - start_time, 2)} seconds")
+
+    return stitch_transcribed_chunks(transcribed_chunks, overlapping_seams=overlapping_seams)
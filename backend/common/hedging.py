@@ -0,0 +1,177 @@
+import threading
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Tuple
+
+from database.models import BasePromptLog
+
+HEDGE_PERCENTILE = 0.95
+# The request time grows with the prompt, so we learn a deadline per model and prompt size bucket,
+# otherwise every big prompt would be slower than the p95 of the (mostly small) prompts and get hedged.
+# The upper bounds (exclusive) of the prompt_tokens buckets, the last bucket is everything above.
+PROMPT_TOKENS_BUCKET_BOUNDS = [1000, 4000, 16000, 64000]
+# The most recent prompt_log rows of a model and prompt size bucket we learn the deadline from.
+LATENCY_SAMPLE_SIZE = 500
+# With less samples we do not trust the percentile, and do not hedge.
+LATENCY_MIN_SAMPLES = 20
+LATENCY_STATS_TTL_SECONDS = 10 * 60
+# So a fast model with a tiny p95 does not get a duplicate for every other request.
+HEDGE_MIN_DEADLINE_SECONDS = 5.0
+# Every hedged call takes up to two pool threads (until the loser finishes, we cannot cancel it at OpenAI),
+# and each pool thread holds its own Postgres connection. Beyond this many hedged calls we just do not hedge.
+HEDGE_MAX_CONCURRENT_CALLS = 8
+
+PATH_PRIMARY = "primary"
+PATH_HEDGE = "hedge"
+PATH_NOT_HEDGED = "not_hedged"
+
+_hedge_executor = ThreadPoolExecutor(
+    max_workers=2 * HEDGE_MAX_CONCURRENT_CALLS, thread_name_prefix="hedge"
+)
+_hedge_slots = threading.BoundedSemaphore(HEDGE_MAX_CONCURRENT_CALLS)
+# Which path won, for the logs / debugging, e.g. {"gpt-4o:primary": 10, "gpt-4o:hedge": 2}.
+hedge_stats: Counter = Counter()
+_hedge_stats_lock = threading.Lock()
+
+
+def record_hedge_path(model: str, path: str):
+    with _hedge_stats_lock:
+        hedge_stats[f"{model}:{path}"] += 1
+
+
+# Returns the [lower, upper) prompt_tokens bounds of the bucket, upper is None for the last one.
+def prompt_tokens_bucket(prompt_tokens: int) -> Tuple[int, Optional[int]]:
+    lower = 0
+    for upper in PROMPT_TOKENS_BUCKET_BOUNDS:
+        if prompt_tokens < upper:
+            return lower, upper
+        lower = upper
+    return lower, None
+
+
+# The p95 request time per model and prompt size bucket, learned from the request_time_ms of the prompt_log.
+# Queried at most once per LATENCY_STATS_TTL_SECONDS per bucket, as it only changes slowly.
+class PromptLatencyStats:
+    P95_SQL = """
+        SELECT percentile_cont(%s) WITHIN GROUP (ORDER BY request_time_ms), count(*)
+        FROM (
+            SELECT request_time_ms FROM public.prompt_log
+            WHERE model = %s AND request_time_ms > 0 AND prompt_tokens >= %s AND (%s IS NULL OR prompt_tokens < %s)
+            ORDER BY id DESC LIMIT %s
+        ) recent
+    """
+
+    def __init__(
+        self,
+        percentile: float = HEDGE_PERCENTILE,
+        ttl_seconds: int = LATENCY_STATS_TTL_SECONDS,
+    ):
+        self.percentile = percentile
+        self.ttl_seconds = ttl_seconds
+        self.lock = threading.Lock()
+        # (model, bucket lower bound) -> (deadline_seconds or None, fetched_at)
+        self.deadlines: Dict[Tuple[str, int], Tuple[Optional[float], float]] = {}
+
+    def _fetch_deadline_seconds(
+        self, model: str, lower: int, upper: Optional[int]
+    ) -> Optional[float]:
+        cursor = BasePromptLog._meta.database.execute_sql(
+            self.P95_SQL,
+            (self.percentile, model, lower, upper, upper, LATENCY_SAMPLE_SIZE),
+        )
+        percentile_ms, sample_count = cursor.fetchone()
+        if percentile_ms is None or sample_count < LATENCY_MIN_SAMPLES:
+            print(
+                f"not enough latency samples for {model} with {lower}+ prompt tokens ({sample_count}), not hedging"
+            )
+            return None
+        return max(HEDGE_MIN_DEADLINE_SECONDS, float(percentile_ms) / 1000)
+
+    # Returns None when we do not know enough to hedge.
+    def get_deadline_seconds(self, model: str, prompt_tokens: int) -> Optional[float]:
+        lower, upper = prompt_tokens_bucket(prompt_tokens)
+        with self.lock:
+            cached = self.deadlines.get((model, lower))
+        if cached is not None and time.time() - cached[1] < self.ttl_seconds:
+            return cached[0]
+
+        try:
+            deadline_seconds = self._fetch_deadline_seconds(model, lower, upper)
+        except Exception as e:
+            print(f"WARNING: cannot get latency stats for {model}, not hedging: {e}")
+            deadline_seconds = None
+        with self.lock:
+            self.deadlines[(model, lower)] = (deadline_seconds, time.time())
+        if deadline_seconds is not None:
+            print(
+                f"p{int(self.percentile * 100)} deadline for {model} with {lower}+ prompt tokens "
+                f"is {round(deadline_seconds, 2)} seconds"
+            )
+        return deadline_seconds
+
+
+# The hedge slot is only free again once all the requests of the hedged call finished, including the loser.
+def _release_slot_when_done(futures: List[Future]):
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def _on_done(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0] > 0:
+                return
+        _hedge_slots.release()
+
+    for future in futures:
+        future.add_done_callback(_on_done)
+
+
+# Runs `primary_fn`, if it does not finish within `deadline_seconds` it ALSO runs `hedge_fn`,
+# and returns whichever result arrives first, together with which path won.
+# Only when both fail the (primary) error is raised.
+def run_hedged(
+    primary_fn: Callable[[], str],
+    hedge_fn: Callable[[], str],
+    deadline_seconds: Optional[float],
+) -> Tuple[str, str]:
+    if deadline_seconds is None or not _hedge_slots.acquire(blocking=False):
+        return primary_fn(), PATH_NOT_HEDGED
+
+    futures: List[Future] = []
+    try:
+        return _run_hedged_in_slot(primary_fn, hedge_fn, deadline_seconds, futures)
+    finally:
+        if len(futures) > 0:
+            _release_slot_when_done(futures)
+        else:
+            _hedge_slots.release()
+
+
+def _run_hedged_in_slot(
+    primary_fn: Callable[[], str],
+    hedge_fn: Callable[[], str],
+    deadline_seconds: float,
+    futures: List[Future],
+) -> Tuple[str, str]:
+    primary: Future = _hedge_executor.submit(primary_fn)
+    futures.append(primary)
+    done, _ = wait([primary], timeout=deadline_seconds)
+    if len(done) > 0:
+        # Includes the primary failing fast, no point in hedging that.
+        return primary.result(), PATH_PRIMARY
+
+    hedge: Future = _hedge_executor.submit(hedge_fn)
+    futures.append(hedge)
+    pending = {primary: PATH_PRIMARY, hedge: PATH_HEDGE}
+    errors: Dict[str, Exception] = {}
+    while len(pending) > 0:
+        done, _ = wait(list(pending.keys()), return_when=FIRST_COMPLETED)
+        for future in done:
+            path = pending.pop(future)
+            try:
+                return future.result(), path
+            except Exception as err:
+                print(f"WARNING: {path} request failed: {err}")
+                errors[path] = err
+    raise errors.get(PATH_PRIMARY, errors.get(PATH_HEDGE))
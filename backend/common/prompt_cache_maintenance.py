@@ -0,0 +1,247 @@
+import datetime
+import gzip
+import json
+import os
+from typing import Dict, List, Optional
+
+from peewee import fn
+
+from common.aws_utils import get_boto_s3_client, is_running_in_aws
+from common.blob_storage import load_texts
+from common.config import (
+    POSTGRES_LOGIN_URL_FROM_ENV,
+    PROMPT_CACHE_ARCHIVE_BUCKET,
+    PROMPT_CACHE_ARCHIVE_LOCAL_DIR,
+    PROMPT_CACHE_MAX_TOTAL_MB,
+    PROMPT_CACHE_RETENTION_DAYS,
+)
+from common.storage_utils import pretty_filesize_int
+from common.tmp_storage import get_work_dir
+from database.models import BasePromptBlob, BasePromptLog
+
+EVICTION_BATCH_SIZE = 500
+# New chunks are stored right before their prompt_log row is inserted, and re-used ones get their
+# referenced_at touched, so anything referenced within this period is never considered an orphan.
+BLOB_GC_GRACE_SECONDS = 60 * 60
+
+# When the row was last useful, i.e. the hot entries are kept the longest.
+_last_used_at = fn.COALESCE(BasePromptLog.last_hit_at, BasePromptLog.created_at)
+
+
+# What the cache takes, i.e. the inline texts of the old rows plus the compressed chunks.
+def get_prompt_cache_total_bytes() -> int:
+    inline_bytes = BasePromptLog.select(
+        fn.COALESCE(
+            fn.SUM(
+                fn.COALESCE(fn.octet_length(BasePromptLog.prompt), 0)
+                + fn.COALESCE(fn.octet_length(BasePromptLog.result), 0)
+            ),
+            0,
+        )
+    ).scalar()
+    blob_bytes = BasePromptBlob.select(
+        fn.COALESCE(fn.SUM(fn.octet_length(BasePromptBlob.data)), 0)
+    ).scalar()
+    return int(inline_bytes) + int(blob_bytes)
+
+
+def _select_least_recently_used(
+    limit: int, used_before: Optional[datetime.datetime] = None
+) -> List[BasePromptLog]:
+    query = BasePromptLog.select()
+    if used_before is not None:
+        query = query.where(_last_used_at < used_before)
+    return list(
+        query.order_by(_last_used_at.asc(), BasePromptLog.id.asc()).limit(limit)
+    )
+
+
+# Returns None for the texts whose chunks are gone, so one broken row cannot block the eviction of the rest.
+def _load_texts_tolerating_missing(
+    chunk_hashes_per_text: List[List[str]],
+) -> List[Optional[str]]:
+    try:
+        return load_texts(chunk_hashes_per_text)
+    except ValueError:
+        pass
+    texts: List[Optional[str]] = []
+    for chunk_hashes in chunk_hashes_per_text:
+        try:
+            texts.extend(load_texts([chunk_hashes]))
+        except ValueError as e:
+            print(f"WARNING: archiving a prompt_log text without its content: {e}")
+            texts.append(None)
+    return texts
+
+
+def _to_archive_dicts(rows: List[BasePromptLog]) -> List[Dict]:
+    # The new rows have their texts in prompt_blob, loaded with one query for the whole batch.
+    chunked_rows = [
+        row
+        for row in rows
+        if row.prompt is None and row.prompt_chunk_hashes is not None
+    ]
+    texts = _load_texts_tolerating_missing(
+        [row.prompt_chunk_hashes for row in chunked_rows]
+        + [row.result_chunk_hashes or [] for row in chunked_rows]
+    )
+    loaded = {
+        row.id: (texts[i], texts[len(chunked_rows) + i])
+        for i, row in enumerate(chunked_rows)
+    }
+
+    result = []
+    for row in rows:
+        prompt, result_text = loaded.get(row.id, (row.prompt, row.result))
+        result.append(
+            {
+                "id": row.id,
+                "created_at": str(row.created_at),
+                "last_hit_at": None
+                if row.last_hit_at is None
+                else str(row.last_hit_at),
+                "model": row.model,
+                "prompt_hash": row.prompt_hash,
+                "prompt": prompt,
+                "result": result_text,
+                "prompt_tokens": row.prompt_tokens,
+                "completion_tokens": row.completion_tokens,
+                "request_time_ms": row.request_time_ms,
+            }
+        )
+    return result
+
+
+# Writes the rows as gzipped JSON lines, in AWS the file is uploaded to S3 and deleted locally.
+# Returns where the archive ended up.
+def archive_rows(rows: List[BasePromptLog], reason: str) -> str:
+    now = datetime.datetime.now(datetime.timezone.utc)
+    file_name = (
+        f"prompt_log-{now.strftime('%Y%m%d-%H%M%S')}-{reason}-{rows[0].id}.jsonl.gz"
+    )
+    if is_running_in_aws():
+        file_path = get_work_dir().path(file_name)
+    else:
+        os.makedirs(PROMPT_CACHE_ARCHIVE_LOCAL_DIR, exist_ok=True)
+        file_path = os.path.join(PROMPT_CACHE_ARCHIVE_LOCAL_DIR, file_name)
+
+    with gzip.open(file_path, "wt", encoding="utf-8") as file_handle:
+        for archive_dict in _to_archive_dicts(rows):
+            file_handle.write(json.dumps(archive_dict) + "\n")
+    print(
+        f"Archived {len(rows)} prompt_log rows ({pretty_filesize_int(os.path.getsize(file_path))}) to {file_path}"
+    )
+
+    if not is_running_in_aws():
+        return file_path
+    get_work_dir().track(file_path)
+    bucket_key = f"prompt_log/{now.strftime('%Y/%m/%d')}/{file_name}"
+    get_boto_s3_client().upload_file(
+        file_path,
+        PROMPT_CACHE_ARCHIVE_BUCKET,
+        bucket_key,
+        ExtraArgs={"ContentType": "application/gzip"},
+    )
+    get_work_dir().release(file_path)
+    return f"s3://{PROMPT_CACHE_ARCHIVE_BUCKET}/{bucket_key}"
+
+
+# Archive first, so we never delete something we failed to archive.
+def _evict(rows: List[BasePromptLog], reason: str) -> int:
+    archive_rows(rows, reason=reason)
+    return (
+        BasePromptLog.delete()
+        .where(BasePromptLog.id.in_([row.id for row in rows]))
+        .execute()
+    )
+
+
+# Deletes the chunks no prompt_log row references anymore, returns the freed (compressed) bytes.
+def garbage_collect_blobs(grace_seconds: int = BLOB_GC_GRACE_SECONDS) -> int:
+    cursor = BasePromptBlob._meta.database.execute_sql(
+        """
+        DELETE FROM public.prompt_blob b
+        WHERE b.referenced_at < now() - make_interval(secs => %s)
+        AND NOT EXISTS (
+            SELECT 1 FROM public.prompt_log l
+            WHERE l.prompt_chunk_hashes @> ARRAY[b.content_hash] OR l.result_chunk_hashes @> ARRAY[b.content_hash]
+        )
+        RETURNING octet_length(b.data)
+        """,
+        (grace_seconds,),
+    )
+    freed = [row[0] for row in cursor.fetchall()]
+    if len(freed) > 0:
+        print(
+            f"Garbage collected {len(freed)} orphan prompt_blob chunks ({pretty_filesize_int(sum(freed))})"
+        )
+    return sum(freed)
+
+
+def evict_by_age(
+    max_age_days: int = PROMPT_CACHE_RETENTION_DAYS,
+    batch_size: int = EVICTION_BATCH_SIZE,
+) -> int:
+    used_before = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(
+        days=max_age_days
+    )
+    evicted_count = 0
+    while True:
+        rows = _select_least_recently_used(batch_size, used_before=used_before)
+        if len(rows) == 0:
+            break
+        evicted_count += _evict(rows, reason="age")
+    print(f"Evicted {evicted_count} prompt_log rows not used for {max_age_days} days")
+    return evicted_count
+
+
+def evict_by_size(
+    max_total_mb: int = PROMPT_CACHE_MAX_TOTAL_MB, batch_size: int = EVICTION_BATCH_SIZE
+) -> int:
+    max_total_bytes = max_total_mb * 1024 * 1024
+    total_bytes = get_prompt_cache_total_bytes()
+    print(
+        f"prompt cache takes {pretty_filesize_int(total_bytes)} out of {pretty_filesize_int(max_total_bytes)}"
+    )
+    evicted_count = 0
+    while total_bytes > max_total_bytes:
+        rows = _select_least_recently_used(batch_size)
+        if len(rows) == 0:
+            break
+        evicted_count += _evict(rows, reason="size")
+        # The chunks of the evicted rows can be shared with the kept ones, only the orphans free up space.
+        # Always with the grace period, as a concurrent write_cache may have just stored (or re-used) a chunk
+        # whose prompt_log row is not inserted yet.
+        garbage_collect_blobs()
+        # Measured, not estimated: the chunked rows free nothing until their chunks are collected.
+        previous_total_bytes = total_bytes
+        total_bytes = get_prompt_cache_total_bytes()
+        if total_bytes >= previous_total_bytes:
+            # E.g. the chunks are all within the grace period, evicting more would only empty the cache.
+            print(
+                f"WARNING: evicting {len(rows)} prompt_log rows freed nothing, "
+                f"stopping at {pretty_filesize_int(total_bytes)}"
+            )
+            break
+    print(
+        f"Evicted {evicted_count} least recently used prompt_log rows to fit {max_total_mb}MB"
+    )
+    return evicted_count
+
+
+# Meant to run daily, e.g. from an EventBridge rule, or locally with `python -m common.prompt_cache_maintenance`.
+def run_prompt_cache_maintenance() -> Dict[str, int]:
+    stats = {
+        "evicted_by_age": evict_by_age(),
+        "evicted_by_size": evict_by_size(),
+        "freed_blob_bytes": garbage_collect_blobs(),
+    }
+    print(f"prompt cache maintenance done: {stats}")
+    return stats
+
+
+if __name__ == "__main__":
+    from supawee.client import connect_to_postgres
+
+    with connect_to_postgres(POSTGRES_LOGIN_URL_FROM_ENV):
+        run_prompt_cache_maintenance()
@@ -0,0 +1,258 @@
+import collections
+import threading
+import time
+import uuid
+from typing import Deque, Dict, List, Optional, Tuple
+
+from peewee import InterfaceError
+
+from common.config import OPENAI_MAX_CONCURRENT_REQUESTS, OPENAI_RATE_LIMIT_UTILIZATION
+from database.models import BaseOpenaiRateLimit
+
+# (requests per minute, tokens per minute), matched by the longest model name prefix.
+# https://platform.openai.com/account/limits
+OPENAI_RATE_LIMITS: Dict[str, Tuple[int, Optional[int]]] = {
+    "gpt-4o-mini": (5000, 2_000_000),
+    "gpt-4o": (5000, 800_000),
+    "gpt-4-turbo": (5000, 600_000),
+    "gpt-4": (5000, 300_000),
+    "gpt-3.5-turbo": (5000, 2_000_000),
+    "whisper-1": (500, None),
+}
+DEFAULT_RATE_LIMIT: Tuple[int, Optional[int]] = (500, 200_000)
+# We only know the prompt size upfront, this is our guess for the completion.
+EXPECTED_COMPLETION_TOKENS = 500
+
+# (bucket_key, capacity, refill_per_second, amount)
+BucketReservation = Tuple[str, float, float, float]
+
+
+def get_rate_limit(model: str) -> Tuple[int, Optional[int]]:
+    for prefix in sorted(OPENAI_RATE_LIMITS.keys(), key=len, reverse=True):
+        if model.startswith(prefix):
+            return OPENAI_RATE_LIMITS[prefix]
+    return DEFAULT_RATE_LIMIT
+
+
+# How long to wait until all the reserved amounts are refilled.
+def _wait_seconds(available_after: float, refill_per_second: float) -> float:
+    if available_after >= 0 or refill_per_second <= 0:
+        return 0.0
+    return -available_after / refill_per_second
+
+
+# Token buckets with reservations: every caller takes what it needs right away, even if that gets the bucket
+# negative, and then waits until the debt is refilled. So the callers are served in the order they came in
+# (no retry storms of everyone polling the bucket), and the quota is used up to its ceiling.
+class InMemoryTokenBucketStore:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # bucket_key -> (available, updated_at)
+        self.buckets: Dict[str, Tuple[float, float]] = {}
+
+    # Returns the available amount of each bucket after the reservation.
+    def reserve(self, reservations: List[BucketReservation]) -> List[float]:
+        now = time.monotonic()
+        result = []
+        with self.lock:
+            for bucket_key, capacity, refill_per_second, amount in reservations:
+                available, updated_at = self.buckets.get(bucket_key, (capacity, now))
+                available = (
+                    min(capacity, available + (now - updated_at) * refill_per_second)
+                    - amount
+                )
+                self.buckets[bucket_key] = (available, now)
+                result.append(available)
+        return result
+
+
+# Same as the in-memory one, but shared by all the Lambda invocations. One round-trip per reservation,
+# the row locks of the upsert serialize the concurrent callers.
+class PostgresTokenBucketStore:
+    RESERVE_SQL = """
+        INSERT INTO public.openai_rate_limit AS b (bucket_key, capacity, refill_per_second, available, updated_at)
+        VALUES {values}
+        ON CONFLICT (bucket_key) DO UPDATE SET
+            capacity = EXCLUDED.capacity,
+            refill_per_second = EXCLUDED.refill_per_second,
+            -- EXCLUDED.capacity - EXCLUDED.available is the reserved amount
+            available = LEAST(
+                EXCLUDED.capacity,
+                b.available + EXTRACT(EPOCH FROM (clock_timestamp() - b.updated_at)) * EXCLUDED.refill_per_second
+            ) - (EXCLUDED.capacity - EXCLUDED.available),
+            updated_at = clock_timestamp()
+        RETURNING b.bucket_key, b.available
+    """
+
+    def reserve(self, reservations: List[BucketReservation]) -> List[float]:
+        values = ", ".join(["(%s, %s, %s, %s, clock_timestamp())"] * len(reservations))
+        params = []
+        # Always lock the rows in the same order, so two callers cannot deadlock.
+        for bucket_key, capacity, refill_per_second, amount in sorted(
+            reservations, key=lambda r: r[0]
+        ):
+            params.extend([bucket_key, capacity, refill_per_second, capacity - amount])
+        cursor = BaseOpenaiRateLimit._meta.database.execute_sql(
+            self.RESERVE_SQL.format(values=values), params
+        )
+        available_by_key = {
+            bucket_key: available for bucket_key, available in cursor.fetchall()
+        }
+        return [available_by_key[r[0]] for r in reservations]
+
+
+# In-flight slots handed out round-robin across the accounts waiting for one, first come, first served within
+# an account. So the many chunks of one big recording cannot take all the slots while the others queue behind them.
+class FairSlots:
+    def __init__(self, slot_count: int):
+        self.lock = threading.Lock()
+        self.free_slots = slot_count
+        # account_id -> the waiting callers, and the order in which the accounts get their next slot.
+        self.waiting: Dict[Optional[uuid.UUID], Deque[threading.Event]] = {}
+        self.turns: Deque[Optional[uuid.UUID]] = collections.deque()
+
+    def acquire(
+        self, account_id: Optional[uuid.UUID] = None, blocking: bool = True
+    ) -> bool:
+        with self.lock:
+            if self.free_slots > 0 and len(self.turns) == 0:
+                self.free_slots -= 1
+                return True
+            if not blocking:
+                return False
+            granted = threading.Event()
+            if account_id not in self.waiting:
+                self.waiting[account_id] = collections.deque()
+                self.turns.append(account_id)
+            self.waiting[account_id].append(granted)
+        # The releasing caller hands its slot over directly, so nobody can cut in.
+        granted.wait()
+        return True
+
+    def release(self):
+        with self.lock:
+            if len(self.turns) == 0:
+                self.free_slots += 1
+                return
+            account_id = self.turns.popleft()
+            account_waiting = self.waiting[account_id]
+            granted = account_waiting.popleft()
+            if len(account_waiting) > 0:
+                self.turns.append(account_id)
+            else:
+                del self.waiting[account_id]
+        granted.set()
+
+
+# Shared requests per minute and tokens per minute limits per model, and a cap on in-flight requests
+# of this process, served round-robin per account. The reservations are first come, first served across
+# all processes, where the in-flight cap keeps any single process from queuing up much ahead of the others.
+class OpenAiRateLimiter:
+    def __init__(
+        self,
+        bucket_store=None,
+        max_concurrent_requests: int = OPENAI_MAX_CONCURRENT_REQUESTS,
+        utilization: float = OPENAI_RATE_LIMIT_UTILIZATION,
+    ):
+        self.bucket_store = (
+            bucket_store if bucket_store is not None else PostgresTokenBucketStore()
+        )
+        self.fallback_store = InMemoryTokenBucketStore()
+        self.request_slots = FairSlots(max(1, max_concurrent_requests))
+        self.utilization = utilization
+
+    def _reservations(self, model: str, token_count: int) -> List[BucketReservation]:
+        requests_per_minute, tokens_per_minute = get_rate_limit(model)
+        # Capacity of one minute worth of quota, so a burst after an idle period cannot exceed the per-minute limit.
+        requests_capacity = requests_per_minute * self.utilization
+        reservations = [
+            (f"{model}:requests", requests_capacity, requests_capacity / 60, 1)
+        ]
+        if tokens_per_minute is not None and token_count > 0:
+            capacity = tokens_per_minute * self.utilization
+            # A request larger than the whole bucket would never fit, it just waits for the full bucket.
+            reservations.append(
+                (f"{model}:tokens", capacity, capacity / 60, min(token_count, capacity))
+            )
+        return reservations
+
+    # Reserves one request and `token_count` tokens, returns how many seconds the caller has to wait.
+    def reserve(self, model: str, token_count: int) -> float:
+        reservations = self._reservations(model, token_count)
+        try:
+            available_after = self.bucket_store.reserve(reservations)
+        except InterfaceError:
+            print(
+                "DB NOT connected, rate limiting OpenAI requests only within this process"
+            )
+            available_after = self.fallback_store.reserve(reservations)
+        except Exception as e:
+            print(
+                f"WARNING: shared rate limiter failed, rate limiting only within this process: {e}"
+            )
+            available_after = self.fallback_store.reserve(reservations)
+        return max(
+            _wait_seconds(available, refill_per_second)
+            for available, (_, _, refill_per_second, _) in zip(
+                available_after, reservations
+            )
+        )
+
+    # Use as `with rate_limiter.limit(model, token_count, account_id): ...call OpenAI...`
+    def limit(
+        self, model: str, token_count: int, account_id: Optional[uuid.UUID] = None
+    ) -> "_RateLimitedCall":
+        return _RateLimitedCall(self, model, token_count, account_id)
+
+
+# Set while the current thread is inside a rate limited call.
+_thread_state = threading.local()
+
+
+def in_rate_limited_call() -> bool:
+    return getattr(_thread_state, "in_limited_call", False)
+
+
+# Re-entrant per thread: e.g. fill_in_form is limited as a whole, and when it calls our (also limited) run_prompt,
+# the nested call neither reserves the tokens again nor takes a second in-flight slot (which could deadlock).
+class _RateLimitedCall:
+    def __init__(
+        self,
+        rate_limiter: OpenAiRateLimiter,
+        model: str,
+        token_count: int,
+        account_id: Optional[uuid.UUID] = None,
+    ):
+        self.rate_limiter = rate_limiter
+        self.model = model
+        self.token_count = token_count
+        self.account_id = account_id
+        self.is_outermost = False
+
+    def __enter__(self):
+        if in_rate_limited_call():
+            return self
+        self.is_outermost = True
+        _thread_state.in_limited_call = True
+        # The slot is taken before the reservation, so waiting counts against the in-flight cap too.
+        self.rate_limiter.request_slots.acquire(self.account_id)
+        try:
+            wait_seconds = self.rate_limiter.reserve(self.model, self.token_count)
+            if wait_seconds > 0:
+                print(
+                    f"rate limiter: waiting {round(wait_seconds, 2)} seconds "
+                    f"for {self.model} ({self.token_count} tokens)"
+                )
+                time.sleep(wait_seconds)
+        except BaseException:
+            self._release()
+            raise
+        return self
+
+    def _release(self):
+        _thread_state.in_limited_call = False
+        self.rate_limiter.request_slots.release()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.is_outermost:
+            self._release()
@@ -0,0 +1,128 @@
+import hashlib
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from peewee import InterfaceError
+
+from common.config import PROMPT_SINGLE_FLIGHT_MAX_WAIT_SECONDS
+from database.models import BasePromptLog
+
+ADVISORY_LOCK_POLL_SECONDS = 0.5
+
+
+# Session level Postgres advisory lock, i.e. held by the connection of the calling thread
+# and released by Postgres if the process dies.
+class PostgresAdvisoryLock:
+    def __init__(self, max_wait_seconds: float = PROMPT_SINGLE_FLIGHT_MAX_WAIT_SECONDS):
+        self.max_wait_seconds = max_wait_seconds
+
+    @staticmethod
+    def _lock_id(key: str) -> int:
+        return int.from_bytes(
+            hashlib.sha256(key.encode("utf-8")).digest()[:8], "big", signed=True
+        )
+
+    def _execute(self, sql: str, key: str) -> bool:
+        cursor = BasePromptLog._meta.database.execute_sql(sql, (self._lock_id(key),))
+        return bool(cursor.fetchone()[0])
+
+    # Returns (is_locked, waited). Not locked if we gave up waiting (or there is no DB), then the caller goes on
+    # without it. Waited when another process held the lock, i.e. it likely just cached the result.
+    # We poll instead of pg_advisory_lock, so a stuck holder cannot block us (and our connection) forever.
+    def acquire(self, key: str) -> Tuple[bool, bool]:
+        deadline = time.time() + self.max_wait_seconds
+        waited = False
+        while True:
+            try:
+                if self._execute("SELECT pg_try_advisory_lock(%s)", key):
+                    if waited:
+                        print(f"single flight: got the lock for {key} after waiting")
+                    return True, waited
+            except InterfaceError:
+                return False, waited
+            except Exception as e:
+                print(
+                    f"WARNING: single flight cannot lock {key}, going without it: {e}"
+                )
+                return False, waited
+            if time.time() > deadline:
+                print(
+                    f"WARNING: single flight gave up waiting for {key} after {self.max_wait_seconds} seconds"
+                )
+                return False, waited
+            waited = True
+            time.sleep(ADVISORY_LOCK_POLL_SECONDS)
+
+    def release(self, key: str):
+        try:
+            self._execute("SELECT pg_advisory_unlock(%s)", key)
+        except Exception as e:
+            print(f"WARNING: single flight cannot unlock {key}: {e}")
+
+
+# Only one caller runs `fn` for the same key at a time, the others wait for its result instead of running it again.
+# In-process the callers share one Future. Across processes (e.g. two Lambdas processing a re-delivered S3 event)
+# the first one holds an advisory lock, the others wait for it and then usually find the result in the cache.
+# So pass `after_waiting` to look it up, it is only called when we actually waited for another process.
+class SingleFlight:
+    def __init__(self, cross_process_lock: Optional[PostgresAdvisoryLock] = None):
+        self.cross_process_lock = cross_process_lock
+        self.lock = threading.Lock()
+        self.in_flight: Dict[str, Future] = {}
+
+    # `before_release` runs before the cross-process lock is released, e.g. to flush the cache write of `fn`,
+    # so the other processes can see the result once they get the lock.
+    # `after_waiting` runs instead of `fn` after waiting for another process, and `fn` only if it returned None.
+    def run(
+        self,
+        key: str,
+        fn: Callable[[], Any],
+        before_release: Optional[Callable[[], None]] = None,
+        after_waiting: Optional[Callable[[], Optional[Any]]] = None,
+    ) -> Any:
+        with self.lock:
+            future = self.in_flight.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                self.in_flight[key] = future
+        if not is_leader:
+            print(f"single flight: waiting for the in-flight {key}")
+            return future.result()
+
+        try:
+            future.set_result(self._run_locked(key, fn, before_release, after_waiting))
+        except Exception as err:
+            future.set_exception(err)
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+        return future.result()
+
+    def _run_locked(
+        self,
+        key: str,
+        fn: Callable[[], Any],
+        before_release: Optional[Callable[[], None]],
+        after_waiting: Optional[Callable[[], Optional[Any]]],
+    ) -> Any:
+        is_locked, waited = (
+            self.cross_process_lock.acquire(key)
+            if self.cross_process_lock is not None
+            else (False, False)
+        )
+        try:
+            if waited and after_waiting is not None:
+                result = after_waiting()
+                if result is not None:
+                    return result
+            return fn()
+        finally:
+            if is_locked:
+                try:
+                    if before_release is not None:
+                        before_release()
+                finally:
+                    self.cross_process_lock.release(key)
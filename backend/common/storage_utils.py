@@ -1,10 +1,14 @@
+import hashlib
 import os
-from typing import Optional, Tuple
+from typing import BinaryIO, Optional, Tuple
 
 from common.aws_utils import get_boto_s3_client, is_running_in_aws
 
 s3 = get_boto_s3_client()
 
+# Inputs (S3 bodies, emails) are copied in buffers of this size, so memory stays flat regardless the input size.
+STREAM_BUFFER_BYTES = 1024 * 1024
+
 
 def pretty_filesize_int(file_size: int) -> str:
     return f"{file_size / (1024 * 1024):.2f}MB"
@@ -14,10 +18,34 @@ def pretty_filesize_path(file_path: str) -> str:
     return pretty_filesize_int(os.path.getsize(file_path))
 
 
+def file_content_hash(filepath: str, block_size: int = STREAM_BUFFER_BYTES) -> str:
+    sha256 = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
 def get_fileinfo(file_handle):
     return f"File {file_handle.name} is {pretty_filesize_path(file_handle.name)}"
 
 
+# Works with anything with .read(size), e.g. botocore StreamingBody or a local file handle.
+def copy_stream_to_file(
+    stream: BinaryIO, file_path: str, buffer_size: int = STREAM_BUFFER_BYTES
+) -> int:
+    total_bytes = 0
+    with open(file_path, "wb") as f:
+        while True:
+            buffer = stream.read(buffer_size)
+            if not buffer:
+                break
+            f.write(buffer)
+            total_bytes += len(buffer)
+    print(f"Streamed {pretty_filesize_int(total_bytes)} to {file_path}")
+    return total_bytes
+
+
 def mkdir_safe(directory_name):
     path = os.path.join(os.getcwd(), directory_name)
     if os.path.exists(directory_name):
@@ -0,0 +1,193 @@
+import contextlib
+import errno
+import os
+import shutil
+import threading
+import time
+import uuid
+from typing import Dict, Iterator, Optional
+
+from common.config import CONVERTED_AUDIO_CACHE_MAX_MB, TMP_DISK_BUDGET_MB
+from common.storage_utils import pretty_filesize_int
+
+TMP_ROOT = "/tmp"
+INVOCATIONS_ROOT = os.path.join(TMP_ROOT, "invocations")
+CONVERTED_AUDIO_CACHE_DIR = os.path.join(TMP_ROOT, "converted-audio-cache")
+
+
+# Lambda /tmp survives across warm invocations, so anything we do not delete piles up until the disk is full.
+# A WorkDir tracks the intermediate files (downloads, ffmpeg outputs, chunks) of one invocation against a budget:
+# * the next stage calls `release` as soon as it consumed a file,
+# * everything left over is deleted with the whole directory at the end of the invocation.
+class WorkDir:
+    def __init__(self, directory: str, budget_bytes: int, owns_directory: bool = True):
+        self.directory = directory
+        self.budget_bytes = budget_bytes
+        # The default WorkDir is /tmp itself, which we should never rmtree.
+        self.owns_directory = owns_directory
+        self.tracked_bytes: Dict[str, int] = {}
+        self.lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, file_name: str) -> str:
+        return os.path.join(self.directory, file_name)
+
+    def used_bytes(self) -> int:
+        with self.lock:
+            return sum(self.tracked_bytes.values())
+
+    # Call after a file was written, so we know how much of the budget is used.
+    # The converted audio cache shares /tmp with us, so it counts against the budget too and gets evicted first.
+    # If our own files alone are over the budget, we fail the invocation before the disk fills up
+    # (the file stays tracked, so it is deleted with the rest in cleanup).
+    def track(self, file_path: str) -> str:
+        file_size = os.path.getsize(file_path)
+        with self.lock:
+            self.tracked_bytes[file_path] = file_size
+            used_bytes = sum(self.tracked_bytes.values())
+        if used_bytes + converted_audio_cache.used_bytes() <= self.budget_bytes:
+            return file_path
+
+        print(
+            f"WARNING: tmp storage over budget {pretty_filesize_int(used_bytes)} + converted audio cache > "
+            f"{pretty_filesize_int(self.budget_bytes)}, evicting the converted audio cache"
+        )
+        converted_audio_cache.evict_to(max(0, self.budget_bytes - used_bytes))
+        if used_bytes > self.budget_bytes:
+            raise OSError(
+                errno.ENOSPC,
+                f"tmp storage budget exceeded {pretty_filesize_int(used_bytes)} > "
+                f"{pretty_filesize_int(self.budget_bytes)} after writing {file_path}",
+            )
+        return file_path
+
+    # Deletes the file if (and only if) it is one of our tracked intermediates, i.e. never touches inputs like testdata.
+    def release(self, file_path: str):
+        with self.lock:
+            if file_path not in self.tracked_bytes:
+                return
+            released_bytes = self.tracked_bytes.pop(file_path)
+        try:
+            os.remove(file_path)
+            print(f"Released {file_path} ({pretty_filesize_int(released_bytes)})")
+        except FileNotFoundError:
+            pass
+
+    def cleanup(self):
+        with self.lock:
+            tracked_files = list(self.tracked_bytes.keys())
+            self.tracked_bytes = {}
+        if self.owns_directory:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            return
+        for file_path in tracked_files:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(file_path)
+
+
+# Small content-addressed cache of converted audio, so a warm retry of the same object skips the conversion.
+# Files are hard-linked in and out, so releasing the work copy does NOT remove the cached one.
+class ConvertedAudioCache:
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+
+    def _entry_path(self, key: str, extension: str) -> str:
+        return os.path.join(self.directory, f"{key}.{extension}")
+
+    def maybe_get(self, key: str, extension: str, output_file_path: str) -> bool:
+        entry_path = self._entry_path(key, extension)
+        if not os.path.exists(entry_path):
+            return False
+        _link_or_copy(entry_path, output_file_path)
+        os.utime(entry_path)  # mark as recently used
+        print(f"converted audio cache hit {entry_path} -> {output_file_path}")
+        return True
+
+    def put(self, key: str, extension: str, file_path: str):
+        if self.max_bytes <= 0 or os.path.getsize(file_path) > self.max_bytes:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        with self.lock:
+            _link_or_copy(file_path, self._entry_path(key, extension))
+        self.evict_to(self.max_bytes)
+
+    # NOTE: Entries hard-linked into a work dir are counted twice, which only makes us evict a bit sooner.
+    def used_bytes(self) -> int:
+        with self.lock:
+            if not os.path.isdir(self.directory):
+                return 0
+            return sum(
+                os.path.getsize(os.path.join(self.directory, name))
+                for name in os.listdir(self.directory)
+            )
+
+    # Least recently used entries go first.
+    def evict_to(self, max_bytes: int):
+        with self.lock:
+            if not os.path.isdir(self.directory):
+                return
+            entries = [
+                os.path.join(self.directory, name)
+                for name in os.listdir(self.directory)
+            ]
+            entries.sort(key=lambda entry: os.path.getmtime(entry))
+            total_bytes = sum(os.path.getsize(entry) for entry in entries)
+            for entry in entries:
+                if total_bytes <= max_bytes:
+                    break
+                total_bytes -= os.path.getsize(entry)
+                os.remove(entry)
+                print(f"evicted converted audio cache entry {entry}")
+
+
+def _link_or_copy(source_path: str, target_path: str):
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(target_path)
+    try:
+        os.link(source_path, target_path)
+    except OSError:
+        shutil.copyfile(source_path, target_path)
+
+
+converted_audio_cache = ConvertedAudioCache(
+    CONVERTED_AUDIO_CACHE_DIR, max_bytes=CONVERTED_AUDIO_CACHE_MAX_MB * 1024 * 1024
+)
+# Outside of an invocation (e.g. local runs of the __main__ functions) we behave like before, just writing to /tmp.
+_default_work_dir = WorkDir(
+    TMP_ROOT, budget_bytes=TMP_DISK_BUDGET_MB * 1024 * 1024, owns_directory=False
+)
+_current_work_dir: Optional[WorkDir] = None
+
+
+def get_work_dir() -> WorkDir:
+    return _current_work_dir if _current_work_dir is not None else _default_work_dir
+
+
+# NOTE: Lambda runs one invocation at a time per container, so a module-level "current" is good enough,
+# and unlike contextvars it is visible from the worker threads too.
+@contextlib.contextmanager
+def invocation_work_dir(
+    budget_bytes: int = TMP_DISK_BUDGET_MB * 1024 * 1024,
+) -> Iterator[WorkDir]:
+    global _current_work_dir
+    # Left-overs of a previous invocation which got killed (e.g. by the 15min timeout) before it could clean up.
+    if os.path.isdir(INVOCATIONS_ROOT):
+        for stale_dir in os.listdir(INVOCATIONS_ROOT):
+            print(f"removing stale invocation work dir {stale_dir}")
+            shutil.rmtree(os.path.join(INVOCATIONS_ROOT, stale_dir), ignore_errors=True)
+
+    work_dir = WorkDir(
+        os.path.join(INVOCATIONS_ROOT, f"{int(time.time())}-{uuid.uuid4()}"),
+        budget_bytes,
+    )
+    _current_work_dir = work_dir
+    try:
+        yield work_dir
+    finally:
+        print(
+            f"cleaning up invocation work dir {work_dir.directory} ({pretty_filesize_int(work_dir.used_bytes())})"
+        )
+        _current_work_dir = None
+        work_dir.cleanup()
@@ -0,0 +1,112 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+
+from gpt_form_filler.openai_client import DEFAULT_MODEL
+
+# Used by gpt-4o and newer, for the models tiktoken does not know (yet).
+FALLBACK_ENCODING_NAME = "o200k_base"
+COUNT_TOKENS_CACHE_SIZE = 1024
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+# Keyed by a digest of the text, so the cache does not keep the (possibly huge) transcripts alive.
+# Least recently used first.
+_token_counts: "OrderedDict[bytes, int]" = OrderedDict()
+_token_counts_lock = threading.Lock()
+
+
+# https://help.openai.com/en/articles/4936856-what-are-tokens-and-how-to-count-them
+def poor_mans_token_counter(text: str) -> int:
+    by_character = len(text) / 4
+    by_words = 3 * len(text.split()) // 4
+    return int(by_character + by_words) // 2
+
+
+# Loaded once per process, i.e. warm Lambda invocations reuse it.
+# NOTE: tiktoken downloads the BPE ranks on first use, the Docker image pre-fetches them into TIKTOKEN_CACHE_DIR.
+def _get_encoding():
+    global _encoding, _encoding_loaded
+    if _encoding_loaded:
+        return _encoding
+    with _encoding_lock:
+        if _encoding_loaded:
+            return _encoding
+        try:
+            import tiktoken
+
+            try:
+                _encoding = tiktoken.encoding_for_model(DEFAULT_MODEL)
+            except KeyError:
+                _encoding = tiktoken.get_encoding(FALLBACK_ENCODING_NAME)
+            print(f"Loaded tokenizer {_encoding.name} for {DEFAULT_MODEL}")
+        except Exception as e:
+            print(
+                f"WARNING: cannot load tiktoken, falling back to poor_mans_token_counter: {e}"
+            )
+            _encoding = None
+        _encoding_loaded = True
+    return _encoding
+
+
+def _count_tokens_uncached(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding is None:
+        return poor_mans_token_counter(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+# The same texts (transcript, its windows, person notes) are counted many times during one pipeline run.
+# Hashing the text is much cheaper than tokenizing it.
+def count_tokens(text: str) -> int:
+    key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+    with _token_counts_lock:
+        token_count = _token_counts.get(key)
+        if token_count is not None:
+            _token_counts.move_to_end(key)
+            return token_count
+    token_count = _count_tokens_uncached(text)
+    with _token_counts_lock:
+        _token_counts[key] = token_count
+        while len(_token_counts) > COUNT_TOKENS_CACHE_SIZE:
+            _token_counts.popitem(last=False)
+    return token_count
+
+
+def truncate_to_token_count(text: str, max_token_count: int) -> str:
+    encoding = _get_encoding()
+    if encoding is None:
+        # Keep the previous behavior of cutting by words
+        return " ".join(text.split()[:max_token_count])
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_token_count:
+        return text
+    return encoding.decode(tokens[:max_token_count])
+
+
+# Greedily packs items (in order) into batches, so the sum of `item_token_counts` in a batch fits `max_batch_tokens`.
+# An item larger than the budget gets its own batch.
+def pack_into_batches(
+    items: List[str],
+    item_token_counts: List[int],
+    max_batch_tokens: int,
+    max_batch_size: Optional[int] = None,
+) -> List[List[str]]:
+    batches: List[List[str]] = []
+    batch: List[str] = []
+    batch_tokens = 0
+    for item, item_tokens in zip(items, item_token_counts):
+        is_full = max_batch_size is not None and len(batch) >= max_batch_size
+        if len(batch) > 0 and (
+            batch_tokens + item_tokens > max_batch_tokens or is_full
+        ):
+            batches.append(batch)
+            batch = []
+            batch_tokens = 0
+        batch.append(item)
+        batch_tokens += item_tokens
+    if len(batch) > 0:
+        batches.append(batch)
+    return batches
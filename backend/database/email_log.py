@@ -1,15 +1,27 @@
+import datetime
 import uuid
-from typing import Optional
+from typing import List, Optional
 
-from common.config import SENDER_EMAIL, SUPPORT_EMAIL
+from common.config import (
+    EMAIL_OUTBOX_CLAIM_LEASE_SECONDS,
+    EMAIL_OUTBOX_MAX_SEND_ATTEMPTS,
+    SENDER_EMAIL,
+    SUPPORT_EMAIL,
+)
 from database.account import Account
 from database.models import BaseEmailLog
 
 
+# psycopg2 returns timestamptz as aware datetimes, so the outbox times are aware too (to be comparable).
+def utc_now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
 # The overarching logic is:
 # * Pass around EmailLog params potentially filling them in
 # * After sending, we persist it in our DB for idempotency_id check
-# TODO(P3, correctness): We should persist both intent, and actually sent. SES is quite stable, so let it be for now.
+# * OR we persist it with a `not_before` (i.e. schedule it), and the outbox dispatcher sends it once due.
+# Either way `sent_at` is only set once the email actually went out.
 class EmailLog(BaseEmailLog):
     class Meta:
         table_name = "email_log"
@@ -34,11 +46,40 @@ class EmailLog(BaseEmailLog):
         self.fill_in_account()
 
         print(f"log_email: to {self.recipient} idempotency_id: {self.idempotency_id}")
+        self.sent_at = utc_now()
         try:
             self.save()
         except Exception as e:
             # We should not fail the whole operation if we fail to save the email log (for e.g. uniqueness constraint)
             print(f"ERROR failed to save email log: {e}")
+            # The same email might have been scheduled before, make sure the dispatcher won't send it again.
+            self._mark_scheduled_as_sent()
+
+    def _mark_scheduled_as_sent(self):
+        try:
+            EmailLog.update(sent_at=self.sent_at).where(
+                EmailLog.recipient == self.recipient,
+                EmailLog.idempotency_id == self.idempotency_id,
+                EmailLog.sent_at.is_null(),
+            ).execute()
+        except Exception as e:
+            print(f"ERROR failed to mark scheduled email log as sent: {e}")
+
+    # Persists the email into the outbox, returns False if the same email was already scheduled (or sent).
+    def schedule(self, not_before: datetime.datetime) -> bool:
+        if bool(self.id):
+            raise ValueError(
+                f"yo, you are likely trying to re-use params for already sent email {self.idempotency_id}, use deepcopy"
+            )
+
+        self.fill_in_account()
+        self.not_before = not_before
+        self.sent_at = None
+        print(
+            f"schedule: to {self.recipient} idempotency_id: {self.idempotency_id} not_before: {not_before}"
+        )
+        inserted_id = EmailLog.insert(self.__data__).on_conflict_ignore().execute()
+        return inserted_id is not None
 
     def check_if_already_sent(self) -> bool:
         return (
@@ -46,10 +87,74 @@ class EmailLog(BaseEmailLog):
             .where(
                 EmailLog.recipient == self.recipient,
                 EmailLog.idempotency_id == self.idempotency_id,
+                EmailLog.sent_at.is_null(False),
             )
             .exists()
         )
 
+    # Neither sent, nor leased by a dispatcher right now, nor given up on.
+    @staticmethod
+    def _is_pending(now: datetime.datetime):
+        return (
+            EmailLog.sent_at.is_null()
+            & (EmailLog.claimed_until.is_null() | (EmailLog.claimed_until < now))
+            & (EmailLog.send_attempts < EMAIL_OUTBOX_MAX_SEND_ATTEMPTS)
+        )
+
+    # The scheduled emails which are due, oldest first.
+    @staticmethod
+    def get_due_scheduled(now: datetime.datetime, limit: int = 100) -> List["EmailLog"]:
+        return list(
+            EmailLog.select()
+            .where(EmailLog._is_pending(now), EmailLog.not_before <= now)
+            .order_by(EmailLog.not_before.asc(), EmailLog.id.asc())
+            .limit(limit)
+        )
+
+    # The earliest not_before of the emails which can be sent, if any.
+    @staticmethod
+    def get_next_scheduled_not_before() -> Optional[datetime.datetime]:
+        next_email = (
+            EmailLog.select(EmailLog.not_before)
+            .where(EmailLog._is_pending(utc_now()), EmailLog.not_before.is_null(False))
+            .order_by(EmailLog.not_before.asc())
+            .first()
+        )
+        return None if next_email is None else next_email.not_before
+
+    # Atomically leases a scheduled email, so when two dispatchers run at the same time only one sends it.
+    # sent_at stays null until SES accepted the email (see mark_as_sent), if we die in-between the lease runs out
+    # and the email is retried. Every claim counts as a send attempt.
+    def claim_for_sending(
+        self, lease_seconds: int = EMAIL_OUTBOX_CLAIM_LEASE_SECONDS
+    ) -> bool:
+        now = utc_now()
+        claimed_until = now + datetime.timedelta(seconds=lease_seconds)
+        claimed = (
+            EmailLog.update(
+                claimed_until=claimed_until, send_attempts=EmailLog.send_attempts + 1
+            )
+            .where(EmailLog.id == self.id, EmailLog._is_pending(now))
+            .execute()
+        )
+        if claimed == 0:
+            return False
+        self.claimed_until = claimed_until
+        self.send_attempts += 1
+        return True
+
+    def mark_as_sent(self):
+        self.sent_at = utc_now()
+        EmailLog.update(sent_at=self.sent_at, claimed_until=None).where(
+            EmailLog.id == self.id
+        ).execute()
+
+    # Puts back the claimed email into the outbox, e.g. when SES failed. Returns False when we gave up on it.
+    def release_claim(self) -> bool:
+        EmailLog.update(claimed_until=None).where(EmailLog.id == self.id).execute()
+        self.claimed_until = None
+        return self.send_attempts < EMAIL_OUTBOX_MAX_SEND_ATTEMPTS
+
     # NOTE: We allow Optional subject in cases we fill it in later on - this can cause EmailLog insertion to fail;
     # so make really sure we really fill it in later on.
     @staticmethod
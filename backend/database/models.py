@@ -133,13 +133,17 @@ class BaseEmailLog(BaseDatabaseModel):
     bcc = ArrayField(constraints=[SQL("DEFAULT '{}'::text[]")], field_class=TextField)
     body_html = TextField(null=True)
     body_text = TextField(null=True)
+    claimed_until = DateTimeField(null=True)
     created_at = DateTimeField(constraints=[SQL("DEFAULT now()")])
     id = BigAutoField()
     idempotency_id = TextField()
+    not_before = DateTimeField(null=True)
     recipient = TextField()
     recipient_full_name = TextField(null=True)
     reply_to = TextField()
+    send_attempts = IntegerField(constraints=[SQL("DEFAULT 0")])
     sender = TextField()
+    sent_at = DateTimeField(null=True)
     subject = TextField()
 
     class Meta:
@@ -181,6 +185,18 @@ class BaseOnboarding(BaseDatabaseModel):
         indexes = ((("ip_address", "email"), True),)
 
 
+class BaseOpenaiRateLimit(BaseDatabaseModel):
+    available = DoubleField()
+    bucket_key = TextField(primary_key=True)
+    capacity = DoubleField()
+    refill_per_second = DoubleField()
+    updated_at = DateTimeField(constraints=[SQL("DEFAULT now()")])
+
+    class Meta:
+        schema = "public"
+        table_name = "openai_rate_limit"
+
+
 class BasePipeline(BaseDatabaseModel):
     created_at = DateTimeField(constraints=[SQL("DEFAULT now()")], null=True)
     destination = ForeignKeyField(
@@ -207,6 +223,7 @@ class BasePipeline(BaseDatabaseModel):
 
 class BaseTask(BaseDatabaseModel):
     api_response = JSONField(null=True)
+    checkpoints = JSONField(null=True)
     code_version = TextField(null=True)
     created_at = DateTimeField(
         constraints=[SQL("DEFAULT (now() AT TIME ZONE 'utc'::text)")]
@@ -228,16 +245,31 @@ class BaseTask(BaseDatabaseModel):
         table_name = "task"
 
 
+class BasePromptBlob(BaseDatabaseModel):
+    content_hash = TextField(primary_key=True)
+    created_at = DateTimeField(constraints=[SQL("DEFAULT now()")])
+    data = BlobField()
+    referenced_at = DateTimeField(constraints=[SQL("DEFAULT now()")])
+    size_bytes = BigIntegerField()
+
+    class Meta:
+        schema = "public"
+        table_name = "prompt_blob"
+
+
 class BasePromptLog(BaseDatabaseModel):
     completion_tokens = BigIntegerField(constraints=[SQL("DEFAULT '0'::bigint")])
     created_at = DateTimeField(constraints=[SQL("DEFAULT now()")])
     id = BigAutoField()
+    last_hit_at = DateTimeField(null=True)
     model = TextField()
-    prompt = TextField()
+    prompt = TextField(null=True)
+    prompt_chunk_hashes = ArrayField(field_class=TextField, null=True)
     prompt_hash = TextField()
     prompt_tokens = BigIntegerField(constraints=[SQL("DEFAULT '0'::bigint")])
     request_time_ms = BigIntegerField()
-    result = TextField()
+    result = TextField(null=True)
+    result_chunk_hashes = ArrayField(field_class=TextField, null=True)
     task = ForeignKeyField(column_name="task_id", field="id", model=BaseTask, null=True)
 
     class Meta:
@@ -246,6 +278,25 @@ class BasePromptLog(BaseDatabaseModel):
         indexes = ((("prompt_hash", "model"), True),)
 
 
+class BaseTranscriptionLog(BaseDatabaseModel):
+    account = ForeignKeyField(
+        column_name="account_id", field="id", model=BaseAccount, null=True
+    )
+    audio_fingerprint = TextField(null=True)
+    content_hash = TextField()
+    created_at = DateTimeField(constraints=[SQL("DEFAULT now()")])
+    duration_ms = BigIntegerField(null=True)
+    id = BigAutoField()
+    model = TextField()
+    request_time_ms = BigIntegerField()
+    result = TextField()
+
+    class Meta:
+        schema = "public"
+        table_name = "transcription_log"
+        indexes = ((("content_hash", "model"), True),)
+
+
 class BaseUserAccount(BaseDatabaseModel):
     account_id = UUIDField()
     created_at = DateTimeField(constraints=[SQL("DEFAULT now()")])
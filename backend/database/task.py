@@ -1,14 +1,19 @@
 import datetime
+import threading
 import uuid
+from typing import Any, Callable, Optional, Tuple
 
-from common import utils
 from gpt_form_filler.form import FormData
+
+from common import utils
 from database.models import BaseTask
 
 TASK_INITIATED = "initiated"
 TASK_DONE = "done"
 TASK_TERMINATED = "terminated"
 
+_task_save_lock = threading.Lock()
+
 
 # Retains data from the done transcription -> action performed.
 # -- in the ETL world usually encompasses all the Task, Logs (Events) and Audit Trail (History).
@@ -30,6 +35,79 @@ class Task(BaseTask):
         task = Task.get_by_id(task_id)
         return task
 
+    # For re-runs (e.g. a Lambda retry) we want to continue with the same Task, so its checkpoints get re-used.
+    @staticmethod
+    def get_or_create_task(workflow_name: str, data_entry_id: uuid.UUID) -> "Task":
+        task: Optional[Task] = (
+            Task.select()
+            .where(
+                (Task.workflow_name == workflow_name)
+                & (Task.data_entry == data_entry_id)
+            )
+            .order_by(Task.created_at.desc())
+            .first()
+        )
+        if task is None:
+            return Task.create_task(
+                workflow_name=workflow_name, data_entry_id=data_entry_id
+            )
+
+        print(
+            f"TASK {task.id}: re-using task for {workflow_name}, previous retries {task.retries_count}"
+        )
+        task.retries_count += 1
+        Task.update(retries_count=task.retries_count).where(
+            Task.id == task.id
+        ).execute()
+        return task
+
+    # Returns (True, output) if the step was already checkpointed, (False, None) otherwise.
+    def get_checkpoint(self, step_name: str) -> Tuple[bool, Any]:
+        checkpoints = self.checkpoints or {}
+        if step_name not in checkpoints:
+            return False, None
+        return True, checkpoints[step_name]["output"]
+
+    # `output` should be JSON serializable.
+    # NOTE: Steps can finish in parallel threads, so we only ever update the checkpoints column.
+    def set_checkpoint(self, step_name: str, output: Any):
+        with _task_save_lock:
+            if self.checkpoints is None:
+                self.checkpoints = {}
+            self.checkpoints[step_name] = {
+                "output": utils.to_json_serializable(output),
+                "timestamp": datetime.datetime.now().isoformat(),  # for json serializable
+            }
+            Task.update(checkpoints=self.checkpoints).where(
+                Task.id == self.id
+            ).execute()
+        print(f"TASK {self.id} {step_name}: checkpoint saved")
+
+    # Runs `fn` unless `stage_name` was already done (e.g. by a previous attempt which hit the Lambda timeout).
+    # If `fn` raises, the stage is NOT marked as done.
+    def run_once(self, stage_name: str, fn: Callable[[], Any]) -> Any:
+        has_checkpoint, output = self.get_checkpoint(stage_name)
+        if has_checkpoint:
+            print(f"TASK {self.id} {stage_name}: skipping as already done")
+            return output
+        output = fn()
+        self.set_checkpoint(stage_name, output)
+        return output
+
+    # Same as run_once, but only marks the stage as done if `fn` returned a truthy output,
+    # e.g. an email which failed to send gets another try on the retry.
+    def run_once_if_succeeded(self, stage_name: str, fn: Callable[[], Any]) -> Any:
+        has_checkpoint, output = self.get_checkpoint(stage_name)
+        if has_checkpoint:
+            print(f"TASK {self.id} {stage_name}: skipping as already done")
+            return output
+        output = fn()
+        if output:
+            self.set_checkpoint(stage_name, output)
+        else:
+            print(f"TASK {self.id} {stage_name}: not done, will be re-tried")
+        return output
+
     # NOTE: This is somewhat redundant to PromptLog - but here we only collect final user-visible outputs.
     # Here "output" means "draft" in user-facing output,
     # one Task can handle multiple results.
@@ -54,7 +132,9 @@ class Task(BaseTask):
                 "timestamp": datetime.datetime.now().isoformat(),  # for json serializable
             }
         )
-        self.save()
+        # Checkpoints can be set from other threads at the same time.
+        with _task_save_lock:
+            self.save()
 
     # When syncing to external systems.
     # `response` should be JSON serializable
@@ -79,6 +79,36 @@ else
     echo "Successfully updated Lambda function."
 fi
 
+echo "=== Schedule the email outbox dispatch ==="
+# Every minute the Lambda drains the email_log outbox (see dispatch_scheduled_emails), for the paced emails
+# which were still pending when the invocation that scheduled them ran out of time.
+OUTBOX_RULE_NAME="draft-your-follow-ups-email-outbox"
+OUTBOX_RULE_ARN=$(aws events put-rule \
+    --name $OUTBOX_RULE_NAME \
+    --schedule-expression "rate(1 minute)" \
+    --query RuleArn --output text \
+    --profile $PROFILE_NAME)
+if [ $? -ne 0 ]; then
+    echo "Failed to create the email outbox schedule, exiting."
+    exit 1
+fi
+# Fails when the permission already exists, which is fine.
+aws lambda add-permission \
+    --function-name draft-your-follow-ups \
+    --statement-id $OUTBOX_RULE_NAME \
+    --action lambda:InvokeFunction \
+    --principal events.amazonaws.com \
+    --source-arn $OUTBOX_RULE_ARN \
+    --profile $PROFILE_NAME > /dev/null 2>&1
+aws events put-targets \
+    --rule $OUTBOX_RULE_NAME \
+    --targets "Id"="draft-your-follow-ups","Arn"="arn:aws:lambda:us-east-1:831154875375:function:draft-your-follow-ups" \
+    --profile $PROFILE_NAME
+if [ $? -ne 0 ]; then
+    echo "Failed to target the email outbox schedule at the Lambda, exiting."
+    exit 1
+fi
+
 # ====== TESTING IN PROD ============
 # Upload a test file to S3 to trigger Lambda function
 echo "=== Upload test file to S3 bucket ==="
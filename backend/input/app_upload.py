@@ -1,4 +1,5 @@
 import uuid
+from typing import Iterable, Optional
 
 from app.emails import (
     send_app_upload_confirmation,
@@ -7,17 +8,22 @@ from app.emails import (
 from gpt_form_filler.openai_client import OpenAiClient
 
 from common.aws_utils import is_running_in_aws
+from common.gpt_client import set_rate_limited_account
 from common.gpt_utils import transcribe_audio_chunk_filepaths
 from database.account import Account
 from database.data_entry import STATE_UPLOAD_DONE
 from database.email_log import EmailLog
 from database.models import BaseDataEntry
-from input.ffmpeg_utils import ffmpeg_convert_to_whisper_supported_audio
+from input.ffmpeg_utils import ffmpeg_convert_to_whisper_supported_audio, transcription_cache_key
 
 
 # App uploads are in webm format - which should work with Whisper (but then they claimed the same for .wav).
+# When `audio_chunk_filepaths` is set (e.g. a streaming conversion already running), we skip our own conversion.
 def process_app_upload(
-    gpt_client: OpenAiClient, audio_or_video_filepath: str, data_entry_id: uuid.UUID
+    gpt_client: OpenAiClient,
+    audio_or_video_filepath: Optional[str],
+    data_entry_id: uuid.UUID,
+    audio_chunk_filepaths: Optional[Iterable[str]] = None,
 ) -> BaseDataEntry:
     print(f"process_app_upload for data_entry_id {data_entry_id}")
 
@@ -26,10 +32,17 @@ def process_app_upload(
 
     # First check if everything is fine
     data_entry: BaseDataEntry = BaseDataEntry.get_by_id(data_entry_id)
+    set_rate_limited_account(gpt_client, data_entry.account_id)
 
     # Browser standards now suggest .webm format, but with so many client versions you cannot guarantee that.
-    converted_audio_filepath_chunks = ffmpeg_convert_to_whisper_supported_audio(audio_or_video_filepath)
-    output_transcript = transcribe_audio_chunk_filepaths(gpt_client, converted_audio_filepath_chunks)
+    if audio_chunk_filepaths is None:
+        audio_chunk_filepaths = ffmpeg_convert_to_whisper_supported_audio(audio_or_video_filepath)
+    output_transcript = transcribe_audio_chunk_filepaths(
+        gpt_client,
+        audio_chunk_filepaths,
+        account_id=data_entry.account_id,
+        cache_key_fn=transcription_cache_key,
+    )
 
     data_entry.output_transcript = output_transcript
     data_entry.state = STATE_UPLOAD_DONE
@@ -1,18 +1,20 @@
 import datetime
-import os
 import re
-from typing import Optional
+from typing import BinaryIO, Optional
 
 from common.aws_utils import is_running_in_aws
 from common.config import SUPPORT_EMAIL
 from gpt_form_filler.openai_client import OpenAiClient
 
+from common.gpt_client import set_rate_limited_account
 from common.gpt_utils import transcribe_audio_chunk_filepaths
+from common.storage_utils import copy_stream_to_file
+from common.tmp_storage import get_work_dir
 from common.twillio_client import TwilioClient
 from database.account import Account
 from database.data_entry import STATE_UPLOAD_DONE
 from database.models import BaseDataEntry
-from input.ffmpeg_utils import ffmpeg_convert_to_whisper_supported_audio
+from input.ffmpeg_utils import ffmpeg_convert_to_whisper_supported_audio, transcription_cache_key
 
 
 def strip_empty_tokens(text):
@@ -32,7 +34,7 @@ def process_voice_recording_input(
     bucket_url: Optional[str],  # for tracking purposes
     event_timestamp: datetime.datetime,
     call_sid: str,
-    voice_file_data: bytes,
+    voice_file_stream: BinaryIO,
     phone_number: str,
     full_name: str,
     phone_carrier_info: Optional[str] = None,
@@ -45,10 +47,10 @@ def process_voice_recording_input(
         full_name=full_name,
         onboarding_kwargs={"phone_carrier_info": phone_carrier_info},
     )
+    set_rate_limited_account(gpt_client, account.id)
 
     if account.get_email() is None:
         msg = (
-            # (size {pretty_filesize_int(len(voice_file_data))})
             f"Hi boss, Voxana here. I have received your voicemail.\n"
             "To get your results into your inbox, please reply with a sms containing your email address.\n"
             f"In case of troubles, you can always reach my supervisors at {SUPPORT_EMAIL}.\n"
@@ -91,12 +93,14 @@ def process_voice_recording_input(
     res = BaseDataEntry.get(BaseDataEntry.id == inserted_id)
 
     # TODO(P3, cleanup): Would be nice to move the filesystem off this file.
-    file_path = os.path.join("/tmp/", call_sid)
-    with open(file_path, "wb") as f:
-        f.write(voice_file_data)
+    file_path = get_work_dir().path(call_sid)
+    copy_stream_to_file(voice_file_stream, file_path)
+    get_work_dir().track(file_path)
 
     converted_audio_filepath_chunks = ffmpeg_convert_to_whisper_supported_audio(file_path)
-    output_transcript = transcribe_audio_chunk_filepaths(gpt_client, converted_audio_filepath_chunks)
+    output_transcript = transcribe_audio_chunk_filepaths(
+        gpt_client, converted_audio_filepath_chunks, cache_key_fn=transcription_cache_key
+    )
     res.output_transcript = output_transcript
 
     res.save()
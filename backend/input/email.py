@@ -1,46 +1,48 @@
 import datetime
 import traceback
-from email import message_from_bytes
+from concurrent.futures import ThreadPoolExecutor
+from email.message import Message
 from email.utils import parsedate_to_datetime
+from typing import BinaryIO
 
-from app.emails import (
-    get_email_params_for_reply,
-    send_confirmation,
-    store_and_get_attachments_from_email,
-)
+from app.emails import get_email_params_for_reply, send_confirmation
 from gpt_form_filler.openai_client import OpenAiClient
 
 from common.aws_utils import is_running_in_aws
-from common.gpt_utils import transcribe_audio_chunk_filepaths
+from common.gpt_client import set_rate_limited_account
+from common.gpt_utils import NO_AUDIO_TRANSCRIPT, transcribe_audio_chunk_filepaths
 from database.account import Account
 from database.data_entry import STATE_UPLOAD_DONE
 from database.email_log import EmailLog
 from database.models import BaseDataEntry
-from input.ffmpeg_utils import ffmpeg_convert_to_whisper_supported_audio
+from input.ffmpeg_utils import ffmpeg_convert_to_whisper_supported_audio, transcription_cache_key
+from input.mime_stream import stream_and_store_attachments_from_email
 
+EMAIL_ATTACHMENTS_MAX_CONCURRENCY = 4
 
+
+def get_email_datetime(msg: Message) -> datetime.datetime:
+    if "Date" in msg:
+        return parsedate_to_datetime(msg["Date"])
+    print(
+        f"email msg does NOT have Date field, defaulting to now for email {msg['Message-ID']}"
+    )
+    return datetime.datetime.now()
+
+
+# `raw_email_stream` is anything with .read(size), e.g. S3 StreamingBody, local file handle or io.BytesIO.
 def process_email_input(
-    gpt_client: OpenAiClient, raw_email, bucket_url=None
+    gpt_client: OpenAiClient, raw_email_stream: BinaryIO, bucket_url=None
 ) -> BaseDataEntry:
     # TODO(P1, migration): Refactor the email processing to another function which returns some custom object maybe
-    print(f"Read raw_email body with {len(raw_email)} bytes")
-
-    # ======== Parse the email
-    msg = message_from_bytes(raw_email)
+    # ======== Parse the email, attachments are decoded straight into files as we read the stream
+    msg, attachment_file_paths = stream_and_store_attachments_from_email(
+        raw_email_stream,
+        file_name_prefix_fn=lambda headers: str(get_email_datetime(headers)),
+    )
     base_email_params = get_email_params_for_reply(msg)
-
     # Generate run-id as an idempotency key for re-runs
-    if "Date" in msg:
-        email_datetime = parsedate_to_datetime(msg["Date"])
-    else:
-        print(
-            f"email msg does NOT have Date field, defaulting to now for email {base_email_params}"
-        )
-        email_datetime = datetime.datetime.now()
-
-    attachment_file_paths = store_and_get_attachments_from_email(
-        msg, file_name_prefix=str(email_datetime)
-    )
+    email_datetime = get_email_datetime(msg)
 
     # To speak the truth, by sending an email they didn't yet signed up.
     # TODO(P0, ux): Test if this works after refactoring.
@@ -49,6 +51,7 @@ def process_email_input(
         full_name=base_email_params.recipient_full_name,
         utm_source="email_input",
     )
+    set_rate_limited_account(gpt_client, account.id)
 
     inserted_id = (
         BaseDataEntry.insert(
@@ -97,14 +100,28 @@ def process_email_input(
         traceback.print_exc()
 
     # For multiple attachments, we just merge them into one.
-    input_transcripts = []
-    for attachment_num, attachment_file_path in enumerate(attachment_file_paths):
+    # People often forward multiple voice memos in one email, so we convert and transcribe them concurrently.
+    # The ffmpeg processes and Whisper requests are capped globally in ffmpeg_utils and gpt_utils respectively.
+    def _convert_and_transcribe(attachment_num: int, attachment_file_path: str) -> str:
         print(
             f"Processing attachment {attachment_num} out of {len(attachment_file_paths)}"
         )
         converted_audio_filepath_chunks = ffmpeg_convert_to_whisper_supported_audio(attachment_file_path)
-        input_transcripts.append(transcribe_audio_chunk_filepaths(gpt_client, converted_audio_filepath_chunks))
+        return transcribe_audio_chunk_filepaths(
+            gpt_client, converted_audio_filepath_chunks, account_id=account.id, cache_key_fn=transcription_cache_key
+        )
+
+    max_workers = max(1, min(EMAIL_ATTACHMENTS_MAX_CONCURRENCY, len(attachment_file_paths)))
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="attachment") as executor:
+        # executor.map keeps the original attachment order.
+        input_transcripts = list(
+            executor.map(_convert_and_transcribe, range(len(attachment_file_paths)), attachment_file_paths)
+        )
 
+    # Silent attachments (e.g. an accidental recording next to the real one) should not end up in the transcript.
+    input_transcripts = [transcript for transcript in input_transcripts if transcript != NO_AUDIO_TRANSCRIPT]
+    if len(input_transcripts) == 0:
+        input_transcripts = [NO_AUDIO_TRANSCRIPT]
     result.output_transcript = "\n\n".join(input_transcripts)
     result.save()
     return result
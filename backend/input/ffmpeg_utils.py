@@ -1,24 +1,397 @@
+import contextlib
+import hashlib
+import itertools
+import json
 import os
+import re
 import subprocess
+import threading
 import time
 import traceback
-from typing import List
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List, Optional, Tuple
 
-from pydub import AudioSegment
+from common.config import AUDIO_PRESCREEN_ENABLED, FFMPEG_AUDIO_PROFILE, FFMPEG_MAX_CONCURRENCY
+from common.gpt_cache import TranscriptionCacheKey
+from common.storage_utils import file_content_hash, pretty_filesize_int, pretty_filesize_path
+from common.tmp_storage import converted_audio_cache, get_work_dir
 
 
 WHISPER_API_MAX_FILE_SIZE = 25 * 1024 * 1024
 WHISPER_API_CHUNK_TARGET_FILE_SIZE = 20 * 1024 * 1024
 WHISPER_API_OVERLAP_MS = 3000
 WHISPER_API_MIN_LAST_CHUNK_MS = 15000
+# Pauses quieter than SILENCE_NOISE_DB for at least SILENCE_MIN_DURATION_MS are candidates for chunk boundaries.
+SILENCE_NOISE_DB = -35
+SILENCE_MIN_DURATION_MS = 500
+# How far before the size-derived target we look for a pause, as a fraction of the chunk duration.
+SILENCE_SEARCH_WINDOW_RATIO = 0.25
+SILENCE_FLOOR_DB = -100.0
+FINGERPRINT_BUCKET_DB = 6
+# Short or flat (e.g. mostly silent) recordings have too few distinct envelopes, so they would collide.
+FINGERPRINT_MIN_DURATION_SECONDS = 60
+FINGERPRINT_MIN_DISTINCT_BUCKETS = 4
+# Pre-screen thresholds, anything below is considered an accidental or silent upload (and never sent to Whisper).
+PRESCREEN_MIN_DURATION_MS = 1500
+PRESCREEN_MIN_RMS_DB = -50.0
+PRESCREEN_MIN_SPEECH_MS = 1000
+PRESCREEN_MIN_SPEECH_RATIO = 0.02
+# Only leading / trailing silence longer than this gets trimmed, we keep a bit of padding around the speech.
+TRIM_SILENCE_MIN_MS = 5000
+TRIM_SILENCE_PADDING_MS = 500
+
+
+# ffmpeg is CPU bound, so running more processes than cores (e.g. for multiple email attachments at once)
+# just makes every one of them slower. Shared across all threads of the process.
+ffmpeg_process_semaphore = threading.BoundedSemaphore(FFMPEG_MAX_CONCURRENCY)
+# Set while the current thread runs the helper ffmpeg calls of a pipeline, which already holds a slot.
+_ffmpeg_thread_state = threading.local()
+
+
+def run_ffmpeg(args: List[str], **kwargs) -> subprocess.CompletedProcess:
+    if getattr(_ffmpeg_thread_state, "in_pipeline_slot", False):
+        return subprocess.run(args, **kwargs)
+    with ffmpeg_process_semaphore:
+        return subprocess.run(args, **kwargs)
+
+
+# E.g. the streaming conversion holds a slot for its long-running ffmpeg process, and cuts the chunks
+# with short ffmpeg runs next to it. Taking another slot for those could deadlock with FFMPEG_MAX_CONCURRENCY 1.
+@contextlib.contextmanager
+def _within_pipeline_slot():
+    _ffmpeg_thread_state.in_pipeline_slot = True
+    try:
+        yield
+    finally:
+        _ffmpeg_thread_state.in_pipeline_slot = False
+
+
+# Returns the first audio stream and the container format info, e.g. {"duration_ms": 1234, "bit_rate": 64000, ...}
+# ffprobe only reads the headers (and at worst scans packets), it never decodes the audio.
+# With `input_bytes` (e.g. the head of a download) `audio_file_path` is ignored, and the duration is usually unknown.
+def ffprobe_audio_info(audio_file_path: str, input_bytes: Optional[bytes] = None) -> dict:
+    completed = subprocess.run(
+        ["ffprobe", "-v", "error", "-print_format", "json", "-show_format", "-show_streams",
+         "-select_streams", "a:0", audio_file_path if input_bytes is None else "pipe:0"],
+        check=True,
+        capture_output=True,
+        input=input_bytes,
+    )
+    probe = json.loads(completed.stdout)
+    format_info = probe.get("format", {})
+    streams = probe.get("streams", [])
+    audio_stream = streams[0] if len(streams) > 0 else {}
+
+    # Some containers (e.g. webm from MediaRecorder) only have the duration on the stream level, or none at all.
+    duration = format_info.get("duration") or audio_stream.get("duration")
+    bit_rate = audio_stream.get("bit_rate") or format_info.get("bit_rate")
+    return {
+        "duration_ms": int(float(duration) * 1000) if duration is not None else None,
+        "bit_rate": int(bit_rate) if bit_rate is not None else None,
+        "codec_name": audio_stream.get("codec_name"),
+        "format_name": format_info.get("format_name"),
+    }
+
+
+# Uses ffmpeg's silencedetect filter (an energy based voice activity detection), returns [(start_ms, end_ms)] of pauses.
+# The decoding happens inside ffmpeg in a streaming fashion, so memory stays flat regardless the file size.
+def ffmpeg_detect_silences(
+    audio_file_path: str, noise_db: int = SILENCE_NOISE_DB, min_silence_ms: int = SILENCE_MIN_DURATION_MS
+) -> List[Tuple[int, int]]:
+    completed = run_ffmpeg(
+        ["ffmpeg", "-hide_banner", "-nostats", "-i", audio_file_path, "-vn",
+         "-af", f"silencedetect=noise={noise_db}dB:d={min_silence_ms / 1000}", "-f", "null", "-"],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    return _parse_silencedetect(completed.stderr)
+
+
+# When `duration_ms` is set, a silence still open at the end of the stream (older ffmpeg versions
+# do not print the last silence_end) is closed at the end of the audio.
+def _parse_silencedetect(ffmpeg_stderr: str, duration_ms: Optional[int] = None) -> List[Tuple[int, int]]:
+    silences = []
+    silence_start_ms = None
+    for line in ffmpeg_stderr.splitlines():
+        start_match = re.search(r"silence_start: (-?[\d.]+)", line)
+        if start_match:
+            silence_start_ms = max(0, int(float(start_match.group(1)) * 1000))
+            continue
+        end_match = re.search(r"silence_end: ([\d.]+)", line)
+        if end_match and silence_start_ms is not None:
+            silences.append((silence_start_ms, int(float(end_match.group(1)) * 1000)))
+            silence_start_ms = None
+    if silence_start_ms is not None and duration_ms is not None and silence_start_ms < duration_ms:
+        silences.append((silence_start_ms, duration_ms))
+    return silences
+
+
+# Cheap local stats computed by ffmpeg (silencedetect + astats) in a single decoding pass,
+# so we can tell silent or accidental uploads apart without paying for Whisper (and GPT) first.
+@dataclass
+class AudioStats:
+    duration_ms: int
+    rms_db: float
+    silences: List[Tuple[int, int]]
+
+    @property
+    def speech_ms(self) -> int:
+        return max(0, self.duration_ms - sum(end - start for start, end in self.silences))
+
+    @property
+    def speech_ratio(self) -> float:
+        return self.speech_ms / self.duration_ms if self.duration_ms > 0 else 0.0
+
+    @property
+    def leading_silence_ms(self) -> int:
+        if len(self.silences) > 0 and self.silences[0][0] <= TRIM_SILENCE_PADDING_MS:
+            return self.silences[0][1]
+        return 0
+
+    @property
+    def trailing_silence_ms(self) -> int:
+        if len(self.silences) > 0 and self.silences[-1][1] >= self.duration_ms - TRIM_SILENCE_PADDING_MS:
+            return self.duration_ms - self.silences[-1][0]
+        return 0
+
+    def is_silent(self) -> bool:
+        return (
+            self.duration_ms < PRESCREEN_MIN_DURATION_MS
+            or self.rms_db < PRESCREEN_MIN_RMS_DB
+            or self.speech_ms < PRESCREEN_MIN_SPEECH_MS
+            or self.speech_ratio < PRESCREEN_MIN_SPEECH_RATIO
+        )
+
+    # Returns the (start_ms, end_ms) of the audio worth transcribing, or None if there is nothing worth trimming.
+    def speech_bounds_ms(self) -> Optional[Tuple[int, int]]:
+        start_ms = 0
+        if self.leading_silence_ms >= TRIM_SILENCE_MIN_MS:
+            start_ms = self.leading_silence_ms - TRIM_SILENCE_PADDING_MS
+        end_ms = self.duration_ms
+        if self.trailing_silence_ms >= TRIM_SILENCE_MIN_MS:
+            end_ms = self.duration_ms - self.trailing_silence_ms + TRIM_SILENCE_PADDING_MS
+        if start_ms == 0 and end_ms == self.duration_ms or start_ms >= end_ms:
+            return None
+        return start_ms, end_ms
+
+    def __str__(self):
+        return (
+            f"duration {round(self.duration_ms / 1000, 2)}s, rms {round(self.rms_db, 1)}dB, "
+            f"speech {round(self.speech_ratio * 100, 1)}%, leading silence {self.leading_silence_ms}ms, "
+            f"trailing silence {self.trailing_silence_ms}ms"
+        )
+
+
+def _parse_astats_overall_rms_db(ffmpeg_stderr: str) -> Optional[float]:
+    is_overall_section = False
+    for line in ffmpeg_stderr.splitlines():
+        if line.rstrip().endswith("] Overall"):
+            is_overall_section = True
+            continue
+        rms_match = re.search(r"RMS level dB: (\S+)", line)
+        if is_overall_section and rms_match:
+            value = rms_match.group(1)
+            # Digital silence is reported as -inf
+            return float(value) if value not in ("-inf", "inf", "nan") else SILENCE_FLOOR_DB
+    return None
+
+
+# Returns None if the stats cannot be computed, in which case callers should just go ahead with the transcription.
+def ffmpeg_analyze_audio(audio_file_path: str) -> Optional[AudioStats]:
+    start_time = time.time()
+    try:
+        duration_ms = ffprobe_audio_info(audio_file_path)["duration_ms"]
+        completed = run_ffmpeg(
+            ["ffmpeg", "-hide_banner", "-nostats", "-i", audio_file_path, "-vn",
+             "-af", f"silencedetect=noise={SILENCE_NOISE_DB}dB:d={SILENCE_MIN_DURATION_MS / 1000},astats",
+             "-f", "null", "-"],
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+    except subprocess.CalledProcessError as e:
+        print(f"WARNING: cannot analyze audio {audio_file_path}: {e}")
+        return None
+
+    rms_db = _parse_astats_overall_rms_db(completed.stderr)
+    if duration_ms is None or rms_db is None:
+        print(f"WARNING: cannot analyze audio {audio_file_path}: duration {duration_ms}, rms {rms_db}")
+        return None
+    stats = AudioStats(
+        duration_ms=duration_ms,
+        rms_db=rms_db,
+        silences=_parse_silencedetect(completed.stderr, duration_ms=duration_ms),
+    )
+    print(f"Analyzed {audio_file_path} in {round(time.time() - start_time, 2)} seconds: {stats}")
+    return stats
+
+
+# Coarse loudness envelope: one RMS level per second of the decoded mono audio, computed by ffmpeg's astats.
+def _ffmpeg_loudness_envelope(audio_file_path: str, window_ms: int = 1000) -> List[float]:
+    sample_rate = 8000
+    completed = run_ffmpeg(
+        ["ffmpeg", "-hide_banner", "-nostats", "-loglevel", "error", "-i", audio_file_path, "-vn", "-ac", "1",
+         "-af", f"aresample={sample_rate},asetnsamples=n={sample_rate * window_ms // 1000}:p=0,"
+                "astats=metadata=1:reset=1,ametadata=print:key=lavfi.astats.Overall.RMS_level:file=-",
+         "-f", "null", "-"],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    levels = []
+    for line in completed.stdout.splitlines():
+        if line.startswith("lavfi.astats.Overall.RMS_level="):
+            value = line.split("=", 1)[1]
+            # Digital silence is reported as -inf
+            levels.append(float(value) if value not in ("-inf", "inf", "nan") else SILENCE_FLOOR_DB)
+    return levels
+
+
+# Best-effort fingerprint which stays the same when the same recording is re-encoded (e.g. the app upload is webm,
+# while the email attachment of the same recording is m4a). We quantize the per-second loudness relative to
+# the median loudness, so gain and codec differences mostly cancel out. It is NOT a Shazam-like fingerprint,
+# it only tries to catch the exact same recording arriving through a different channel.
+def ffmpeg_audio_fingerprint(audio_file_path: str) -> Optional[str]:
+    try:
+        levels = _ffmpeg_loudness_envelope(audio_file_path)
+    except subprocess.CalledProcessError as e:
+        print(f"WARNING: cannot compute audio fingerprint for {audio_file_path}: {e}")
+        return None
+    if len(levels) < FINGERPRINT_MIN_DURATION_SECONDS:
+        return None
+
+    median_level = sorted(levels)[len(levels) // 2]
+    buckets = [str(int(round((level - median_level) / FINGERPRINT_BUCKET_DB))) for level in levels]
+    if len(set(buckets)) < FINGERPRINT_MIN_DISTINCT_BUCKETS:
+        print(f"INFO: {audio_file_path} loudness is too flat for a fingerprint")
+        return None
+    return hashlib.sha256(f"{len(levels)}:{','.join(buckets)}".encode("utf-8")).hexdigest()
+
+
+# Hash of the decoded audio (mono 16kHz PCM, the way Whisper hears it), so the same audio in a different
+# container, or with different tags and timestamps (e.g. re-muxed by the streaming conversion), still matches.
+# The decoding streams through ffmpeg's hash muxer, so memory stays flat regardless the file size.
+def ffmpeg_decoded_audio_hash(audio_file_path: str) -> Optional[str]:
+    try:
+        completed = run_ffmpeg(
+            ["ffmpeg", "-hide_banner", "-nostats", "-loglevel", "error", "-i", audio_file_path,
+             "-map", "0:a:0", "-ac", "1", "-ar", "16000", "-c:a", "pcm_s16le", "-f", "hash", "-hash", "sha256", "-"],
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+    except subprocess.CalledProcessError as e:
+        print(f"WARNING: cannot decode {audio_file_path} for its hash: {e}")
+        return None
+    # E.g. SHA256=afa6e9...
+    return completed.stdout.strip().split("=", 1)[-1] or None
+
+
+def _probe_duration_ms(audio_file_path: str) -> Optional[int]:
+    try:
+        return ffprobe_audio_info(audio_file_path)["duration_ms"]
+    except subprocess.CalledProcessError as e:
+        print(f"WARNING: cannot probe the duration of {audio_file_path}: {e}")
+        return None
+
+
+# For transcribe_audio_chunk_filepaths, None when the audio cannot be decoded (then it goes uncached).
+def transcription_cache_key(audio_file_path: str) -> Optional[TranscriptionCacheKey]:
+    content_hash = ffmpeg_decoded_audio_hash(audio_file_path)
+    if content_hash is None:
+        return None
+    return TranscriptionCacheKey(
+        content_hash=content_hash,
+        get_audio_fingerprint=lambda: ffmpeg_audio_fingerprint(audio_file_path),
+        get_duration_ms=lambda: _probe_duration_ms(audio_file_path),
+    )
+
+
+# A chunk file path which remembers whether the chunk starts with `overlap_ms` of the previous chunk's audio,
+# i.e. whether the seam was a hard cut (then the duplicated words get dropped) or a cut in a pause.
+# It is a str, so the callers can keep passing the chunks around as file paths.
+class AudioChunkPath(str):
+    overlaps_previous: bool = False
+
+    @classmethod
+    def of(cls, file_path: str, overlaps_previous: bool) -> "AudioChunkPath":
+        chunk_path = cls(file_path)
+        chunk_path.overlaps_previous = overlaps_previous
+        return chunk_path
+
+
+def chunk_overlaps_previous(file_path: str) -> bool:
+    return getattr(file_path, "overlaps_previous", False)
+
+
+# Splits the audio file into [start_ms, end_ms) intervals of at most `chunk_size_ms`.
+# Where possible, we cut in the middle of a pause close to the target so no word gets split and no overlap is needed.
+# Only when there is no pause within the search window, we do a hard cut and extend the chunk by `overlap_ms`
+# (the duplicated words at those seams are then dropped in transcribe_audio_chunk_filepaths).
+def _plan_chunk_intervals(
+    duration_ms: int, chunk_size_ms: int, overlap_ms: int, silences: List[Tuple[int, int]]
+) -> List[Tuple[int, int]]:
+    search_window_ms = int(chunk_size_ms * SILENCE_SEARCH_WINDOW_RATIO)
+    silence_midpoints = [(silence_start + silence_end) // 2 for silence_start, silence_end in silences]
+
+    intervals = []
+    chunk_start = 0
+    while chunk_start < duration_ms:
+        target_cut = chunk_start + chunk_size_ms
+        if target_cut >= duration_ms:
+            intervals.append((chunk_start, duration_ms))
+            break
+
+        # Never cut after the target, as that could go over the Whisper file size limit.
+        candidates = [mid for mid in silence_midpoints if target_cut - search_window_ms <= mid <= target_cut]
+        if len(candidates) > 0:
+            chunk_cut = max(candidates)
+            chunk_end = chunk_cut
+        else:
+            print(f"No pause found around {target_cut} ms, doing a hard cut with {overlap_ms} ms overlap")
+            chunk_cut = target_cut
+            chunk_end = min(target_cut + overlap_ms, duration_ms)
+
+        # Ensure the last chunk is at least 15 seconds long
+        if duration_ms - chunk_cut < WHISPER_API_MIN_LAST_CHUNK_MS:
+            print("Last-ish chunk is too short, extending it to 15 seconds")
+            intervals.append((chunk_start, duration_ms))  # Merge the remaining audio into the current chunk
+            break
+        intervals.append((chunk_start, chunk_end))
+        chunk_start = chunk_cut
+    return intervals
+
+
+# Stream copy cut of a single interval, i.e. no decoding nor re-encoding happens (audio packets are all key-frames).
+def _ffmpeg_copy_interval(audio_file_path: str, chunk_filepath: str, start_ms: int, end_ms: int):
+    run_ffmpeg(
+        ["ffmpeg", "-y", "-loglevel", "warning",
+         "-ss", str(start_ms / 1000), "-i", audio_file_path, "-t", str((end_ms - start_ms) / 1000),
+         "-map", "0:a:0", "-c", "copy", chunk_filepath],
+        check=True,
+    )
+
+
+# Cuts the whole file in one ffmpeg pass using the segment muxer, only works for non-overlapping (contiguous) chunks.
+def _ffmpeg_segment_at(audio_file_path: str, chunk_filepath_pattern: str, cut_points_ms: List[int]):
+    args = ["ffmpeg", "-y", "-loglevel", "warning", "-i", audio_file_path,
+            "-map", "0:a:0", "-c", "copy", "-f", "segment", "-reset_timestamps", "1", "-segment_start_number", "1"]
+    if len(cut_points_ms) > 0:
+        args += ["-segment_times", ",".join(str(cut_point / 1000) for cut_point in cut_points_ms)]
+    else:
+        # Effectively disables segmenting, still going through the same code path.
+        args += ["-segment_time", "999999"]
+    run_ffmpeg(args + [chunk_filepath_pattern], check=True)
 
 
 # Here object_prefix is used for both local, response attachments and buckets.
 # BEWARE: This requires the heavy ffmpeg to be installed on the machine (which is a quite large dependency).
+# NOTE: We never decode the audio in Python memory, ffmpeg just copies the encoded packets into the chunk files.
 def deal_with_potentially_large_audio_file(
         audio_file_path,
-        target_file_size:int = WHISPER_API_CHUNK_TARGET_FILE_SIZE,
-        overlap_ms: int = 3000
+        target_file_size: int = WHISPER_API_CHUNK_TARGET_FILE_SIZE,
+        overlap_ms: int = WHISPER_API_OVERLAP_MS,
 ) -> List[str]:
     # https://platform.openai.com/docs/guides/speech-to-text/longer-inputs
     audio_file_size = os.path.getsize(audio_file_path)
@@ -28,111 +401,529 @@ def deal_with_potentially_large_audio_file(
 
     audio_format = os.path.splitext(audio_file_path)[-1][1:].lower()
     print(f"Audio file is too large for Whisper API: {audio_file_size_mb} MB for {audio_format} "
-          f"-> Splitting it into smaller parts about {WHISPER_API_CHUNK_TARGET_FILE_SIZE / 1024 / 1024} MB each.")
-    audio = AudioSegment.from_file(audio_file_path, format=audio_format)
+          f"-> Splitting it into smaller parts about {target_file_size / 1024 / 1024} MB each.")
+    start_time = time.time()
+    audio_info = ffprobe_audio_info(audio_file_path)
 
     # Calculate the duration per MB to determine the length of each chunk
-    duration_ms = len(audio)  # Get the duration of the entire audio in milliseconds
-    size_per_ms = audio_file_size / duration_ms  # B per millisecond of audio
-    chunk_size_ms = target_file_size / size_per_ms  # Target chunk size 20MB in milliseconds
+    duration_ms: Optional[int] = audio_info["duration_ms"]
+    if duration_ms is not None and duration_ms > 0:
+        size_per_ms = audio_file_size / duration_ms  # B per millisecond of audio
+    elif audio_info["bit_rate"] is not None:
+        size_per_ms = audio_info["bit_rate"] / 8 / 1000
+        duration_ms = int(audio_file_size / size_per_ms)
+        print(f"WARNING: ffprobe returned no duration, estimated {duration_ms} ms from the bit rate")
+    else:
+        print(f"ERROR: cannot probe neither duration nor bit rate for {audio_file_path}, giving it a shot as-is")
+        return [audio_file_path]
+    chunk_size_ms = int(target_file_size / size_per_ms)  # Target chunk size 20MB in milliseconds
 
-    start_time = time.time()
-    chunks = []
-    total_file_size = 0
-    for i, chunk_start in enumerate(range(0, duration_ms, int(chunk_size_ms))):
-        chunk_end = min(chunk_start + int(chunk_size_ms) + overlap_ms, duration_ms)
-        # Ensure the last chunk is at least 15 seconds long
-        should_early_exit = False
-        if duration_ms != chunk_end and duration_ms - chunk_end < WHISPER_API_MIN_LAST_CHUNK_MS:
-            print("Last-ish chunk is too short, extending it to 15 seconds")
-            chunk_end = duration_ms  # Merge the remaining audio into the current chunk
-            should_early_exit = True
+    try:
+        silences = ffmpeg_detect_silences(audio_file_path)
+        print(f"Detected {len(silences)} pauses in {round(time.time() - start_time, 2)} seconds")
+    except subprocess.CalledProcessError as e:
+        print(f"WARNING: ffmpeg silencedetect failed, falling back to fixed size cuts: {e}")
+        silences = []
 
-        chunk = audio[chunk_start:chunk_end]
-        chunk_filepath = f"{audio_file_path}_part_{i+1}.{audio_format}"
+    intervals = _plan_chunk_intervals(duration_ms, chunk_size_ms, overlap_ms, silences)
+    chunk_filepaths = [f"{audio_file_path}_part_{i+1}.{audio_format}" for i in range(len(intervals))]
+    is_contiguous = all(intervals[i][0] == intervals[i - 1][1] for i in range(1, len(intervals)))
+    if is_contiguous:
+        # One ffmpeg process for all chunks, the cut points are the starts of all but the first interval.
+        _ffmpeg_segment_at(
+            audio_file_path,
+            f"{audio_file_path}_part_%d.{audio_format}",
+            cut_points_ms=[chunk_start for chunk_start, _ in intervals[1:]],
+        )
+    else:
+        for (chunk_start, chunk_end), chunk_filepath in zip(intervals, chunk_filepaths):
+            _ffmpeg_copy_interval(audio_file_path, chunk_filepath, chunk_start, chunk_end)
 
-        export_format_map = {
-            "m4a": "ipod",
-            "mp3": "mp3",
-            "webm": "webm",
-            "wav": "wav"
-        }
-        export_format = export_format_map.get(audio_format, audio_format)
-        chunk.export(chunk_filepath, format=export_format)
+    work_dir = get_work_dir()
+    for chunk_filepath in chunk_filepaths:
+        work_dir.track(chunk_filepath)
+    # All the audio is in the chunks now (no-op if the input is not ours, e.g. testdata).
+    work_dir.release(audio_file_path)
 
+    chunks = []
+    total_file_size = 0
+    for i, ((chunk_start, chunk_end), chunk_filepath) in enumerate(zip(intervals, chunk_filepaths)):
         chunk_filesize = os.path.getsize(chunk_filepath)
         total_file_size += chunk_filesize
         chunk_duration_sec = round((chunk_end - chunk_start) / 1000, 2)
-        print(f"Chunk {i+1}: duration {chunk_duration_sec} seconds {round(chunk_filesize / 1024 / 1024, 2)} MB saved as {chunk_filepath}")
+        print(
+            f"Chunk {i+1}: duration {chunk_duration_sec} seconds {round(chunk_filesize / 1024 / 1024, 2)} MB "
+            f"saved as {chunk_filepath}"
+        )
 
+        overlaps_previous = i > 0 and chunk_start < intervals[i - 1][1]
         if chunk_filesize > WHISPER_API_MAX_FILE_SIZE:
             print(f"ERROR: Chunk {i+1} is still too large, lower WHISPER_API_CHUNK_TARGET_FILE_SIZE")
-            # Recurse trying smaller target chunks, without overlap just to be safe.
-            chunks.extend(deal_with_potentially_large_audio_file(chunk_filepath, target_file_size=target_file_size // 2, overlap_ms=0))
+            # Recurse trying smaller target chunks, without (the hard-cut) overlap just to be safe.
+            sub_chunks = deal_with_potentially_large_audio_file(
+                chunk_filepath, target_file_size=target_file_size // 2, overlap_ms=0
+            )
+            # The first sub-chunk still starts with the overlap of our previous chunk.
+            chunks.append(AudioChunkPath.of(sub_chunks[0], overlaps_previous=overlaps_previous))
+            chunks.extend(sub_chunks[1:])
         else:
-            chunks.append(chunk_filepath)
-
-        if should_early_exit:
-            print("should_early_exit chunk loop true, breaking loop")
-            break
+            chunks.append(AudioChunkPath.of(chunk_filepath, overlaps_previous=overlaps_previous))
 
     duration_in_seconds = time.time() - start_time
     mbs_processed_per_second = round(audio_file_size / 1024 / 1024 / duration_in_seconds, 2)
     print(
-        f"Split up {round(duration_in_seconds, 2)} seconds at speed of {mbs_processed_per_second} MB/seconds into {len(chunks)} chunks."
+        f"Split up {round(duration_in_seconds, 2)} seconds at speed of {mbs_processed_per_second} MB/seconds "
+        f"into {len(chunks)} chunks."
     )
     print(f"Input size: {audio_file_size_mb} MB, Output size: {round(total_file_size / 1024 / 1024, 2)} MB.")
 
     return chunks
 
 
-def ffmpeg_convert_to_whisper_supported_audio(input_file_path: str) -> List[str]:
+# Returns the audio file to transcribe (possibly with long leading / trailing silence trimmed),
+# or None when the recording is silent or accidental, i.e. there is nothing worth sending to Whisper.
+def prescreen_audio_file(audio_file_path: str) -> Optional[str]:
+    if AUDIO_PRESCREEN_ENABLED != "1":
+        return audio_file_path
+    stats = ffmpeg_analyze_audio(audio_file_path)
+    if stats is None:
+        return audio_file_path
+    work_dir = get_work_dir()
+    if stats.is_silent():
+        print(f"INFO: {audio_file_path} looks silent or accidental, skipping transcription ({stats})")
+        work_dir.release(audio_file_path)
+        return None
+
+    speech_bounds = stats.speech_bounds_ms()
+    if speech_bounds is None:
+        return audio_file_path
+    base_file_path, extension = os.path.splitext(audio_file_path)
+    trimmed_file_path = f"{base_file_path}_trimmed{extension}"
+    try:
+        _ffmpeg_copy_interval(audio_file_path, trimmed_file_path, *speech_bounds)
+    except subprocess.CalledProcessError as e:
+        print(f"WARNING: cannot trim silence of {audio_file_path}, transcribing it as-is: {e}")
+        return audio_file_path
+    trimmed_ms = stats.duration_ms - (speech_bounds[1] - speech_bounds[0])
+    print(f"Trimmed {round(trimmed_ms / 1000, 2)} seconds of leading / trailing silence into {trimmed_file_path}")
+    work_dir.track(trimmed_file_path)
+    work_dir.release(audio_file_path)
+    return trimmed_file_path
+
+
+def _prescreen_and_split(audio_file_path: str) -> List[str]:
+    screened_file_path = prescreen_audio_file(audio_file_path)
+    if screened_file_path is None:
+        return []
+    return deal_with_potentially_large_audio_file(screened_file_path)
+
+
+# Each profile is the output file extension and the ffmpeg output args (on top of dropping the video stream).
+AUDIO_PROFILE_DEFAULT = "default"
+AUDIO_PROFILE_SPEECH = "speech"
+AUDIO_PROFILES = {
     # I did a super-quick test on this (and I should have done way before), but it seems that m4a works best.
-    # OR just keeping the original format, but that's not always possible.
     # https://chatgpt.com/share/66e34f17-6bb8-8005-8d3f-44764e481761
-    primary_target_format = "m4a"  # when changing this, also change the -acodec below
-    # We omit formats mp4 and mpeg, as those can be videos too.
-    supported_formats = ["m4a", "mp3", "webm", "wav"]
-    if any(input_file_path.endswith(supported_format) for supported_format in supported_formats):
-        print(f"File is already in a supported format, skipping ffmpeg conversion for: {input_file_path}")
-        return deal_with_potentially_large_audio_file(input_file_path)
-
-    output_file_path = input_file_path + f".{primary_target_format}"
-    print(f"Running ffmpeg on {input_file_path} outputting to {output_file_path}")
-    input_file_size = os.path.getsize(input_file_path) / 1024 / 1024  # in MB
-    print(f".. Expected ffmpeg runtime is {2 * input_file_size} seconds (about 1 second per 0.5MB of input file size).")
-
-    # TODO(P1, cost): Consider deploying Whisper by ourselves, BUT that can be quite expensive anyway.
-    # TODO(P2, ux): Consider optimizing for file-size for faster uploads. For example:
-    # ffmpeg -i audio.mp3 -vn -map_metadata -1 -ac 1 -c:a libopus -b:a 12k -application voip audio.ogg
+    # For higher quality larger file outputs (increases file size by 80%):
+    #      "-b:a", "320k",  # Set audio bitrate to 320kbps for best quality (can be adjusted)
+    #      "-ar", "44100",  # Set sample rate (standard is 44100 Hz)
+    AUDIO_PROFILE_DEFAULT: ("m4a", []),
     # Opus is one of the highest quality audio encoders at low bitrates, and is supported by Whisper in ogg container.
+    # Mono 16kHz is what Whisper resamples to anyway, so we do NOT lose anything for transcription purposes.
+    # At 24kbps one hour of speech is about 10MB, i.e. most recordings end up as a single Whisper chunk.
     # https://community.openai.com/t/whisper-api-increase-file-limit-25-mb/566754
-    # Or this guy MP3 Bit Rate: 16 kbps Sample Rate: 12 kHz Channels: mono
     # https://dev.to/mxro/optimise-openai-whisper-api-audio-format-sampling-rate-and-quality-29fj
+    AUDIO_PROFILE_SPEECH: (
+        "ogg",
+        ["-map_metadata", "-1", "-ac", "1", "-ar", "16000",
+         "-c:a", "libopus", "-b:a", "24k", "-application", "voip"],
+    ),
+}
+# We omit formats mp4 and mpeg, as those can be videos too.
+WHISPER_SUPPORTED_AUDIO_FORMATS = ["m4a", "mp3", "ogg", "webm", "wav"]
+
+
+# Compressed audio codecs Whisper accepts as-is, mapped to the container we can stream copy them into.
+# E.g. phone videos (mp4 / mov) almost always have an AAC track, screen recordings in webm have Opus.
+# NOTE: Uncompressed PCM (e.g. wav) is deliberately missing, copying it is about 10x larger than any re-encode.
+REMUX_FORMAT_BY_CODEC = {
+    "aac": "m4a",
+    "mp3": "mp3",
+    "opus": "ogg",
+    "vorbis": "ogg",
+}
+AUDIO_PROFILE_REMUX = "remux"
+
+
+def _try_ffprobe_audio_info(audio_file_path: str, input_bytes: Optional[bytes] = None) -> Optional[dict]:
+    try:
+        return ffprobe_audio_info(audio_file_path, input_bytes=input_bytes)
+    except (subprocess.CalledProcessError, json.JSONDecodeError) as e:
+        print(f"WARNING: ffprobe failed for {audio_file_path}, cannot remux: {e}")
+        return None
+
+
+# Returns the output format when the audio stream can be copied without re-encoding, None otherwise.
+def _pick_remux_format(audio_info: Optional[dict], profile: str) -> Optional[str]:
+    if audio_info is None:
+        return None
+    remux_format = REMUX_FORMAT_BY_CODEC.get(audio_info["codec_name"])
+    if remux_format is None:
+        print(f"Audio codec {audio_info['codec_name']} is not a compressed one Whisper supports, need to re-encode")
+        return None
+    if profile == AUDIO_PROFILE_DEFAULT:
+        # The default profile re-encodes into AAC, which is about the size of the already compressed input.
+        return remux_format
+
+    # For the compact profiles, only remux when the copied audio fits into a single Whisper request.
+    if audio_info["duration_ms"] is None or audio_info["bit_rate"] is None:
+        return None
+    # NOTE: For some containers (e.g. webm) the bit rate is the overall one including video, i.e. over-estimated.
+    estimated_size = audio_info["bit_rate"] / 8 * audio_info["duration_ms"] / 1000
+    if estimated_size > WHISPER_API_MAX_FILE_SIZE:
+        print(f"Remuxed audio would be about {pretty_filesize_int(int(estimated_size))}, re-encoding with {profile}")
+        return None
+    return remux_format
 
+
+# Returns the converted file path, or None if ffmpeg failed (the input is kept in that case).
+def _ffmpeg_convert_cached(
+    input_file_path: str, input_content_hash: str, target_format: str, cache_profile: str, output_args: List[str]
+) -> Optional[str]:
+    output_file_path = input_file_path + f".{target_format}"
+    work_dir = get_work_dir()
+    # Keyed by content, so a retried invocation for the same S3 object (or an email re-sent) skips the conversion.
+    cache_key = f"{input_content_hash}-{cache_profile}"
+    if converted_audio_cache.maybe_get(cache_key, target_format, output_file_path):
+        work_dir.track(output_file_path)
+        work_dir.release(input_file_path)
+        return output_file_path
+
+    print(f"Running ffmpeg on {input_file_path} outputting to {output_file_path} with profile {cache_profile}")
     try:
         start_time = time.time()
         # -y to force overwrite,
-        #      "-acodec", "aac",  # Use AAC codec (default for M4A)
-        # For higher quality larger file outputs (increases file size by 80%):
-        #      "-b:a", "320k",  # Set audio bitrate to 320kbps for best quality (can be adjusted)
-        #      "-ar", "44100",  # Set sample rate (standard is 44100 Hz)
-        subprocess.run(
+        run_ffmpeg(
             ["ffmpeg", "-y", "-loglevel", "warning", "-i", input_file_path,
              "-vn",  # Disable the video stream (audio-only)
-             output_file_path],
+             ] + output_args + [output_file_path],
             check=True,
         )
         duration_in_seconds = time.time() - start_time
         mbs_processed = os.path.getsize(output_file_path) / 1024 / 1024  # in MB
         mbs_processed_per_second = round(mbs_processed / duration_in_seconds, 2)
-        print(f"Converted in {round(duration_in_seconds, 2)} seconds at speed of {mbs_processed_per_second} MB/second saved as: {output_file_path}")
+        print(f"Converted in {round(duration_in_seconds, 2)} seconds at speed of {mbs_processed_per_second} MB/second "
+              f"saved as: {output_file_path} ({pretty_filesize_path(output_file_path)})")
     except subprocess.CalledProcessError as e:
         print(f"ffmpeg error occurred: {e}")
         traceback.print_exc()
+        return None
+
+    work_dir.track(output_file_path)
+    converted_audio_cache.put(cache_key, target_format, output_file_path)
+    work_dir.release(input_file_path)
+    return output_file_path
+
+
+def ffmpeg_convert_to_whisper_supported_audio(input_file_path: str, profile: str = FFMPEG_AUDIO_PROFILE) -> List[str]:
+    input_file_size = os.path.getsize(input_file_path)
+    is_supported_format = any(
+        input_file_path.endswith(supported_format) for supported_format in WHISPER_SUPPORTED_AUDIO_FORMATS
+    )
+    if is_supported_format:
+        if input_file_size <= WHISPER_API_MAX_FILE_SIZE:
+            print(f"File is already in a supported format, skipping ffmpeg conversion for: {input_file_path}")
+            return _prescreen_and_split(input_file_path)
+        # Re-encoding is way cheaper than uploading (and transcribing) multiple chunks with overlaps.
+        print(f"File is in a supported format but too large ({pretty_filesize_int(input_file_size)}), "
+              f"re-encoding it with the {AUDIO_PROFILE_SPEECH} profile")
+        profile = AUDIO_PROFILE_SPEECH
+
+    if profile not in AUDIO_PROFILES:
+        print(f"WARNING: unknown audio profile {profile}, defaulting to {AUDIO_PROFILE_DEFAULT}")
+        profile = AUDIO_PROFILE_DEFAULT
+    input_content_hash = file_content_hash(input_file_path)
+
+    # Fast path: extracting an already compatible audio track only copies packets, i.e. runs at disk speed.
+    # Skipped for supported formats, as there the remux would just produce the same (too large) file.
+    remux_format = None
+    if not is_supported_format:
+        remux_format = _pick_remux_format(_try_ffprobe_audio_info(input_file_path), profile)
+    if remux_format is not None:
+        remuxed_file_path = _ffmpeg_convert_cached(
+            input_file_path, input_content_hash, remux_format, AUDIO_PROFILE_REMUX,
+            ["-map", "0:a:0", "-c:a", "copy"],
+        )
+        if remuxed_file_path is not None:
+            return _prescreen_and_split(remuxed_file_path)
+        print(f"WARNING: remuxing {input_file_path} failed, falling back to re-encoding")
+
+    target_format, profile_args = AUDIO_PROFILES[profile]
+    input_file_size_mb = input_file_size / 1024 / 1024
+    print(
+        f".. Expected ffmpeg runtime is {2 * input_file_size_mb} seconds "
+        "(about 1 second per 0.5MB of input file size)."
+    )
+    # TODO(P1, cost): Consider deploying Whisper by ourselves, BUT that can be quite expensive anyway.
+    converted_file_path = _ffmpeg_convert_cached(
+        input_file_path, input_content_hash, target_format, profile, profile_args
+    )
+    if converted_file_path is None:
         return []
+    # We analyze the converted audio, as it is way cheaper to decode than e.g. a video input.
+    return _prescreen_and_split(converted_file_path)
+
+
+# Formats which ffmpeg can decode from a non-seekable pipe. Notably mp4 / mov / m4a are NOT, as phones
+# usually write the moov atom (the index) at the end of the file.
+PIPE_DECODABLE_INPUT_FORMATS = ["mkv", "mp3", "ogg", "wav", "webm"]
+# Shorter segments mean transcription can start sooner, at the cost of more seams to stitch.
+PIPELINE_SEGMENT_SECONDS = 300
+PIPELINE_POLL_INTERVAL_SECONDS = 0.2
+# Enough of the download for ffprobe to tell the audio codec, so we know whether we can remux.
+PIPELINE_PROBE_BYTES = 1024 * 1024
+
+
+def is_pipe_decodable(file_name: str) -> bool:
+    return os.path.splitext(file_name)[-1][1:].lower() in PIPE_DECODABLE_INPUT_FORMATS
+
+
+# A failed read (e.g. S3 connection reset) kills ffmpeg and lands in `feed_errors`, as ffmpeg would otherwise
+# happily finish the truncated input and we would transcribe only a part of the recording.
+def _feed_ffmpeg_stdin(
+    process: subprocess.Popen, input_byte_chunks: Iterable[bytes], feed_errors: List[Exception]
+):
+    total_bytes = 0
+    try:
+        for byte_chunk in input_byte_chunks:
+            process.stdin.write(byte_chunk)
+            total_bytes += len(byte_chunk)
+    except BrokenPipeError:
+        print(f"WARNING: ffmpeg closed its stdin after {pretty_filesize_int(total_bytes)}, likely it failed")
+    except Exception as e:
+        print(f"ERROR: reading the input stream failed after {pretty_filesize_int(total_bytes)}: {e}")
+        traceback.print_exc()
+        feed_errors.append(e)
+        process.kill()
+    finally:
+        try:
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+    print(f"Fed {pretty_filesize_int(total_bytes)} into ffmpeg stdin")
+
+
+# Returns the first `probe_bytes` of the stream, and the whole stream (including those) to be consumed later.
+def _peek_byte_chunks(
+    input_byte_chunks: Iterable[bytes], probe_bytes: int = PIPELINE_PROBE_BYTES
+) -> Tuple[bytes, Iterable[bytes]]:
+    input_iterator = iter(input_byte_chunks)
+    head_chunks = []
+    head_size = 0
+    for byte_chunk in input_iterator:
+        head_chunks.append(byte_chunk)
+        head_size += len(byte_chunk)
+        if head_size >= probe_bytes:
+            break
+    return b"".join(head_chunks), itertools.chain(head_chunks, input_iterator)
+
+
+def _ffmpeg_copy_tail(audio_file_path: str, tail_file_path: str, tail_ms: int):
+    run_ffmpeg(
+        ["ffmpeg", "-y", "-loglevel", "warning", "-sseof", str(-tail_ms / 1000), "-i", audio_file_path,
+         "-map", "0:a:0", "-c", "copy", tail_file_path],
+        check=True,
+    )
+
+
+# Stream copy concatenation with the concat demuxer, the inputs have to share the codec and its parameters.
+def _ffmpeg_concat(file_paths: List[str], output_file_path: str):
+    list_file_path = output_file_path + ".txt"
+    with open(list_file_path, "w") as list_file:
+        for file_path in file_paths:
+            # The concat list quoting, e.g. for the user provided file names with a quote.
+            quoted_file_path = os.path.abspath(file_path).replace("'", "'\\''")
+            list_file.write(f"file '{quoted_file_path}'\n")
+    try:
+        run_ffmpeg(
+            ["ffmpeg", "-y", "-loglevel", "warning", "-f", "concat", "-safe", "0", "-i", list_file_path,
+             "-c", "copy", output_file_path],
+            check=True,
+        )
+    finally:
+        os.remove(list_file_path)
+
+
+# Staged pipeline: (download ->) convert -> cut runs in a single ffmpeg process, and the returned iterator yields
+# each chunk as soon as ffmpeg moved on to the next segment. So the caller can transcribe chunk N while ffmpeg
+# still converts chunk N+1 and the tail is still downloading.
+# Pass either `input_file_path`, or `input_byte_chunks` (e.g. S3 body.iter_chunks()) for pipe-decodable formats.
+# We cannot look for pauses ahead of time, so every seam is a hard cut: each chunk starts with the last `overlap_ms`
+# of the previous segment, and is marked with `AudioChunkPath.overlaps_previous` so the duplicated words get stitched.
+# Same as ffmpeg_convert_to_whisper_supported_audio, compressed audio is remuxed rather than re-encoded when the
+# `profile` allows it. The ffmpeg process is started on the first next(), and killed when the iteration stops early.
+def ffmpeg_stream_convert_to_whisper_chunks(
+    output_file_prefix: str,
+    input_file_path: Optional[str] = None,
+    input_byte_chunks: Optional[Iterable[bytes]] = None,
+    segment_seconds: int = PIPELINE_SEGMENT_SECONDS,
+    overlap_ms: int = WHISPER_API_OVERLAP_MS,
+    profile: str = FFMPEG_AUDIO_PROFILE,
+) -> Iterator[str]:
+    if (input_file_path is None) == (input_byte_chunks is None):
+        raise ValueError("exactly one of input_file_path or input_byte_chunks has to be set")
+    if profile not in AUDIO_PROFILES:
+        print(f"WARNING: unknown audio profile {profile}, defaulting to {AUDIO_PROFILE_DEFAULT}")
+        profile = AUDIO_PROFILE_DEFAULT
+    return _stream_convert_to_whisper_chunks(
+        output_file_prefix, input_file_path, input_byte_chunks, segment_seconds, overlap_ms, profile
+    )
+
+
+def _stream_convert_to_whisper_chunks(
+    output_file_prefix: str,
+    input_file_path: Optional[str],
+    input_byte_chunks: Optional[Iterable[bytes]],
+    segment_seconds: int,
+    overlap_ms: int,
+    profile: str,
+) -> Iterator[str]:
+    if input_byte_chunks is not None:
+        head_bytes, input_byte_chunks = _peek_byte_chunks(input_byte_chunks)
+        audio_info = _try_ffprobe_audio_info("pipe:0", input_bytes=head_bytes)
+    else:
+        audio_info = _try_ffprobe_audio_info(input_file_path)
+    remux_format = _pick_remux_format(audio_info, profile)
+    if remux_format is not None:
+        target_format, output_args = remux_format, ["-map", "0:a:0", "-c:a", "copy"]
+        output_profile = AUDIO_PROFILE_REMUX
+        # The copied audio keeps its bit rate, so the segment (with the overlap) has to fit into a Whisper request.
+        if audio_info["bit_rate"] is not None and audio_info["bit_rate"] > 0:
+            max_segment_seconds = int(WHISPER_API_CHUNK_TARGET_FILE_SIZE * 8 / audio_info["bit_rate"])
+            segment_seconds = max(1, min(segment_seconds, max_segment_seconds))
+    else:
+        target_format, profile_args = AUDIO_PROFILES[profile]
+        output_args = ["-vn"] + profile_args
+        output_profile = profile
+
+    segment_filepath_pattern = f"{output_file_prefix}_part_%d.{target_format}"
+    print(f"Starting streaming ffmpeg conversion into {segment_filepath_pattern} with profile {output_profile}")
+    start_time = time.time()
+    work_dir = get_work_dir()
+    feed_errors: List[Exception] = []
 
-    return deal_with_potentially_large_audio_file(output_file_path)
+    # The caller (i.e. the job) fails, so it can be retried, rather than going on with a partial transcript.
+    def _raise_if_feed_failed():
+        if len(feed_errors) > 0:
+            raise feed_errors[0]
+
+    # The previous segment's tail, which gets prepended to the next segment.
+    previous_tail_filepath: Optional[str] = None
+    previous_was_yielded = False
+
+    # Returns the chunk to transcribe made from the completed `segment_filepath`, or None if it is silent.
+    def _to_chunk(segment_number: int, segment_filepath: str, is_last: bool) -> Optional[str]:
+        nonlocal previous_tail_filepath, previous_was_yielded
+        work_dir.track(segment_filepath)
+        with _within_pipeline_slot():
+            tail_filepath = None
+            if not is_last and overlap_ms > 0:
+                tail_filepath = f"{output_file_prefix}_part_{segment_number}_tail.{target_format}"
+                try:
+                    _ffmpeg_copy_tail(segment_filepath, tail_filepath, overlap_ms)
+                    work_dir.track(tail_filepath)
+                except subprocess.CalledProcessError as e:
+                    print(f"WARNING: cannot cut the tail of {segment_filepath}, the next seam has no overlap: {e}")
+                    tail_filepath = None
+
+            chunk_filepath = AudioChunkPath.of(segment_filepath, overlaps_previous=False)
+            if previous_tail_filepath is not None:
+                overlapped_filepath = f"{output_file_prefix}_chunk_{segment_number}.{target_format}"
+                try:
+                    _ffmpeg_concat([previous_tail_filepath, segment_filepath], overlapped_filepath)
+                    work_dir.track(overlapped_filepath)
+                    work_dir.release(segment_filepath)
+                    # The words in a skipped silent chunk were never transcribed, so there is nothing to stitch.
+                    chunk_filepath = AudioChunkPath.of(overlapped_filepath, overlaps_previous=previous_was_yielded)
+                except subprocess.CalledProcessError as e:
+                    print(f"WARNING: cannot prepend the overlap to {segment_filepath}, going without it: {e}")
+                work_dir.release(previous_tail_filepath)
+            previous_tail_filepath = tail_filepath
+
+            # We cannot analyze the whole recording upfront, so at least silent chunks do not go to Whisper.
+            if AUDIO_PRESCREEN_ENABLED == "1":
+                stats = ffmpeg_analyze_audio(chunk_filepath)
+                if stats is not None and stats.is_silent():
+                    print(f"INFO: skipping silent chunk {chunk_filepath} ({stats})")
+                    work_dir.release(chunk_filepath)
+                    previous_was_yielded = False
+                    return None
+        previous_was_yielded = True
+        return chunk_filepath
+
+    # Held for the whole conversion, the chunk cuts above run within it.
+    ffmpeg_process_semaphore.acquire()
+    process = None
+    try:
+        process = subprocess.Popen(
+            ["ffmpeg", "-y", "-loglevel", "warning",
+             "-i", input_file_path if input_file_path is not None else "pipe:0"]
+            + output_args
+            + ["-f", "segment", "-segment_time", str(segment_seconds), "-reset_timestamps", "1",
+               "-segment_start_number", "1", segment_filepath_pattern],
+            stdin=subprocess.PIPE if input_byte_chunks is not None else subprocess.DEVNULL,
+        )
+        if input_byte_chunks is not None:
+            threading.Thread(
+                target=_feed_ffmpeg_stdin,
+                args=(process, input_byte_chunks, feed_errors),
+                name="ffmpeg-feeder",
+                daemon=True,
+            ).start()
+
+        segment_number = 1
+        while True:
+            _raise_if_feed_failed()
+            segment_filepath = segment_filepath_pattern % segment_number
+            # ffmpeg only opens the next segment once the current one is finished.
+            if os.path.exists(segment_filepath_pattern % (segment_number + 1)):
+                print(
+                    f"Segment {segment_number} ready after {round(time.time() - start_time, 2)} seconds: "
+                    f"{segment_filepath}"
+                )
+                chunk_filepath = _to_chunk(segment_number, segment_filepath, is_last=False)
+                if chunk_filepath is not None:
+                    yield chunk_filepath
+                segment_number += 1
+                continue
+            if process.poll() is not None:
+                break
+            time.sleep(PIPELINE_POLL_INTERVAL_SECONDS)
+
+        _raise_if_feed_failed()
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, "ffmpeg streaming conversion")
+        if input_file_path is not None:
+            work_dir.release(input_file_path)
+        last_segment_filepath = segment_filepath_pattern % segment_number
+        if os.path.exists(last_segment_filepath) and os.path.getsize(last_segment_filepath) > 0:
+            chunk_filepath = _to_chunk(segment_number, last_segment_filepath, is_last=True)
+            if chunk_filepath is not None:
+                yield chunk_filepath
+        elif previous_tail_filepath is not None:
+            work_dir.release(previous_tail_filepath)
+        print(
+            f"Streaming conversion finished in {round(time.time() - start_time, 2)} seconds "
+            f"into {segment_number} chunks"
+        )
+    finally:
+        # E.g. the caller stopped iterating (or failed), the ffmpeg process must not outlive us.
+        if process is not None and process.poll() is None:
+            print("Killing the streaming ffmpeg conversion, as the caller stopped early")
+            process.kill()
+        if process is not None:
+            process.wait()
+        ffmpeg_process_semaphore.release()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,160 @@
+import binascii
+import os
+from email.feedparser import BytesFeedParser
+from email.message import Message
+from typing import BinaryIO, Callable, Iterator, List, Optional, Tuple
+
+from app.emails import sanitize_filename
+from common.storage_utils import STREAM_BUFFER_BYTES, pretty_filesize_int
+from common.tmp_storage import get_work_dir
+
+
+# Yields lines including their line endings, reading the stream in fixed-size buffers.
+# NOTE: botocore StreamingBody.iter_lines strips the line endings, which we need for non-base64 attachments.
+def _iter_lines(
+    stream: BinaryIO, buffer_size: int = STREAM_BUFFER_BYTES
+) -> Iterator[bytes]:
+    pending = b""
+    while True:
+        buffer = stream.read(buffer_size)
+        if not buffer:
+            break
+        pending += buffer
+        lines = pending.split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line + b"\n"
+    if pending:
+        yield pending
+
+
+def _parse_headers(lines: Iterator[bytes]) -> Message:
+    parser = BytesFeedParser()
+    for line in lines:
+        parser.feed(line)
+        if line in (b"\n", b"\r\n"):
+            break
+    return parser.close()
+
+
+# Decodes a Content-Transfer-Encoding incrementally, so we never hold the full attachment in memory.
+class _IncrementalDecoder:
+    def __init__(self, transfer_encoding: Optional[str], output_file: BinaryIO):
+        self.transfer_encoding = (transfer_encoding or "7bit").lower()
+        self.output_file = output_file
+        self.pending = b""
+        self.bytes_written = 0
+
+    def _write(self, data: bytes):
+        self.output_file.write(data)
+        self.bytes_written += len(data)
+
+    def feed(self, line: bytes):
+        if self.transfer_encoding == "base64":
+            self.pending += b"".join(line.split())
+            # base64 decodes in 4 character groups, keep the remainder for the next line.
+            decodable_len = len(self.pending) - len(self.pending) % 4
+            self._write(binascii.a2b_base64(self.pending[:decodable_len]))
+            self.pending = self.pending[decodable_len:]
+        elif self.transfer_encoding == "quoted-printable":
+            self._write(binascii.a2b_qp(line))
+        else:
+            # The line ending right before a boundary belongs to the boundary, so we always delay it by one line.
+            self._write(self.pending)
+            content = line.rstrip(b"\r\n")
+            self._write(content)
+            self.pending = line[len(content) :]
+
+    def close(self):
+        if self.transfer_encoding == "base64" and len(self.pending) > 0:
+            # Tolerate missing padding, which some mail clients do.
+            padded = self.pending + b"=" * (-len(self.pending) % 4)
+            try:
+                self._write(binascii.a2b_base64(padded))
+            except binascii.Error as e:
+                print(
+                    f"WARNING: dropping {len(self.pending)} trailing base64 characters: {e}"
+                )
+        self.pending = b""
+
+
+# Streams a raw MIME email from `raw_email_stream`, writing every attachment straight to a file under `output_dir`
+# (defaults to the invocation work dir, where the attachments are tracked for cleanup).
+# Only the top-level headers are kept in memory (that is all get_email_params_for_reply needs),
+# text bodies are skipped and attachments are decoded line-by-line, so peak memory stays flat for any email size.
+# `file_name_prefix_fn` gets the top-level headers, so the prefix can depend on e.g. the Date header.
+def stream_and_store_attachments_from_email(
+    raw_email_stream: BinaryIO,
+    file_name_prefix_fn: Callable[[Message], str],
+    output_dir: Optional[str] = None,
+) -> Tuple[Message, List[str]]:
+    work_dir = get_work_dir()
+    if output_dir is None:
+        output_dir = work_dir.directory
+    lines = _iter_lines(raw_email_stream)
+    top_level_headers = _parse_headers(lines)
+    file_name_prefix = file_name_prefix_fn(top_level_headers)
+
+    attachment_file_paths = []
+    boundaries: List[bytes] = []
+
+    # Returns the (stripped) boundary line which ended the part, or None on end of stream.
+    def _consume_part(part_headers: Message) -> Optional[bytes]:
+        if part_headers.get_content_maintype() == "multipart":
+            boundary = part_headers.get_boundary()
+            if boundary is None:
+                print(
+                    "WARNING: multipart without boundary, skipping the rest of the email"
+                )
+                return _skip_until_boundary(None)
+            boundaries.append(boundary.encode("utf-8"))
+            # Skip the preamble, then consume all sub-parts until the closing boundary.
+            delimiter = _skip_until_boundary(None)
+            while delimiter is not None and not delimiter.endswith(b"--"):
+                delimiter = _consume_part(_parse_headers(lines))
+            boundaries.pop()
+            # Skip the epilogue until the parent boundary.
+            return _skip_until_boundary(None) if len(boundaries) > 0 else None
+
+        # Forwarded emails (as attachment) embed the whole original message, where the voice memo usually is.
+        # RFC 2046 only allows 7bit / 8bit / binary here, so the embedded message is right there in the stream.
+        if part_headers.get_content_type() == "message/rfc822":
+            return _consume_part(_parse_headers(lines))
+
+        orig_file_name = part_headers.get_filename()
+        if part_headers.get("Content-Disposition") is None or not bool(orig_file_name):
+            return _skip_until_boundary(None)
+
+        print(f"Parsing attachment {orig_file_name}")
+        file_name = sanitize_filename(f"{file_name_prefix}-{orig_file_name}")
+        file_path = os.path.join(output_dir, file_name)
+        with open(file_path, "wb") as f:
+            decoder = _IncrementalDecoder(
+                part_headers.get("Content-Transfer-Encoding"), f
+            )
+            delimiter = _skip_until_boundary(decoder)
+            decoder.close()
+        print(
+            f"Stored attachment {file_path} ({pretty_filesize_int(decoder.bytes_written)})"
+        )
+        attachment_file_paths.append(work_dir.track(file_path))
+        return delimiter
+
+    def _skip_until_boundary(decoder: Optional[_IncrementalDecoder]) -> Optional[bytes]:
+        for line in lines:
+            stripped = line.rstrip()
+            if stripped.startswith(b"--") and any(
+                stripped in (b"--" + boundary, b"--" + boundary + b"--")
+                for boundary in boundaries
+            ):
+                return stripped
+            if decoder is not None:
+                decoder.feed(line)
+        return None
+
+    _consume_part(top_level_headers)
+
+    print(
+        f"stream_and_store_attachments_from_email got {len(attachment_file_paths)} total attachments"
+    )
+    return top_level_headers, attachment_file_paths
@@ -1,3 +1,4 @@
+import io
 import os
 import random
 import time
@@ -14,7 +15,7 @@ from input.email import process_email_input
 def process_file(gpt_client: OpenAiClient, file_contents):
     orig_data_entry = process_email_input(
         gpt_client=gpt_client,
-        raw_email=file_contents,
+        raw_email_stream=io.BytesIO(file_contents),
     )
 
     people_entries = process_networking_transcript(
@@ -0,0 +1,17 @@
+create table
+  public.transcription_log (
+    id bigint generated by default as identity not null,
+    created_at timestamp with time zone not null default now(),
+    model text not null,
+    content_hash text not null, -- sha256 of the (converted) audio file bytes
+    audio_fingerprint text null, -- coarse hash of the decoded loudness envelope, survives re-encoding
+    duration_ms bigint null,
+    result text not null,
+    request_time_ms bigint not null,
+    constraint transcription_log_pkey primary key (id),
+    constraint transcription_log_content_hash_model_key UNIQUE (content_hash, model)
+  ) tablespace pg_default;
+
+create index transcription_log_audio_fingerprint_model_idx on public.transcription_log (audio_fingerprint, model);
+
+ALTER TABLE public.transcription_log ENABLE ROW LEVEL SECURITY;
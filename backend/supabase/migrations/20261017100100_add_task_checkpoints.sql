@@ -0,0 +1,2 @@
+-- Outputs of finished workflow steps keyed by the step name, so a retried Lambda skips them.
+ALTER TABLE public.task ADD COLUMN checkpoints jsonb null;
@@ -0,0 +1,9 @@
+-- email_log doubles as an outbox: a row with not_before in the future is scheduled, and is sent (by the dispatcher)
+-- once due. sent_at is null until the email actually went out.
+ALTER TABLE public.email_log ADD COLUMN not_before timestamp with time zone null;
+ALTER TABLE public.email_log ADD COLUMN sent_at timestamp with time zone null;
+
+-- Everything logged so far was logged after sending.
+UPDATE public.email_log SET sent_at = created_at WHERE sent_at IS NULL;
+
+create index email_log_outbox_not_before_idx on public.email_log (not_before) where sent_at is null;
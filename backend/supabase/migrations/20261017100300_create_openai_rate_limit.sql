@@ -0,0 +1,13 @@
+-- Token buckets shared by all Lambda invocations, so they do not compete for the same OpenAI rate limits.
+-- One row per (model, requests | tokens), see common/rate_limiter.py for the reservation logic.
+create table
+  public.openai_rate_limit (
+    bucket_key text not null, -- e.g. "gpt-4o:requests" or "gpt-4o:tokens"
+    capacity double precision not null,
+    refill_per_second double precision not null,
+    available double precision not null, -- goes negative when reserved ahead, i.e. the debt callers wait out
+    updated_at timestamp with time zone not null default now(),
+    constraint openai_rate_limit_pkey primary key (bucket_key)
+  ) tablespace pg_default;
+
+ALTER TABLE public.openai_rate_limit ENABLE ROW LEVEL SECURITY;
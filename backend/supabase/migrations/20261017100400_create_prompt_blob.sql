@@ -0,0 +1,19 @@
+-- Content-addressed, zlib compressed chunks of the prompt_log prompts and results.
+-- The prompts embed whole transcripts, which repeat across the prompts of the same recording,
+-- with content-defined chunking the repeated parts are stored only once.
+create table
+  public.prompt_blob (
+    content_hash text not null, -- sha256 of the uncompressed chunk
+    data bytea not null, -- zlib compressed chunk
+    size_bytes bigint not null, -- uncompressed
+    created_at timestamp with time zone not null default now(),
+    constraint prompt_blob_pkey primary key (content_hash)
+  ) tablespace pg_default;
+
+ALTER TABLE public.prompt_blob ENABLE ROW LEVEL SECURITY;
+
+-- New rows reference their chunks instead of storing the texts inline, the old rows keep their texts.
+ALTER TABLE public.prompt_log ADD COLUMN prompt_chunk_hashes text[] null;
+ALTER TABLE public.prompt_log ADD COLUMN result_chunk_hashes text[] null;
+ALTER TABLE public.prompt_log ALTER COLUMN prompt DROP NOT NULL;
+ALTER TABLE public.prompt_log ALTER COLUMN result DROP NOT NULL;
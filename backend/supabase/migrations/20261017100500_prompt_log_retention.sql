@@ -0,0 +1,14 @@
+-- Retention of the prompt cache, see common/prompt_cache_maintenance.py.
+-- last_hit_at is updated (in batches) on cache hits, null means never hit since created_at.
+ALTER TABLE public.prompt_log ADD COLUMN last_hit_at timestamp with time zone null;
+
+-- Eviction walks the least recently hit rows first.
+create index prompt_log_last_used_idx on public.prompt_log ((coalesce(last_hit_at, created_at)));
+
+-- Orphan prompt_blob garbage collection looks up the referencing rows by a chunk hash.
+create index prompt_log_prompt_chunk_hashes_idx on public.prompt_log using gin (prompt_chunk_hashes);
+create index prompt_log_result_chunk_hashes_idx on public.prompt_log using gin (result_chunk_hashes);
+
+-- Touched whenever a new prompt_log row re-uses the chunk, so the garbage collection does not race with writers.
+ALTER TABLE public.prompt_blob ADD COLUMN referenced_at timestamp with time zone not null default now();
+create index prompt_blob_referenced_at_idx on public.prompt_blob (referenced_at);
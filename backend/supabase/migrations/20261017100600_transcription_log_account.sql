@@ -0,0 +1,8 @@
+-- The audio fingerprint fallback of the transcription cache only matches recordings of the same account.
+ALTER TABLE public.transcription_log ADD COLUMN account_id uuid null;
+ALTER TABLE public.transcription_log
+ADD CONSTRAINT transcription_log_account_id_fkey FOREIGN KEY (account_id) REFERENCES public.account (id) on delete cascade;
+
+drop index if exists public.transcription_log_audio_fingerprint_model_idx;
+create index transcription_log_account_fingerprint_idx
+on public.transcription_log (account_id, audio_fingerprint, duration_ms, model);
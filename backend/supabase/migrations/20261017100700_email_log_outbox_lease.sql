@@ -0,0 +1,5 @@
+-- The outbox dispatcher leases an email (claimed_until) instead of marking it sent before calling SES,
+-- so a crash or timeout in-between only delays the email until the lease is over.
+-- send_attempts caps the retries of emails SES keeps rejecting.
+ALTER TABLE public.email_log ADD COLUMN claimed_until timestamp with time zone null;
+ALTER TABLE public.email_log ADD COLUMN send_attempts integer not null default 0;
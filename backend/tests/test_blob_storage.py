@@ -0,0 +1,45 @@
+import random
+
+from common.blob_storage import CHUNK_MAX_BYTES, CHUNK_MIN_BYTES, split_into_chunks
+
+
+def _random_text(seed: int, word_count: int) -> str:
+    rng = random.Random(seed)
+    words = [
+        "Katka",
+        "Penelope",
+        "marketing",
+        "walk",
+        "Friday",
+        "executive",
+        "reporting",
+        "čaj",
+        "and",
+        "the",
+    ]
+    return " ".join(rng.choice(words) for _ in range(word_count))
+
+
+def test_split_into_chunks_is_lossless_and_bounded():
+    data = _random_text(seed=1, word_count=20000).encode("utf-8")
+    chunks = split_into_chunks(data)
+    assert b"".join(chunks) == data
+    assert len(chunks) > 1
+    assert all(len(chunk) <= CHUNK_MAX_BYTES for chunk in chunks)
+    assert all(len(chunk) >= CHUNK_MIN_BYTES for chunk in chunks[:-1])
+
+    assert split_into_chunks(b"") == [b""]
+    assert split_into_chunks(b"short prompt") == [b"short prompt"]
+
+
+def test_split_into_chunks_dedupes_the_shared_transcript():
+    transcript = _random_text(seed=2, word_count=10000)
+    chunks_a = split_into_chunks(
+        f"Summarize the notes about Katka: {transcript}".encode("utf-8")
+    )
+    chunks_b = split_into_chunks(
+        f"Draft a follow up for Penelope and Ricardo from: {transcript}".encode("utf-8")
+    )
+    # Only the chunks around the different prefix differ.
+    shared = set(chunks_a) & set(chunks_b)
+    assert sum(len(chunk) for chunk in shared) > 0.8 * len(transcript)
@@ -0,0 +1,77 @@
+import threading
+
+import app.contacts_dump as contacts_dump
+from app.contacts_dump import (
+    merge_person_contexts,
+    split_words_into_windows,
+    summarize_and_draft_people,
+)
+from app.datashare import PersonDataEntry
+
+
+def test_split_transcript_into_windows():
+    transcript = " ".join(f"w{i}" for i in range(25))
+    assert split_words_into_windows(
+        transcript, window_word_count=30, overlap_word_count=5
+    ) == [transcript]
+
+    windows = split_words_into_windows(
+        transcript, window_word_count=10, overlap_word_count=3
+    )
+    assert [window.split()[0] for window in windows] == ["w0", "w7", "w14", "w21"]
+    assert windows[-1].split()[-1] == "w24"
+    # No word gets dropped
+    assert set(" ".join(windows).split()) == set(transcript.split())
+
+
+def test_merge_person_contexts():
+    given = merge_person_contexts(
+        [
+            {
+                "Penelope": "Met Penelope, doing executive reporting.",
+                "Katka": "Katka gave me marketing advice.",
+            },
+            {
+                "penelope.": "Met Penelope, doing executive reporting.",
+                "Katka Sabo": [
+                    "Katka Sabo recommended Amy Porterfield.",
+                    "Walk on Friday.",
+                ],
+                "Ricardo": None,
+            },
+        ]
+    )
+    assert given == {
+        "Penelope": "Met Penelope, doing executive reporting.",
+        "Katka Sabo": "Katka Sabo recommended Amy Porterfield. Walk on Friday.\nKatka gave me marketing advice.",
+        "Ricardo": "",
+    }
+
+
+def test_summarize_and_draft_people_hands_over_in_sort_key_order(monkeypatch):
+    person_to_transcript = {
+        "Katka": "Short note.",
+        "Penelope": "The longest note of them all, so she goes first.",
+        "Ricardo": "A medium long note.",
+    }
+    penelope_done = threading.Event()
+
+    def _summarize(gpt_client, name, raw_note, checkpoint_task):
+        # Penelope is the slowest, so the others finish first but still have to wait for her.
+        if name == "Penelope":
+            penelope_done.wait(1)
+        else:
+            penelope_done.set()
+        if name == "Katka":
+            return None
+        return PersonDataEntry(name=name, transcript=raw_note)
+
+    monkeypatch.setattr(contacts_dump, "_summarize_and_draft_person_once", _summarize)
+    ready = []
+
+    people = summarize_and_draft_people(
+        None, person_to_transcript, on_person_ready=lambda p: ready.append(p.name)
+    )
+
+    assert ready == ["Penelope", "Ricardo"]
+    assert [person.name for person in people] == ready
@@ -0,0 +1,27 @@
+import pytest
+
+from app.delivery import DeliveryQueue
+
+
+def test_delivery_queue_keeps_order_and_survives_failures():
+    delivered = []
+
+    def _deliver(item):
+        if item == "Ricardo":
+            raise ValueError("email bounced")
+        delivered.append(item)
+
+    delivery_queue = DeliveryQueue("test", _deliver)
+    for item in ["Penelope", "Ricardo", "Katka"]:
+        delivery_queue.put(item)
+    with pytest.raises(ValueError):
+        delivery_queue.close()
+    assert delivered == ["Penelope", "Katka"]
+    assert delivery_queue.delivered_count == 2
+
+
+def test_delivery_queue_does_not_shadow_producer_errors():
+    with pytest.raises(KeyError):
+        with DeliveryQueue("test", lambda item: 1 / 0) as delivery_queue:
+            delivery_queue.put("Penelope")
+            raise KeyError("summarization failed")
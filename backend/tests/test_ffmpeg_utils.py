@@ -0,0 +1,235 @@
+import os
+import shutil
+import subprocess
+import threading
+
+import pytest
+
+import input.ffmpeg_utils as ffmpeg_utils
+from input.ffmpeg_utils import (
+    AUDIO_PROFILE_DEFAULT,
+    AUDIO_PROFILE_SPEECH,
+    AudioStats,
+    _feed_ffmpeg_stdin,
+    _parse_astats_overall_rms_db,
+    _parse_silencedetect,
+    _pick_remux_format,
+    chunk_overlaps_previous,
+    ffmpeg_stream_convert_to_whisper_chunks,
+    transcription_cache_key,
+)
+
+FFMPEG_STDERR = """
+[silencedetect @ 0x55d0c8a4c2c0] silence_start: 0
+[silencedetect @ 0x55d0c8a4c2c0] silence_end: 12.5 | silence_duration: 12.5
+[silencedetect @ 0x55d0c8a4c2c0] silence_start: 30.2
+[silencedetect @ 0x55d0c8a4c2c0] silence_end: 31.0 | silence_duration: 0.8
+[silencedetect @ 0x55d0c8a4c2c0] silence_start: 50
+[Parsed_astats_1 @ 0x55d0c8a4d100] Channel: 1
+[Parsed_astats_1 @ 0x55d0c8a4d100] RMS level dB: -31.2
+[Parsed_astats_1 @ 0x55d0c8a4d100] Overall
+[Parsed_astats_1 @ 0x55d0c8a4d100] RMS level dB: -29.8
+"""
+
+
+def test_parse_ffmpeg_stats():
+    assert _parse_silencedetect(FFMPEG_STDERR) == [(0, 12500), (30200, 31000)]
+    assert _parse_silencedetect(FFMPEG_STDERR, duration_ms=60000) == [
+        (0, 12500),
+        (30200, 31000),
+        (50000, 60000),
+    ]
+    assert _parse_astats_overall_rms_db(FFMPEG_STDERR) == -29.8
+
+
+def test_audio_stats():
+    stats = AudioStats(
+        duration_ms=60000,
+        rms_db=-29.8,
+        silences=[(0, 12500), (30200, 31000), (50000, 60000)],
+    )
+    assert stats.speech_ms == 36700
+    assert stats.leading_silence_ms == 12500
+    assert stats.trailing_silence_ms == 10000
+    assert not stats.is_silent()
+    assert stats.speech_bounds_ms() == (12000, 50500)
+
+    # Short pauses at the edges are not worth a trim.
+    assert (
+        AudioStats(
+            duration_ms=60000, rms_db=-29.8, silences=[(0, 1000)]
+        ).speech_bounds_ms()
+        is None
+    )
+
+    assert AudioStats(duration_ms=800, rms_db=-20.0, silences=[]).is_silent()
+    assert AudioStats(duration_ms=60000, rms_db=-70.0, silences=[]).is_silent()
+    assert AudioStats(
+        duration_ms=60000, rms_db=-40.0, silences=[(0, 59500)]
+    ).is_silent()
+
+
+def test_pick_remux_format():
+    def _audio_info(codec_name, bit_rate=128000, duration_ms=60 * 60 * 1000):
+        return {
+            "codec_name": codec_name,
+            "bit_rate": bit_rate,
+            "duration_ms": duration_ms,
+        }
+
+    assert _pick_remux_format(_audio_info("aac"), AUDIO_PROFILE_DEFAULT) == "m4a"
+    # One hour of 128kbps AAC is about 58MB, the speech profile gets it into a single Whisper request.
+    assert _pick_remux_format(_audio_info("aac"), AUDIO_PROFILE_SPEECH) is None
+    assert (
+        _pick_remux_format(_audio_info("opus", bit_rate=32000), AUDIO_PROFILE_SPEECH)
+        == "ogg"
+    )
+    assert _pick_remux_format(_audio_info("amr_nb"), AUDIO_PROFILE_DEFAULT) is None
+    # Copying PCM into a wav would be about 10x the size of the AAC re-encode.
+    assert (
+        _pick_remux_format(
+            _audio_info("pcm_s16le", bit_rate=1411200), AUDIO_PROFILE_DEFAULT
+        )
+        is None
+    )
+    # E.g. ffprobe failed.
+    assert _pick_remux_format(None, AUDIO_PROFILE_DEFAULT) is None
+
+
+def test_feed_ffmpeg_stdin_kills_the_process_on_read_errors():
+    def _truncated_download():
+        yield b"first bytes"
+        raise ConnectionResetError("S3 connection reset")
+
+    # Stands in for ffmpeg, which would exit cleanly once its stdin is closed.
+    process = subprocess.Popen(
+        ["cat"], stdin=subprocess.PIPE, stdout=subprocess.DEVNULL
+    )
+    feed_errors = []
+    _feed_ffmpeg_stdin(process, _truncated_download(), feed_errors)
+
+    assert process.wait(timeout=5) != 0
+    assert len(feed_errors) == 1 and isinstance(feed_errors[0], ConnectionResetError)
+
+
+def _generate_wav(file_path: str, duration_seconds: int) -> bytes:
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-y",
+            "-loglevel",
+            "error",
+            "-f",
+            "lavfi",
+            "-i",
+            f"anoisesrc=duration={duration_seconds}:amplitude=0.3",
+            file_path,
+        ],
+        check=True,
+    )
+    with open(file_path, "rb") as handle:
+        return handle.read()
+
+
+def _byte_chunks(data: bytes, chunk_size: int = 64 * 1024):
+    return [data[i : i + chunk_size] for i in range(0, len(data), chunk_size)]
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="needs ffmpeg")
+def test_stream_convert_overlaps_the_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(ffmpeg_utils, "AUDIO_PRESCREEN_ENABLED", "0")
+    data = _generate_wav(str(tmp_path / "memo.wav"), duration_seconds=25)
+
+    chunks = list(
+        ffmpeg_stream_convert_to_whisper_chunks(
+            output_file_prefix=str(tmp_path / "streamed"),
+            input_byte_chunks=_byte_chunks(data),
+            segment_seconds=10,
+            profile=AUDIO_PROFILE_SPEECH,
+        )
+    )
+
+    # Every seam is a hard cut, so every chunk but the first starts with the end of the previous one.
+    assert [chunk_overlaps_previous(chunk) for chunk in chunks] == [False, True, True]
+    assert all(os.path.getsize(chunk) > 0 for chunk in chunks)
+    assert not any(path.endswith("_tail.ogg") for path in os.listdir(tmp_path))
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="needs ffmpeg")
+def test_stream_convert_kills_ffmpeg_when_the_caller_stops(tmp_path, monkeypatch):
+    monkeypatch.setattr(ffmpeg_utils, "AUDIO_PRESCREEN_ENABLED", "0")
+    data = _generate_wav(str(tmp_path / "memo.wav"), duration_seconds=60)
+    processes = []
+    popen = subprocess.Popen
+    monkeypatch.setattr(
+        ffmpeg_utils.subprocess,
+        "Popen",
+        lambda *args, **kwargs: processes.append(popen(*args, **kwargs))
+        or processes[-1],
+    )
+    stalled = threading.Event()
+
+    # The download stalls after the first half, so ffmpeg keeps waiting for more input.
+    def _stalling_download():
+        yield from _byte_chunks(data[: len(data) // 2])
+        stalled.wait(10)
+
+    chunk_iterator = ffmpeg_stream_convert_to_whisper_chunks(
+        output_file_prefix=str(tmp_path / "streamed"),
+        input_byte_chunks=_stalling_download(),
+        segment_seconds=5,
+        profile=AUDIO_PROFILE_SPEECH,
+    )
+    try:
+        assert os.path.getsize(next(chunk_iterator)) > 0
+        chunk_iterator.close()
+        assert processes[-1].returncode is not None
+        # The slot is free again.
+        assert ffmpeg_utils.ffmpeg_process_semaphore.acquire(blocking=False)
+        ffmpeg_utils.ffmpeg_process_semaphore.release()
+    finally:
+        stalled.set()
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="needs ffmpeg")
+def test_transcription_cache_key_is_of_the_decoded_audio(tmp_path):
+    ogg_path, webm_path = str(tmp_path / "memo.ogg"), str(tmp_path / "memo.webm")
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-y",
+            "-loglevel",
+            "error",
+            "-f",
+            "lavfi",
+            "-i",
+            "sine=frequency=300:duration=5",
+            "-c:a",
+            "libopus",
+            ogg_path,
+        ],
+        check=True,
+    )
+    # Same audio, different container and tags.
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-y",
+            "-loglevel",
+            "error",
+            "-i",
+            ogg_path,
+            "-c",
+            "copy",
+            "-metadata",
+            "title=memo",
+            webm_path,
+        ],
+        check=True,
+    )
+
+    assert (
+        transcription_cache_key(ogg_path).content_hash
+        == transcription_cache_key(webm_path).content_hash
+    )
+    assert transcription_cache_key(str(tmp_path / "missing.ogg")) is None
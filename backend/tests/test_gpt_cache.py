@@ -0,0 +1,140 @@
+from gpt_form_filler.openai_client import PromptCacheEntry
+
+from common.gpt_cache import (
+    InMemoryPromptCache,
+    PromptLogWriteBehind,
+    TwoTierCacheStorage,
+)
+from common.gpt_client import _LookedUpCacheStore
+
+
+class FakeDbCache:
+    def __init__(self):
+        self.results = {}
+        self.lookups = 0
+
+    def maybe_get(self, prompt: str, model: str) -> PromptCacheEntry:
+        self.lookups += 1
+        pce = PromptCacheEntry(prompt=prompt, model=model)
+        pce.result = self.results.get((prompt, model))
+        return pce
+
+    def write_cache(self, pce: PromptCacheEntry):
+        self.results[(pce.prompt, pce.model)] = pce.result
+
+
+def _pce(prompt: str, result: str, model: str = "gpt-4o") -> PromptCacheEntry:
+    pce = PromptCacheEntry(prompt=prompt, model=model)
+    pce.result = result
+    return pce
+
+
+def test_in_memory_prompt_cache_evicts_least_recently_used():
+    cache = InMemoryPromptCache(max_entries=2, max_bytes=1000, ttl_seconds=60)
+    cache.put("a", "gpt-4o", _pce("a", "result a"))
+    cache.put("b", "gpt-4o", _pce("b", "result b"))
+    assert cache.get("a", "gpt-4o").result == "result a"
+    cache.put("c", "gpt-4o", _pce("c", "result c"))
+    assert cache.get("b", "gpt-4o") is None
+    assert cache.get("a", "gpt-4o") is not None and cache.get("c", "gpt-4o") is not None
+
+    # Bounded by bytes too
+    cache = InMemoryPromptCache(max_entries=100, max_bytes=20, ttl_seconds=60)
+    cache.put("a", "gpt-4o", _pce("a", "x" * 15))
+    cache.put("b", "gpt-4o", _pce("b", "y" * 15))
+    assert len(cache) == 1 and cache.total_bytes == 15
+
+
+def test_in_memory_prompt_cache_expires():
+    cache = InMemoryPromptCache(max_entries=10, max_bytes=1000, ttl_seconds=-1)
+    cache.put("a", "gpt-4o", _pce("a", "result a"))
+    assert cache.get("a", "gpt-4o") is None
+    assert len(cache) == 0
+
+
+def test_two_tier_cache_storage_serves_repeated_lookups_from_memory():
+    db_cache = FakeDbCache()
+    db_cache.results[("prompt", "gpt-4o")] = "from db"
+    storage = TwoTierCacheStorage(db_cache=db_cache, memory_cache=InMemoryPromptCache())
+
+    assert storage.maybe_get("prompt", "gpt-4o").result == "from db"
+    assert storage.maybe_get("prompt", "gpt-4o").result == "from db"
+    assert db_cache.lookups == 1
+
+    assert storage.maybe_get("other", "gpt-4o").result is None
+    storage.write_cache(_pce("other", "fresh"))
+    assert storage.maybe_get("other", "gpt-4o").result == "fresh"
+    assert db_cache.lookups == 2
+    assert db_cache.results[("other", "gpt-4o")] == "fresh"
+
+
+def test_prompt_log_write_behind_flushes_in_batches():
+    inserted_batches = []
+    write_behind = PromptLogWriteBehind(
+        batch_size=2, interval_seconds=60, insert_rows_fn=inserted_batches.append
+    )
+    write_behind.add({"prompt_hash": "hash-0", "model": "gpt-4o", "result": "result 0"})
+    # Served from the buffer until flushed.
+    assert write_behind.get_pending("hash-0", "gpt-4o")["result"] == "result 0"
+    assert inserted_batches == []
+
+    for i in range(1, 5):
+        write_behind.add(
+            {"prompt_hash": f"hash-{i}", "model": "gpt-4o", "result": f"result {i}"}
+        )
+    write_behind.flush()
+    assert sorted(
+        row["prompt_hash"] for batch in inserted_batches for row in batch
+    ) == [f"hash-{i}" for i in range(5)]
+    assert all(len(batch) <= 2 for batch in inserted_batches)
+    assert write_behind.get_pending("hash-0", "gpt-4o") is None
+    assert write_behind.flush() == 0
+
+
+def test_prompt_log_write_behind_flushes_a_single_row():
+    inserted_batches = []
+    write_behind = PromptLogWriteBehind(
+        batch_size=10, interval_seconds=60, insert_rows_fn=inserted_batches.append
+    )
+    for i in range(3):
+        write_behind.add(
+            {"prompt_hash": f"hash-{i}", "model": "gpt-4o", "result": f"result {i}"}
+        )
+    assert write_behind.flush_row("hash-1", "gpt-4o")
+    assert [[row["prompt_hash"] for row in batch] for batch in inserted_batches] == [
+        ["hash-1"]
+    ]
+    assert write_behind.get_pending("hash-1", "gpt-4o") is None
+    assert not write_behind.flush_row("hash-1", "gpt-4o")
+    # The others stay for the batch.
+    assert write_behind.flush() == 2
+
+
+def test_prompt_log_write_behind_records_hits_once_per_flush():
+    updated_ids = []
+    write_behind = PromptLogWriteBehind(
+        interval_seconds=60,
+        insert_rows_fn=lambda rows: None,
+        update_hits_fn=updated_ids.append,
+    )
+    for prompt_log_id in [3, 1, 3]:
+        write_behind.record_hit(prompt_log_id)
+    write_behind.flush()
+    write_behind.flush()
+
+    assert updated_ids == [[1, 3]]
+
+
+def test_looked_up_cache_store_hands_over_the_lookup_once():
+    db_cache = FakeDbCache()
+    store = _LookedUpCacheStore(db_cache)
+    miss = store.cache_store.maybe_get("prompt", "gpt-4o")
+    store.remember(miss)
+    # The client's own lookup is served from what we already looked up.
+    assert store.maybe_get("prompt", "gpt-4o") is miss
+    assert db_cache.lookups == 1
+    # Only once, and only for the same prompt and model.
+    store.remember(miss)
+    store.maybe_get("prompt", "gpt-4o-mini")
+    store.maybe_get("prompt", "gpt-4o")
+    assert db_cache.lookups == 3
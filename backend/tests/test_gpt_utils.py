@@ -0,0 +1,194 @@
+import threading
+import time
+
+import common.gpt_utils as gpt_utils
+from common.gpt_cache import TranscriptionCacheKey
+from common.gpt_utils import stitch_transcribed_chunks, transcribe_audio_chunk_filepaths
+from input.ffmpeg_utils import AudioChunkPath
+
+
+class FakeWhisperClient:
+    def __init__(self, fail_first_n_per_file: int = 0):
+        self.fail_first_n_per_file = fail_first_n_per_file
+        self.attempts = {}
+        self.lock = threading.Lock()
+
+    def transcribe_audio(
+        self, audio_filepath: str, prompt_hint: str, use_cache_hit: bool
+    ) -> str:
+        with self.lock:
+            self.attempts[audio_filepath] = self.attempts.get(audio_filepath, 0) + 1
+            attempt = self.attempts[audio_filepath]
+        if attempt <= self.fail_first_n_per_file:
+            raise ValueError(f"transient failure for {audio_filepath}")
+        # Earlier chunks take longer, so they finish last.
+        time.sleep(0.05 * (3 - int(audio_filepath.split("_")[-1])))
+        return f"text-{audio_filepath}"
+
+
+def test_transcribe_audio_chunk_filepaths_keeps_order():
+    given = transcribe_audio_chunk_filepaths(
+        FakeWhisperClient(),
+        ["audio_part_0", "audio_part_1", "audio_part_2"],
+        use_cache=False,
+    )
+    assert given == "text-audio_part_0 text-audio_part_1 text-audio_part_2"
+
+
+def test_transcribe_audio_chunk_filepaths_retries(monkeypatch):
+    monkeypatch.setattr(gpt_utils, "TRANSCRIPTION_RETRY_BACKOFF_SECONDS", 0)
+    client = FakeWhisperClient(fail_first_n_per_file=1)
+    given = transcribe_audio_chunk_filepaths(
+        client, ["audio_part_0", "audio_part_1"], use_cache=False
+    )
+    assert given == "text-audio_part_0 text-audio_part_1"
+    assert client.attempts == {"audio_part_0": 2, "audio_part_1": 2}
+
+
+def test_stitch_transcribed_chunks():
+    test_cases = {
+        "no overlap": {
+            "input": ["I met Katka at the cafe.", "She told me about lead magnets."],
+            "output": "I met Katka at the cafe. She told me about lead magnets.",
+        },
+        "overlap with different punctuation": {
+            "input": [
+                "So we agreed to meet on Friday at the usual time",
+                "meet on Friday, at the usual time. And then Ricardo joined.",
+            ],
+            "output": "So we agreed to meet on Friday, at the usual time. And then Ricardo joined.",
+        },
+        "overlap with a garbled first word": {
+            "input": [
+                "He has a weird role, vice president relationship manager",
+                "ent relationship manager at X&Y Bank.",
+            ],
+            # Only two words match which is below the threshold, so nothing gets dropped.
+            "output": "He has a weird role, vice president relationship manager ent relationship manager at X&Y Bank.",
+        },
+        "longer overlap with a garbled first word": {
+            "input": [
+                "She is doing executive reporting which is pretty cool",
+                "ting which is pretty cool. So she is pregnant.",
+            ],
+            "output": "She is doing executive reporting which is pretty cool. So she is pregnant.",
+        },
+        "phrase repeated earlier in the tail": {
+            "input": [
+                "I told him we should meet next week and he said we should meet next week for sure",
+                "we should meet next week for sure. Then we talked about his startup.",
+            ],
+            "output": "I told him we should meet next week and he said we should meet next week for sure. "
+            "Then we talked about his startup.",
+        },
+        "match not reaching the end of the tail": {
+            "input": [
+                "We talked about the new office in Berlin and then about hiring two engineers",
+                "about the new office in Berlin again, she really likes it.",
+            ],
+            "output": "We talked about the new office in Berlin and then about hiring two engineers "
+            "about the new office in Berlin again, she really likes it.",
+        },
+    }
+    for name, test_case in test_cases.items():
+        print(f"test_case: {name}")
+        assert stitch_transcribed_chunks(test_case["input"]) == test_case["output"]
+
+
+def test_stitch_transcribed_chunks_only_at_overlapping_seams():
+    chunks = [
+        "So we agreed to meet on Friday at the usual time",
+        "meet on Friday at the usual time again",
+    ]
+    assert stitch_transcribed_chunks(
+        chunks, overlapping_seams=[False, False]
+    ) == " ".join(chunks)
+    assert (
+        stitch_transcribed_chunks(chunks, overlapping_seams=[False, True])
+        == "So we agreed to meet on Friday at the usual time again"
+    )
+
+
+def test_transcribe_audio_chunk_filepaths_stitches_hard_cuts_only():
+    class EchoClient:
+        def transcribe_audio(
+            self, audio_filepath: str, prompt_hint: str, use_cache_hit: bool
+        ) -> str:
+            return (
+                "one two three four five"
+                if audio_filepath.endswith("0")
+                else "two three four five six"
+            )
+
+    pause_cut = ["audio_part_0", "audio_part_1"]
+    hard_cut = [
+        "audio_part_0",
+        AudioChunkPath.of("audio_part_1", overlaps_previous=True),
+    ]
+    assert (
+        transcribe_audio_chunk_filepaths(EchoClient(), pause_cut, use_cache=False)
+        == "one two three four five two three four five six"
+    )
+    assert (
+        transcribe_audio_chunk_filepaths(EchoClient(), hard_cut, use_cache=False)
+        == "one two three four five six"
+    )
+
+
+def test_transcription_cache_fingerprint_fallback_is_scoped_to_the_account(
+    tmp_path, monkeypatch
+):
+    class FakeTranscriptionCache:
+        def __init__(self):
+            self.fingerprint_lookups = []
+            self.writes = []
+
+        def maybe_get(self, content_hash, model):
+            return None
+
+        def maybe_get_by_fingerprint(
+            self, audio_fingerprint, duration_ms, account_id, model
+        ):
+            self.fingerprint_lookups.append(
+                (audio_fingerprint, duration_ms, account_id)
+            )
+            return "cached transcript" if account_id == "account-a" else None
+
+        def write_cache(self, content_hash, model, result, request_time_ms, **kwargs):
+            self.writes.append(kwargs)
+
+    cache = FakeTranscriptionCache()
+    monkeypatch.setattr(gpt_utils, "transcription_cache", cache)
+    fingerprinted = []
+
+    def _cache_key_fn(filepath):
+        return TranscriptionCacheKey(
+            content_hash="decoded-audio-hash",
+            get_audio_fingerprint=lambda: fingerprinted.append(filepath)
+            or "fingerprint",
+            get_duration_ms=lambda: 61234,
+        )
+
+    filepath = str(tmp_path / "audio_part_1")
+
+    given = gpt_utils.transcribe_audio_chunk_with_cache(
+        None, filepath, cache_key_fn=_cache_key_fn, account_id="account-a"
+    )
+    assert given == "cached transcript"
+    assert cache.fingerprint_lookups == [("fingerprint", 61234, "account-a")]
+    assert cache.writes[0]["duration_ms"] == 61234
+
+    # Without an account only the exact bytes can match.
+    monkeypatch.setattr(
+        gpt_utils,
+        "transcribe_audio_chunk_with_retries",
+        lambda client, path: "fresh transcript",
+    )
+    given = gpt_utils.transcribe_audio_chunk_with_cache(
+        None, filepath, cache_key_fn=_cache_key_fn, account_id=None
+    )
+    assert given == "fresh transcript"
+    assert len(cache.fingerprint_lookups) == 1
+    assert cache.writes[1]["audio_fingerprint"] is None
+    # Not even computed.
+    assert fingerprinted == [filepath]
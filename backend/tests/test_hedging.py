@@ -0,0 +1,138 @@
+import threading
+import uuid
+
+import pytest
+from supawee.client import (
+    connect_to_postgres_i_will_call_disconnect_i_promise,
+    disconnect_from_postgres_as_i_promised,
+)
+
+import common.hedging as hedging_module
+from common.config import POSTGRES_LOGIN_URL_FROM_ENV
+from common.hedging import (
+    LATENCY_MIN_SAMPLES,
+    PATH_HEDGE,
+    PATH_NOT_HEDGED,
+    PATH_PRIMARY,
+    PromptLatencyStats,
+    prompt_tokens_bucket,
+    run_hedged,
+)
+from database.models import BasePromptLog
+
+
+def test_run_hedged_primary_within_deadline():
+    hedge_calls = []
+    result = run_hedged(
+        lambda: "primary", lambda: hedge_calls.append(1) or "hedge", deadline_seconds=1
+    )
+    assert result == ("primary", PATH_PRIMARY)
+    assert hedge_calls == []
+
+
+def test_run_hedged_hedge_wins_over_slow_primary():
+    release_primary = threading.Event()
+
+    def _slow_primary():
+        release_primary.wait(5)
+        return "primary"
+
+    try:
+        assert run_hedged(_slow_primary, lambda: "hedge", deadline_seconds=0.01) == (
+            "hedge",
+            PATH_HEDGE,
+        )
+    finally:
+        release_primary.set()
+
+
+def test_run_hedged_falls_back_to_primary_when_hedge_fails():
+    def _primary():
+        threading.Event().wait(0.1)
+        return "primary"
+
+    def _failing_hedge():
+        raise ValueError("rate limited")
+
+    assert run_hedged(_primary, _failing_hedge, deadline_seconds=0.01) == (
+        "primary",
+        PATH_PRIMARY,
+    )
+
+
+def test_run_hedged_without_deadline():
+    assert run_hedged(lambda: "primary", lambda: "hedge", deadline_seconds=None) == (
+        "primary",
+        PATH_NOT_HEDGED,
+    )
+
+    def _failing():
+        raise ValueError("gpt is down")
+
+    with pytest.raises(ValueError):
+        run_hedged(_failing, lambda: "hedge", deadline_seconds=None)
+
+
+def test_prompt_tokens_bucket():
+    assert prompt_tokens_bucket(0) == (0, 1000)
+    assert prompt_tokens_bucket(999) == (0, 1000)
+    assert prompt_tokens_bucket(1000) == (1000, 4000)
+    assert prompt_tokens_bucket(100_000) == (64000, None)
+
+
+def test_run_hedged_without_free_slots_does_not_hedge(monkeypatch):
+    monkeypatch.setattr(hedging_module, "_hedge_slots", threading.BoundedSemaphore(1))
+    release_primary = threading.Event()
+
+    def _slow_primary():
+        release_primary.wait(5)
+        return "primary"
+
+    try:
+        assert run_hedged(_slow_primary, lambda: "hedge", deadline_seconds=0.01) == (
+            "hedge",
+            PATH_HEDGE,
+        )
+        # The loser still runs, so its slot is still taken.
+        assert run_hedged(
+            lambda: "primary", lambda: "hedge", deadline_seconds=0.01
+        ) == ("primary", PATH_NOT_HEDGED)
+    finally:
+        release_primary.set()
+    # Freed once the loser finished.
+    assert hedging_module._hedge_slots.acquire(timeout=5)
+
+
+@pytest.mark.skipif(
+    not POSTGRES_LOGIN_URL_FROM_ENV, reason="needs a database with the prompt_log table"
+)
+def test_prompt_latency_stats_deadline_per_prompt_size():
+    connect_to_postgres_i_will_call_disconnect_i_promise(POSTGRES_LOGIN_URL_FROM_ENV)
+    model = f"test-{uuid.uuid4()}"
+    try:
+        rows = [
+            {
+                "model": model,
+                "prompt_hash": f"small-{i}",
+                "prompt_tokens": 500,
+                "request_time_ms": 6000,
+            }
+            for i in range(LATENCY_MIN_SAMPLES)
+        ] + [
+            {
+                "model": model,
+                "prompt_hash": f"big-{i}",
+                "prompt_tokens": 20000,
+                "request_time_ms": 60000,
+            }
+            for i in range(LATENCY_MIN_SAMPLES)
+        ]
+        BasePromptLog.insert_many(rows).execute()
+        latency_stats = PromptLatencyStats()
+        assert latency_stats.get_deadline_seconds(model, 300) == pytest.approx(6)
+        assert latency_stats.get_deadline_seconds(model, 30000) == pytest.approx(60)
+        # Too few samples, so we do not hedge.
+        assert latency_stats.get_deadline_seconds(model, 100_000) is None
+    finally:
+        BasePromptLog.delete().where(BasePromptLog.model == model).execute()
+        disconnect_from_postgres_as_i_promised()
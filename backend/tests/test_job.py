@@ -0,0 +1,105 @@
+import threading
+import time
+
+import pytest
+
+from app.job import Job, Step
+
+
+class FakeTask:
+    def __init__(self, checkpoints=None):
+        self.checkpoints = checkpoints or {}
+
+    def get_checkpoint(self, step_name):
+        if step_name not in self.checkpoints:
+            return False, None
+        return True, self.checkpoints[step_name]
+
+    def set_checkpoint(self, step_name, output):
+        self.checkpoints[step_name] = output
+
+
+def test_job_runs_independent_steps_in_parallel():
+    both_started = threading.Barrier(2, timeout=5)
+
+    def _independent(value):
+        # Would time out if the two steps ran one after another.
+        both_started.wait()
+        return value
+
+    job = Job(
+        "test",
+        [
+            Step("generic_reply", lambda _: _independent("reply")),
+            Step("extract_people", lambda _: _independent({"Katka": "walk on Friday"})),
+            Step(
+                "email",
+                lambda inputs: f"{inputs['generic_reply']} for {list(inputs['extract_people'].keys())}",
+                depends_on=["generic_reply", "extract_people"],
+            ),
+        ],
+    )
+    assert job.run()["email"] == "reply for ['Katka']"
+
+
+def test_job_skips_checkpointed_steps():
+    calls = []
+
+    def _step(name):
+        calls.append(name)
+        return name
+
+    task = FakeTask(checkpoints={"first": "from checkpoint"})
+    job = Job(
+        "test",
+        [
+            Step("first", lambda _: _step("first")),
+            Step(
+                "second",
+                lambda inputs: _step(inputs["first"] + " + second"),
+                depends_on=["first"],
+            ),
+            Step(
+                "not_checkpointed",
+                lambda _: _step("not_checkpointed"),
+                checkpoint=False,
+            ),
+        ],
+        task=task,
+    )
+    outputs = job.run()
+    assert outputs["second"] == "from checkpoint + second"
+    assert sorted(calls) == ["from checkpoint + second", "not_checkpointed"]
+    assert task.checkpoints == {
+        "first": "from checkpoint",
+        "second": "from checkpoint + second",
+    }
+
+
+def test_job_stops_on_failure():
+    def _fail(_):
+        time.sleep(0.01)
+        raise ValueError("gpt is down")
+
+    job = Job(
+        "test",
+        [
+            Step("failing", _fail),
+            Step("dependent", lambda _: "never", depends_on=["failing"]),
+        ],
+        task=FakeTask(),
+    )
+    with pytest.raises(ValueError):
+        job.run()
+    assert job.task.checkpoints == {}
+
+
+def test_job_rejects_cycles():
+    with pytest.raises(ValueError):
+        Job(
+            "test",
+            [
+                Step("a", lambda _: 1, depends_on=["b"]),
+                Step("b", lambda _: 2, depends_on=["a"]),
+            ],
+        )
@@ -0,0 +1,89 @@
+import io
+import os
+from email import message_from_bytes
+from email.mime.application import MIMEApplication
+from email.mime.message import MIMEMessage
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from input.mime_stream import stream_and_store_attachments_from_email
+
+
+def _expected_attachments(raw_email: bytes):
+    msg = message_from_bytes(raw_email)
+    return [part.get_payload(decode=True) for part in msg.walk() if part.get_filename()]
+
+
+def test_stream_and_store_attachments_from_email(tmp_path):
+    with open("testdata/boomergpt-mail-email", "rb") as handle:
+        raw_email = handle.read()
+
+    headers, attachment_file_paths = stream_and_store_attachments_from_email(
+        io.BytesIO(raw_email),
+        file_name_prefix_fn=lambda h: "prefix",
+        output_dir=str(tmp_path),
+    )
+    assert headers["Subject"] == "Lets see if generic works"
+    assert [os.path.basename(path) for path in attachment_file_paths] == [
+        "prefix-New_boomermail_32.m4a"
+    ]
+    given = [open(path, "rb").read() for path in attachment_file_paths]
+    assert given == _expected_attachments(raw_email)
+
+
+def test_stream_and_store_attachments_from_email_nested_multipart(tmp_path):
+    msg = MIMEMultipart("mixed")
+    msg["Subject"] = "Two voice memos"
+    body = MIMEMultipart("alternative")
+    body.attach(MIMEText("plain body", "plain"))
+    body.attach(MIMEText("<b>html body</b>", "html"))
+    msg.attach(body)
+    text_attachment = MIMEText("line one\nline two\n", "plain", "utf-8")
+    text_attachment.add_header(
+        "Content-Disposition", "attachment", filename="notes.txt"
+    )
+    msg.attach(text_attachment)
+    binary_attachment = MIMEApplication(os.urandom(10000))
+    binary_attachment.add_header(
+        "Content-Disposition", "attachment", filename="memo.m4a"
+    )
+    msg.attach(binary_attachment)
+    raw_email = msg.as_bytes()
+
+    _, attachment_file_paths = stream_and_store_attachments_from_email(
+        io.BytesIO(raw_email),
+        file_name_prefix_fn=lambda h: "prefix",
+        output_dir=str(tmp_path),
+    )
+    given = [open(path, "rb").read() for path in attachment_file_paths]
+    assert given == _expected_attachments(raw_email)
+
+
+def test_stream_and_store_attachments_from_email_forwarded_as_attachment(tmp_path):
+    original = MIMEMultipart("mixed")
+    original["Subject"] = "Voice memo from the conference"
+    original.attach(MIMEText("see the attached memo", "plain"))
+    memo = MIMEApplication(os.urandom(10000))
+    memo.add_header("Content-Disposition", "attachment", filename="memo.m4a")
+    original.attach(memo)
+
+    msg = MIMEMultipart("mixed")
+    msg["Subject"] = "Fwd: Voice memo from the conference"
+    msg.attach(MIMEText("forwarding this one", "plain"))
+    forwarded = MIMEMessage(original)
+    forwarded.add_header("Content-Disposition", "attachment", filename="forwarded.eml")
+    msg.attach(forwarded)
+    msg.attach(MIMEText("trailing signature", "plain"))
+    raw_email = msg.as_bytes()
+
+    headers, attachment_file_paths = stream_and_store_attachments_from_email(
+        io.BytesIO(raw_email),
+        file_name_prefix_fn=lambda h: "prefix",
+        output_dir=str(tmp_path),
+    )
+    assert headers["Subject"] == "Fwd: Voice memo from the conference"
+    assert [os.path.basename(path) for path in attachment_file_paths] == [
+        "prefix-memo.m4a"
+    ]
+    given = [open(path, "rb").read() for path in attachment_file_paths]
+    assert given == [memo.get_payload(decode=True)]
@@ -0,0 +1,127 @@
+import datetime
+import gzip
+import json
+import os
+from types import SimpleNamespace
+
+from common import prompt_cache_maintenance
+from common.prompt_cache_maintenance import archive_rows
+
+
+def _prompt_log_row(row_id: int) -> SimpleNamespace:
+    return SimpleNamespace(
+        id=row_id,
+        created_at=datetime.datetime(2026, 1, 1),
+        last_hit_at=None,
+        model="gpt-4o",
+        prompt_hash=f"hash-{row_id}",
+        prompt=f"prompt {row_id} ž",
+        result=f"result {row_id}",
+        prompt_chunk_hashes=None,
+        result_chunk_hashes=None,
+        prompt_tokens=10,
+        completion_tokens=5,
+        request_time_ms=100,
+    )
+
+
+def test_archive_rows_writes_gzipped_json_lines(tmp_path, monkeypatch):
+    monkeypatch.delenv("AWS_LAMBDA_FUNCTION_NAME", raising=False)
+    monkeypatch.delenv("AWS_EXECUTION_ENV", raising=False)
+    monkeypatch.setattr(
+        prompt_cache_maintenance, "PROMPT_CACHE_ARCHIVE_LOCAL_DIR", str(tmp_path)
+    )
+
+    file_path = archive_rows([_prompt_log_row(1), _prompt_log_row(2)], reason="age")
+
+    assert os.path.dirname(file_path) == str(tmp_path)
+    with gzip.open(file_path, "rt", encoding="utf-8") as file_handle:
+        archived = [json.loads(line) for line in file_handle]
+    assert [row["id"] for row in archived] == [1, 2]
+    assert archived[0]["prompt"] == "prompt 1 ž"
+    assert archived[1]["result"] == "result 2"
+
+
+def test_archive_rows_tolerates_missing_chunks(tmp_path, monkeypatch):
+    monkeypatch.delenv("AWS_LAMBDA_FUNCTION_NAME", raising=False)
+    monkeypatch.delenv("AWS_EXECUTION_ENV", raising=False)
+    monkeypatch.setattr(
+        prompt_cache_maintenance, "PROMPT_CACHE_ARCHIVE_LOCAL_DIR", str(tmp_path)
+    )
+    chunks = {"p1": "prompt 1", "r1": "result 1", "r2": "result 2"}
+
+    def _load_texts(chunk_hashes_per_text):
+        missing = [
+            h for hashes in chunk_hashes_per_text for h in hashes if h not in chunks
+        ]
+        if len(missing) > 0:
+            raise ValueError(
+                f"prompt_blob is missing {len(missing)} chunks, e.g. {missing[0]}"
+            )
+        return ["".join(chunks[h] for h in hashes) for hashes in chunk_hashes_per_text]
+
+    monkeypatch.setattr(prompt_cache_maintenance, "load_texts", _load_texts)
+    rows = [_prompt_log_row(1), _prompt_log_row(2)]
+    for row_id, row in enumerate(rows, start=1):
+        row.prompt, row.result = None, None
+        row.prompt_chunk_hashes, row.result_chunk_hashes = [f"p{row_id}"], [
+            f"r{row_id}"
+        ]
+
+    file_path = archive_rows(rows, reason="size")
+
+    with gzip.open(file_path, "rt", encoding="utf-8") as file_handle:
+        archived = [json.loads(line) for line in file_handle]
+    assert [(row["prompt"], row["result"]) for row in archived] == [
+        ("prompt 1", "result 1"),
+        (None, "result 2"),
+    ]
+
+
+def test_evict_by_size_stops_when_a_batch_frees_nothing(monkeypatch):
+    # The chunks of the evicted rows are still within the GC grace period, so the total never goes down.
+    rows = [_prompt_log_row(row_id) for row_id in range(1, 11)]
+    evicted = []
+    monkeypatch.setattr(
+        prompt_cache_maintenance,
+        "get_prompt_cache_total_bytes",
+        lambda: 3 * 1024 * 1024,
+    )
+    monkeypatch.setattr(
+        prompt_cache_maintenance,
+        "_select_least_recently_used",
+        lambda limit: rows[len(evicted) : len(evicted) + limit],
+    )
+    monkeypatch.setattr(
+        prompt_cache_maintenance,
+        "_evict",
+        lambda batch, reason: evicted.extend(batch) or len(batch),
+    )
+    monkeypatch.setattr(prompt_cache_maintenance, "garbage_collect_blobs", lambda: 0)
+
+    assert prompt_cache_maintenance.evict_by_size(max_total_mb=1, batch_size=2) == 2
+    assert [row.id for row in evicted] == [1, 2]
+
+
+def test_evict_by_size_measures_the_total_after_each_batch(monkeypatch):
+    rows = [_prompt_log_row(row_id) for row_id in range(1, 11)]
+    evicted = []
+    monkeypatch.setattr(
+        prompt_cache_maintenance,
+        "get_prompt_cache_total_bytes",
+        lambda: (5 - len(evicted) // 2) * 1024 * 1024,
+    )
+    monkeypatch.setattr(
+        prompt_cache_maintenance,
+        "_select_least_recently_used",
+        lambda limit: rows[len(evicted) : len(evicted) + limit],
+    )
+    monkeypatch.setattr(
+        prompt_cache_maintenance,
+        "_evict",
+        lambda batch, reason: evicted.extend(batch) or len(batch),
+    )
+    monkeypatch.setattr(prompt_cache_maintenance, "garbage_collect_blobs", lambda: 0)
+
+    # Every batch frees 1MB, 5MB -> 2MB takes three batches.
+    assert prompt_cache_maintenance.evict_by_size(max_total_mb=2, batch_size=2) == 6
@@ -0,0 +1,140 @@
+import threading
+import uuid
+
+import pytest
+from supawee.client import (
+    connect_to_postgres_i_will_call_disconnect_i_promise,
+    disconnect_from_postgres_as_i_promised,
+)
+
+import common.rate_limiter as rate_limiter_module
+from common.config import POSTGRES_LOGIN_URL_FROM_ENV
+from common.rate_limiter import (
+    FairSlots,
+    InMemoryTokenBucketStore,
+    OpenAiRateLimiter,
+    PostgresTokenBucketStore,
+    get_rate_limit,
+    in_rate_limited_call,
+)
+
+
+def test_get_rate_limit_matches_longest_prefix():
+    assert get_rate_limit("gpt-4o-mini-2024-07-18") == (5000, 2_000_000)
+    assert get_rate_limit("gpt-4o-2024-08-06") == (5000, 800_000)
+    assert get_rate_limit("whisper-1") == (500, None)
+
+
+def test_token_bucket_reservations_queue_up():
+    store = InMemoryTokenBucketStore()
+    # Full bucket of 10, refills 1 per second.
+    assert store.reserve([("model:tokens", 10, 1, 6)]) == [4]
+    # Goes into debt, i.e. the caller waits until refilled instead of retrying.
+    [available] = store.reserve([("model:tokens", 10, 1, 6)])
+    assert -2 <= available < -1.9
+
+
+def test_rate_limiter_waits_for_the_most_limiting_bucket(monkeypatch):
+    # 60 requests and 600 tokens per minute, i.e. 1 request and 10 tokens per second.
+    monkeypatch.setattr(
+        rate_limiter_module, "OPENAI_RATE_LIMITS", {"test-model": (60, 600)}
+    )
+    rate_limiter = OpenAiRateLimiter(
+        bucket_store=InMemoryTokenBucketStore(), utilization=1.0
+    )
+    assert rate_limiter.reserve("test-model", 500) == 0
+    # Only 100 tokens left, 200 more needed, refilled in 20 seconds.
+    assert 19.9 < rate_limiter.reserve("test-model", 300) <= 20
+
+
+def test_rate_limiter_caps_in_flight_requests():
+    rate_limiter = OpenAiRateLimiter(
+        bucket_store=InMemoryTokenBucketStore(), max_concurrent_requests=2
+    )
+    in_flight = []
+    max_in_flight = []
+    lock = threading.Lock()
+
+    def _call():
+        with rate_limiter.limit("gpt-4o-mini", 10):
+            with lock:
+                in_flight.append(1)
+                max_in_flight.append(len(in_flight))
+            threading.Event().wait(0.01)
+            with lock:
+                in_flight.pop()
+
+    threads = [threading.Thread(target=_call) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max(max_in_flight) <= 2
+
+
+def test_rate_limiter_nested_calls_take_one_slot():
+    bucket_store = InMemoryTokenBucketStore()
+    rate_limiter = OpenAiRateLimiter(
+        bucket_store=bucket_store, max_concurrent_requests=1, utilization=1.0
+    )
+    # E.g. fill_in_form calling run_prompt, with a single slot the nested call would block forever.
+    with rate_limiter.limit("gpt-4o-mini", 10):
+        with rate_limiter.limit("gpt-4o-mini", 10):
+            assert in_rate_limited_call()
+        assert in_rate_limited_call()
+    assert not in_rate_limited_call()
+    # Only the outer call reserved, and its slot is free again.
+    [requests_available] = bucket_store.reserve(
+        [("gpt-4o-mini:requests", 5000, 5000 / 60, 0)]
+    )
+    assert 4998.9 < requests_available < 4999.5
+    assert rate_limiter.request_slots.acquire(blocking=False)
+
+
+def test_fair_slots_take_turns_across_accounts():
+    slots = FairSlots(1)
+    assert slots.acquire()
+    big_account, small_account = uuid.uuid4(), uuid.uuid4()
+    served = []
+    threads = []
+
+    def _call(account_id):
+        slots.acquire(account_id)
+        served.append(account_id)
+        slots.release()
+
+    # The big recording queues up three requests before the small one comes in.
+    for account_id in [big_account, big_account, big_account, small_account]:
+        queued = sum(len(waiting) for waiting in slots.waiting.values())
+        threads.append(threading.Thread(target=_call, args=(account_id,)))
+        threads[-1].start()
+        while sum(len(waiting) for waiting in slots.waiting.values()) == queued:
+            threading.Event().wait(0.001)
+    slots.release()
+    for thread in threads:
+        thread.join()
+
+    assert served == [big_account, small_account, big_account, big_account]
+    assert slots.acquire(blocking=False)
+
+
+@pytest.mark.skipif(
+    not POSTGRES_LOGIN_URL_FROM_ENV,
+    reason="needs a database with the openai_rate_limit table",
+)
+def test_postgres_token_bucket_store_reserves_across_callers():
+    connect_to_postgres_i_will_call_disconnect_i_promise(POSTGRES_LOGIN_URL_FROM_ENV)
+    try:
+        bucket_key = f"test-{uuid.uuid4()}"
+        store = PostgresTokenBucketStore()
+        # Full bucket of 10, refills 1 per second.
+        [available] = store.reserve([(f"{bucket_key}:tokens", 10, 1, 6)])
+        assert available == pytest.approx(4)
+        # A second caller sees the first reservation, and goes into debt.
+        [requests_available, tokens_available] = store.reserve(
+            [(f"{bucket_key}:requests", 5, 1, 1), (f"{bucket_key}:tokens", 10, 1, 6)]
+        )
+        assert requests_available == pytest.approx(4)
+        assert -2 <= tokens_available < -1.9
+    finally:
+        disconnect_from_postgres_as_i_promised()
@@ -0,0 +1,105 @@
+import threading
+from typing import Optional, Tuple
+
+import pytest
+
+from common.single_flight import SingleFlight
+
+
+class FakeLock:
+    def __init__(self, waits_for: Optional[str] = None):
+        self.events = []
+        self.waits_for = waits_for
+
+    def acquire(self, key: str) -> Tuple[bool, bool]:
+        self.events.append(f"acquire {key}")
+        return True, key == self.waits_for
+
+    def release(self, key: str):
+        self.events.append(f"release {key}")
+
+
+def test_single_flight_runs_concurrent_identical_calls_once():
+    single_flight = SingleFlight()
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def _slow_prompt():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "result"
+
+    results = []
+    leader = threading.Thread(
+        target=lambda: results.append(single_flight.run("key", _slow_prompt))
+    )
+    leader.start()
+    started.wait(5)
+    followers = [
+        threading.Thread(
+            target=lambda: results.append(single_flight.run("key", _slow_prompt))
+        )
+        for _ in range(3)
+    ]
+    for follower in followers:
+        follower.start()
+    # Let the followers get to the in-flight future.
+    threading.Event().wait(0.1)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join()
+
+    assert results == ["result"] * 4
+    assert len(calls) == 1
+    assert single_flight.in_flight == {}
+
+
+def test_single_flight_flushes_before_releasing_the_cross_process_lock():
+    lock = FakeLock()
+    single_flight = SingleFlight(cross_process_lock=lock)
+    assert (
+        single_flight.run(
+            "key",
+            lambda: "result",
+            before_release=lambda: lock.events.append("flush key"),
+        )
+        == "result"
+    )
+    assert lock.events == ["acquire key", "flush key", "release key"]
+
+    def _failing():
+        raise ValueError("gpt is down")
+
+    with pytest.raises(ValueError):
+        single_flight.run(
+            "other", _failing, before_release=lambda: lock.events.append("flush other")
+        )
+    assert lock.events[-2] == "flush other"
+    assert lock.events[-1] == "release other"
+    # Not stuck, the next call runs again.
+    assert single_flight.run("other", lambda: "second try") == "second try"
+
+
+def test_single_flight_looks_up_again_only_after_waiting():
+    lock = FakeLock(waits_for="waited")
+    single_flight = SingleFlight(cross_process_lock=lock)
+    lookups = []
+
+    def _lookup():
+        lookups.append(1)
+        return "cached by the other process"
+
+    assert single_flight.run("key", lambda: "result", after_waiting=_lookup) == "result"
+    assert lookups == []
+    assert (
+        single_flight.run("waited", lambda: "result", after_waiting=_lookup)
+        == "cached by the other process"
+    )
+    assert lookups == [1]
+    # Still not cached, so we run it ourselves.
+    assert (
+        single_flight.run("waited", lambda: "result", after_waiting=lambda: None)
+        == "result"
+    )
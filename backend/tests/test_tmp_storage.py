@@ -0,0 +1,64 @@
+import os
+
+import pytest
+
+import common.tmp_storage as tmp_storage
+from common.tmp_storage import ConvertedAudioCache, WorkDir
+
+
+def _write(file_path: str, size: int) -> str:
+    with open(file_path, "wb") as f:
+        f.write(b"x" * size)
+    return file_path
+
+
+def test_work_dir_release_and_cleanup(tmp_path):
+    work_dir = WorkDir(str(tmp_path / "invocation"), budget_bytes=1024)
+    first = work_dir.track(_write(work_dir.path("first.ogg"), 100))
+    second = work_dir.track(_write(work_dir.path("second.ogg"), 200))
+    untracked = _write(str(tmp_path / "input.m4a"), 10)
+    assert work_dir.used_bytes() == 300
+
+    work_dir.release(first)
+    work_dir.release(untracked)
+    assert not os.path.exists(first)
+    assert os.path.exists(untracked)
+    assert work_dir.used_bytes() == 200
+
+    work_dir.cleanup()
+    assert not os.path.exists(second)
+    assert not os.path.exists(work_dir.directory)
+
+
+def test_converted_audio_cache_survives_release_and_evicts(tmp_path):
+    work_dir = WorkDir(str(tmp_path / "invocation"), budget_bytes=1024)
+    cache = ConvertedAudioCache(str(tmp_path / "cache"), max_bytes=250)
+
+    converted = work_dir.track(_write(work_dir.path("a.ogg"), 100))
+    cache.put("a", "ogg", converted)
+    work_dir.release(converted)
+    assert cache.maybe_get("a", "ogg", work_dir.path("a-again.ogg"))
+    assert os.path.getsize(work_dir.path("a-again.ogg")) == 100
+
+    cache.put("b", "ogg", _write(work_dir.path("b.ogg"), 100))
+    os.utime(cache._entry_path("a", "ogg"))  # "a" is now the most recently used
+    cache.put("c", "ogg", _write(work_dir.path("c.ogg"), 100))
+    assert cache.maybe_get("a", "ogg", work_dir.path("a-3.ogg"))
+    assert not cache.maybe_get("b", "ogg", work_dir.path("b-2.ogg"))
+    assert not cache.maybe_get("missing", "ogg", work_dir.path("missing.ogg"))
+
+
+def test_work_dir_enforces_the_budget(tmp_path, monkeypatch):
+    cache = ConvertedAudioCache(str(tmp_path / "cache"), max_bytes=1024)
+    monkeypatch.setattr(tmp_storage, "converted_audio_cache", cache)
+    work_dir = WorkDir(str(tmp_path / "invocation"), budget_bytes=500)
+    cache.put("old", "ogg", _write(str(tmp_path / "old.ogg"), 300))
+
+    # The cache makes room for our files.
+    work_dir.track(_write(work_dir.path("first.ogg"), 300))
+    assert not cache.maybe_get("old", "ogg", work_dir.path("old-again.ogg"))
+
+    with pytest.raises(OSError):
+        work_dir.track(_write(work_dir.path("second.ogg"), 300))
+    work_dir.cleanup()
+    assert not os.path.exists(work_dir.directory)
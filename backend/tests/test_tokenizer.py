@@ -0,0 +1,46 @@
+from collections import OrderedDict
+
+import common.tokenizer as tokenizer
+from common.tokenizer import count_tokens, pack_into_batches, poor_mans_token_counter
+
+
+def test_pack_into_batches():
+    people = ["Penelope", "Ricardo", "Katka", "real estate guy"]
+    assert pack_into_batches(people, [100, 100, 100, 100], max_batch_tokens=1000) == [
+        people
+    ]
+    assert pack_into_batches(people, [400, 400, 400, 400], max_batch_tokens=1000) == [
+        ["Penelope", "Ricardo"],
+        ["Katka", "real estate guy"],
+    ]
+    # Items over the budget still get processed, just on their own.
+    assert pack_into_batches(people, [1500, 100, 100, 100], max_batch_tokens=1000) == [
+        ["Penelope"],
+        ["Ricardo", "Katka", "real estate guy"],
+    ]
+    assert pack_into_batches(
+        people, [1, 1, 1, 1], max_batch_tokens=1000, max_batch_size=3
+    ) == [
+        ["Penelope", "Ricardo", "Katka"],
+        ["real estate guy"],
+    ]
+
+
+def test_poor_mans_token_counter():
+    assert poor_mans_token_counter("") == 0
+    assert (
+        5 <= poor_mans_token_counter("Okay, I just talked to Katka, Katka Sabo.") <= 15
+    )
+
+
+def test_count_tokens_caches_by_digest(monkeypatch):
+    monkeypatch.setattr(tokenizer, "COUNT_TOKENS_CACHE_SIZE", 2)
+    monkeypatch.setattr(tokenizer, "_token_counts", OrderedDict())
+    transcript = "Okay, I just talked to Katka, Katka Sabo. " * 1000
+
+    assert count_tokens(transcript) == count_tokens(transcript) > 0
+    # Only the digest is kept, not the transcript itself.
+    assert all(len(key) == 16 for key in tokenizer._token_counts)
+    count_tokens("Penelope")
+    count_tokens("Ricardo")
+    assert len(tokenizer._token_counts) == 2